@@ -82,12 +82,128 @@ WSGI_APPLICATION = 'Bookkeeping.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# The database is chosen with the environment variable BOOKKEEPING_DATABASE: 'sqlite' keeps everything in a local
+# file, 'postgresql' connects to the server in the variables BOOKKEEPING_DATABASE_NAME, _USER, _PASSWORD, _HOST and
+# _PORT, and needs the packages in requirements/postgresql.txt. The fastest way to load, export and sum transactions
+# on the chosen database is picked automatically, see common.database.
 DB_FILE = os.path.join(BASE_DIR, 'tmp', 'db.sqlite3')
+DATABASE_BACKENDS = {
+    'sqlite': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DB_FILE,
+    },
+    'postgresql': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('BOOKKEEPING_DATABASE_NAME', 'bookkeeping'),
+        'USER': os.environ.get('BOOKKEEPING_DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('BOOKKEEPING_DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('BOOKKEEPING_DATABASE_HOST', ''),
+        'PORT': os.environ.get('BOOKKEEPING_DATABASE_PORT', ''),
+        # The ledger export reads its rows with a server-side cursor, which does not work behind a connection pooler
+        # in transaction mode, e.g. PgBouncer
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('BOOKKEEPING_DATABASE_POOLED', '') == 'true',
+    },
+}
+database_backend = os.environ.get('BOOKKEEPING_DATABASE', 'sqlite')
+if database_backend not in DATABASE_BACKENDS:
+    raise ImproperlyConfigured('BOOKKEEPING_DATABASE must be one of {}'.format(', '.join(DATABASE_BACKENDS)))
 DATABASES = {
+    'default': DATABASE_BACKENDS[database_backend],
+}
+
+# Every new SQLite connection is tuned with the pragmas of a database profile, see common.database. The profile is
+# chosen with the environment variable BOOKKEEPING_DATABASE_PROFILE. Both profiles use write-ahead logging, so readers
+# are not blocked by a running import, and wait up to busy_timeout milliseconds for a lock instead of failing.
+# 'durable' syncs every commit to disk. 'bulk_load' only syncs at checkpoints and uses more memory: an import is
+# faster, and a power failure can lose the last commits, but never corrupts the database.
+DATABASE_PROFILES = {
+    'durable': {
+        'journal_mode': 'wal',
+        'synchronous': 'full',
+        'cache_size': -64 * 1024,  # In KiB, since it is negative
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'memory',
+        'busy_timeout': 5000,
+    },
+    'bulk_load': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -512 * 1024,
+        'mmap_size': 1024 * 1024 * 1024,
+        'temp_store': 'memory',
+        'busy_timeout': 30000,
+        'wal_autocheckpoint': 10000,  # In pages, so the log is copied to the database less often
+    },
+}
+DATABASE_PROFILE = os.environ.get('BOOKKEEPING_DATABASE_PROFILE', 'durable')
+if DATABASE_PROFILE not in DATABASE_PROFILES:
+    raise ImproperlyConfigured('BOOKKEEPING_DATABASE_PROFILE must be one of {}'.format(', '.join(DATABASE_PROFILES)))
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+SILENCED_SYSTEM_CHECKS = [
+    'models.W040',  # Covering indexes are used where the database supports them, other databases ignore them
+]
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+# Computed reports are cached in the cache 'reports', see ledger.cache. The backend is chosen with the environment
+# variable BOOKKEEPING_REPORT_CACHE: 'locmem' keeps them in the memory of the process and evicts the least recently
+# used reports, 'filebased' shares them between processes, and 'dummy' disables the cache. Reports expire after
+# BOOKKEEPING_REPORT_CACHE_TIMEOUT seconds, and at most BOOKKEEPING_REPORT_CACHE_MAX_ENTRIES are kept.
+REPORT_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reports',
+    },
+    'filebased': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'tmp', 'report_cache'),
+    },
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+report_cache_backend = os.environ.get('BOOKKEEPING_REPORT_CACHE', 'locmem')
+if report_cache_backend not in REPORT_CACHE_BACKENDS:
+    raise ImproperlyConfigured('BOOKKEEPING_REPORT_CACHE must be one of {}'.format(', '.join(REPORT_CACHE_BACKENDS)))
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': DB_FILE
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': dict(REPORT_CACHE_BACKENDS[report_cache_backend],
+                    TIMEOUT=int(os.environ.get('BOOKKEEPING_REPORT_CACHE_TIMEOUT', 24 * 60 * 60)),
+                    OPTIONS={'MAX_ENTRIES': int(os.environ.get('BOOKKEEPING_REPORT_CACHE_MAX_ENTRIES', 300))}),
+}
+
+# Reports
+
+# The amounts of the reports are summed by the engine BOOKKEEPING_REPORT_ENGINE, see ledger.totals: 'decimal' sums
+# decimals, 'cents' sums integer numbers of cents.
+REPORT_ENGINE = os.environ.get('BOOKKEEPING_REPORT_ENGINE', 'decimal')
+if REPORT_ENGINE not in ('decimal', 'cents'):
+    raise ImproperlyConfigured('BOOKKEEPING_REPORT_ENGINE must be one of decimal, cents')
+
+# Logging
+# https://docs.djangoproject.com/en/2.0/topics/logging/
+
+# The reports of common.instrumentation are logged as JSON. With level DEBUG, every report, import and export is
+# profiled, with level INFO only the commands that are run with --profile.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'common.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('BOOKKEEPING_PROFILE_LOG_LEVEL', 'WARNING'),
+        },
+    },
 }
 
 # Password validation
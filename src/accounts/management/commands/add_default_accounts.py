@@ -143,6 +143,19 @@ CREDIT_BALANCE_ACCOUNTS = {
 
 }
 
+# Groups of the accounts above by the first digit of their code, with their name, type and debit type. Some groups
+# hold accounts of both debit types, so their debit type is set here instead of taken from their accounts.
+ACCOUNT_GROUPS = {
+    '0': ('Vaste activa en passiva', Account.BALANCE, Account.DEBIT),
+    '1': ('Financiële rekeningen', Account.BALANCE, Account.DEBIT),
+    '2': ('Tussenrekeningen', Account.BALANCE, Account.DEBIT),
+    '3': ('Voorraden', Account.BALANCE, Account.DEBIT),
+    '4': ('Kosten', Account.PROFIT_LOSS, Account.CREDIT),
+    '7': ('Kostprijs', Account.PROFIT_LOSS, Account.CREDIT),
+    '8': ('Omzet', Account.PROFIT_LOSS, Account.DEBIT),
+    '9': ('Financiële baten en lasten', Account.PROFIT_LOSS, Account.DEBIT),
+}
+
 
 class Command(BaseCommand):
     help = 'Generate a default set of Accounts in a single ChartOfAccounts'
@@ -169,6 +182,19 @@ class Command(BaseCommand):
         accounts += [Account(uuid=Account.generate_uuid(), created_at=now, updated_at=now,
                              chart=chart, code=code, name=name, type=Account.BALANCE, debit_type=Account.CREDIT)
                      for code, name in CREDIT_BALANCE_ACCOUNTS.items()]
+
+        groups = {code: Account(uuid=Account.generate_uuid(), created_at=now, updated_at=now, chart=chart, code=code,
+                                name=name, type=account_type, debit_type=debit_type)
+                  for code, (name, account_type, debit_type) in ACCOUNT_GROUPS.items()
+                  if any(account.code[0] == code for account in accounts)}
+        for group in groups.values():
+            group.path = group.make_path()
+        Account.objects.bulk_create(groups.values())
+
+        # The paths of the accounts are made from the paths of their groups, which must be saved first
+        for account in accounts:
+            account.parent = groups[account.code[0]]
+            account.path = account.make_path()
         Account.objects.bulk_create(accounts)
 
     def add_arguments(self, parser):
@@ -0,0 +1,70 @@
+# The primary keys of the charts of accounts and the accounts change from the UUID to an integer id. They are copied to
+# new tables, which replace the old ones in accounts.0003, after the ledgers and transactions refer to the new tables.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_charts_and_accounts(apps, schema_editor):
+    ChartOfAccounts = apps.get_model('accounts', 'ChartOfAccounts')
+    NewChartOfAccounts = apps.get_model('accounts', 'NewChartOfAccounts')
+    Account = apps.get_model('accounts', 'Account')
+    NewAccount = apps.get_model('accounts', 'NewAccount')
+    NewContact = apps.get_model('contacts', 'NewContact')
+
+    NewChartOfAccounts.objects.bulk_create(
+        NewChartOfAccounts(uuid=chart.uuid, created_at=chart.created_at, updated_at=chart.updated_at)
+        for chart in ChartOfAccounts.objects.order_by('created_at', 'uuid'))
+    chart_ids = dict(NewChartOfAccounts.objects.values_list('uuid', 'id'))
+    contact_ids = dict(NewContact.objects.values_list('uuid', 'id'))
+
+    NewAccount.objects.bulk_create(
+        (NewAccount(uuid=account.uuid, created_at=account.created_at, updated_at=account.updated_at,
+                    chart_id=chart_ids[account.chart_id], code=account.code, name=account.name, type=account.type,
+                    debit_type=account.debit_type, contact_id=contact_ids.get(account.contact_id))
+         for account in Account.objects.order_by('code').iterator()),
+        batch_size=1000)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('contacts', '0003_contact_integer_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewChartOfAccounts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('uuid', models.CharField(editable=False, max_length=64, unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='NewAccount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('uuid', models.CharField(editable=False, max_length=64, unique=True)),
+                ('code', models.CharField(max_length=4, unique=True)),
+                ('name', models.CharField(max_length=32)),
+                ('type', models.CharField(choices=[('profit_loss', 'On profit/loss sheet'), ('balance', 'On balance sheet')], help_text='Where to put the account', max_length=16)),
+                ('debit_type', models.CharField(choices=[('debit', 'Debit'), ('credit', 'Credit')], help_text='For profit/loss accounts: debit=cost, credit=profit. For balance accounts: debit=active, credit=passive', max_length=16)),
+                ('chart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accounts', to='accounts.newchartofaccounts')),
+                ('contact', models.ForeignKey(blank=True, default=None, help_text='Linked contact, in use for debitors and creditors', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='accounts', to='contacts.newcontact')),
+            ],
+            options={
+                'ordering': ['code'],
+            },
+        ),
+        # The charts and accounts are copied back in accounts.0003, once their old tables are restored
+        migrations.RunPython(copy_charts_and_accounts, migrations.RunPython.noop),
+    ]
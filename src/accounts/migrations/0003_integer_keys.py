@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+def copy_charts_and_accounts_back(apps, schema_editor):
+    ChartOfAccounts = apps.get_model('accounts', 'ChartOfAccounts')
+    NewChartOfAccounts = apps.get_model('accounts', 'NewChartOfAccounts')
+    Account = apps.get_model('accounts', 'Account')
+    NewAccount = apps.get_model('accounts', 'NewAccount')
+    NewContact = apps.get_model('contacts', 'NewContact')
+
+    ChartOfAccounts.objects.bulk_create(
+        ChartOfAccounts(uuid=chart.uuid, created_at=chart.created_at, updated_at=chart.updated_at)
+        for chart in NewChartOfAccounts.objects.order_by('id'))
+    chart_uuids = dict(NewChartOfAccounts.objects.values_list('id', 'uuid'))
+    contact_uuids = dict(NewContact.objects.values_list('id', 'uuid'))
+
+    Account.objects.bulk_create(
+        (Account(uuid=account.uuid, created_at=account.created_at, updated_at=account.updated_at,
+                 chart_id=chart_uuids[account.chart_id], code=account.code, name=account.name, type=account.type,
+                 debit_type=account.debit_type, contact_id=contact_uuids.get(account.contact_id))
+         for account in NewAccount.objects.order_by('id').iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_integer_keys'),
+        ('ledger', '0006_integer_keys'),
+    ]
+
+    operations = [
+        # Reversed last, when the old tables are restored, so the rows are copied back with their UUID keys
+        migrations.RunPython(migrations.RunPython.noop, copy_charts_and_accounts_back),
+        migrations.DeleteModel(
+            name='Account',
+        ),
+        migrations.DeleteModel(
+            name='ChartOfAccounts',
+        ),
+        migrations.RenameModel(
+            old_name='NewChartOfAccounts',
+            new_name='ChartOfAccounts',
+        ),
+        migrations.RenameModel(
+            old_name='NewAccount',
+            new_name='Account',
+        ),
+    ]
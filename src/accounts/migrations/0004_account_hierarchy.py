@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Concat
+
+
+def set_paths(apps, schema_editor):
+    """
+    Set the path of every existing account, which has no group yet
+    """
+
+    Account = apps.get_model('accounts', 'Account')
+    Account.objects.update(path=Concat(Value('/'), 'code', Value('/')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_integer_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='parent',
+            field=models.ForeignKey(blank=True, default=None, help_text='Group account this account belongs to', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='children', to='accounts.account'),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, help_text='Codes of the groups of the account and of the account itself, e.g. /1/10/1010/', max_length=255),
+        ),
+        migrations.RunPython(set_paths, migrations.RunPython.noop),
+    ]
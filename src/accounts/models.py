@@ -1,5 +1,8 @@
 from django.db import models
-from django.db.models import Manager
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.db.transaction import atomic
+from typing import Tuple
 
 from common.behaviors import Equalable, Timestampable, UUIDable
 from contacts.models import Contact
@@ -13,6 +16,16 @@ class ChartOfAccounts(UUIDable, Timestampable, Equalable, models.Model):
     pass
 
 
+class AccountQuerySet(models.QuerySet):
+    def subtree(self, account: 'Account') -> 'AccountQuerySet':
+        """
+        Filter the given account and all accounts below it, with one range query on their path
+        """
+
+        low, high = account.get_subtree_range()
+        return self.filter(path__gte=low, path__lt=high)
+
+
 class Account(UUIDable, Timestampable, Equalable, models.Model):
     """
     In Dutch: grootboekrekening of rubriek.
@@ -24,6 +37,11 @@ class Account(UUIDable, Timestampable, Equalable, models.Model):
     3 Equity accounts
     4 Expense accounts indirectly related to revenue
     5 Expense accounts directly related to revenue
+
+    Accounts can be grouped in a hierarchy, e.g. by the first digit of their code, with a group account as their
+    parent. A group has the same type as the accounts in it. Every account stores its materialized path: the codes of
+    its groups and its own code, e.g. /1/10/1010/. All accounts below a group have a path that starts with the path of
+    the group, so a subtree is found with one range query, see AccountQuerySet.subtree.
     """
 
     PROFIT_LOSS = 'profit_loss'
@@ -42,7 +60,8 @@ class Account(UUIDable, Timestampable, Equalable, models.Model):
     DEBIT_TYPE = 'For profit/loss accounts: debit=cost, credit=profit. ' \
                  'For balance accounts: debit=active, credit=passive'
 
-    # TODO: Build in hierarchy in accounts
+    path_separator = '/'
+
     chart = models.ForeignKey(ChartOfAccounts, on_delete=models.CASCADE, related_name='accounts')
     code = models.CharField(max_length=4, unique=True)  # Code can start with 0, and hence is not an integer
     name = models.CharField(max_length=32)  # Name is not unique, e.g. company tax can be both on PL and on Balance
@@ -50,10 +69,34 @@ class Account(UUIDable, Timestampable, Equalable, models.Model):
     debit_type = models.CharField(max_length=16, choices=CHOICES_TRANSACTION_TYPE, help_text=DEBIT_TYPE)
     contact = models.ForeignKey(Contact, null=True, blank=True, default=None, related_name='accounts',
                                 on_delete=models.PROTECT, help_text='Linked contact, in use for debitors and creditors')
+    parent = models.ForeignKey('self', null=True, blank=True, default=None, related_name='children',
+                               on_delete=models.PROTECT, help_text='Group account this account belongs to')
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='',
+                            help_text='Codes of the groups of the account and of the account itself, e.g. /1/10/1010/')
+
+    objects = AccountQuerySet.as_manager()
 
     class Meta:
         ordering = ['code']
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        old_path = '' if adding else Account.objects.filter(pk=self.pk).values_list('path', flat=True).get()
+        if self.parent_id:
+            # The path of the group is read from the database, since it changes when the group is moved
+            self.parent.refresh_from_db(fields=['path'])
+            if old_path and self.parent.path.startswith(old_path):
+                raise ValueError('Account {} cannot belong to the group {} below it'.format(self, self.parent))
+        self.path = self.make_path()
+        with atomic():
+            super().save(*args, **kwargs)
+            if not adding:
+                if self.path != old_path:
+                    self._move_subtree(old_path)
+                # The code and name of the account are shown in the reports of all ledgers, see Ledger.version. A new
+                # account does not change any report yet, since it has no transactions.
+                self.chart.ledgers.update(version=models.F('version') + 1)
+
     def clean(self):
         # TODO: Remove once there can be multiple ChartOfAccounts
         if not getattr(self, 'chart', None):
@@ -62,3 +105,40 @@ class Account(UUIDable, Timestampable, Equalable, models.Model):
 
     def __str__(self):
         return '{} - {}'.format(self.code, self.name)
+
+    @property
+    def depth(self) -> int:
+        """
+        Return the number of groups above this account, which is 0 for an account without a group
+        """
+
+        return max(self.path.count(self.path_separator) - 2, 0)
+
+    def make_path(self) -> str:
+        """
+        Return the path of this account, from the path of its group and its own code
+
+        Code that creates accounts with bulk_create must set their paths with this method.
+        """
+
+        parent_path = self.parent.path if self.parent_id else self.path_separator
+        return '{}{}{}'.format(parent_path, self.code, self.path_separator)
+
+    def get_subtree_range(self) -> Tuple[str, str]:
+        """
+        Return the lowest path and the path just above the highest path of this account and all accounts below it
+
+        The paths below this account all start with its path. They are ordered before the path in which the final
+        separator is replaced by the character after it.
+        """
+
+        return self.path, self.path[:-1] + chr(ord(self.path_separator) + 1)
+
+    def _move_subtree(self, old_path: str) -> None:
+        """
+        Replace the given old path of this account by its new path in the paths of all accounts below it
+        """
+
+        high = old_path[:-1] + chr(ord(self.path_separator) + 1)
+        Account.objects.filter(path__gt=old_path, path__lt=high) \
+            .update(path=Concat(Value(self.path), Substr('path', len(old_path) + 1)))
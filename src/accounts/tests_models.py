@@ -0,0 +1,64 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from accounts.models import Account, ChartOfAccounts
+
+
+class AccountHierarchyTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chart = ChartOfAccounts.objects.create()
+        cls.assets = cls.create_account('1')
+        cls.current_assets = cls.create_account('10', parent=cls.assets)
+        cls.bank = cls.create_account('1010', parent=cls.current_assets)
+        cls.cash = cls.create_account('1020', parent=cls.current_assets)
+        cls.liabilities = cls.create_account('2')
+
+    @classmethod
+    def create_account(cls, code, parent=None):
+        return Account.objects.create(chart=cls.chart, code=code, name='Account {}'.format(code), parent=parent,
+                                      type=Account.BALANCE, debit_type=Account.DEBIT)
+
+    def test_that_path_holds_codes_of_groups(self):
+        self.assertEqual('/1/10/1010/', self.bank.path)
+        self.assertEqual(2, self.bank.depth)
+        self.assertEqual(0, self.assets.depth)
+
+    def test_that_subtree_is_found_with_one_range_query(self):
+        with self.assertNumQueries(1):
+            codes = list(Account.objects.subtree(self.current_assets).values_list('code', flat=True))
+        self.assertListEqual(['10', '1010', '1020'], codes)
+        self.assertListEqual(['1', '10', '1010', '1020'],
+                             list(Account.objects.subtree(self.assets).values_list('code', flat=True)))
+
+    def test_that_moving_a_group_moves_its_subtree(self):
+        self.current_assets.parent = self.liabilities
+        self.current_assets.save()
+        self.assertListEqual(['/2/10/', '/2/10/1010/', '/2/10/1020/'],
+                             list(Account.objects.subtree(self.current_assets).values_list('path', flat=True)))
+        self.assertListEqual(['1'], list(Account.objects.subtree(self.assets).values_list('code', flat=True)))
+
+    def test_that_group_cannot_be_moved_below_itself(self):
+        self.assets.parent = self.bank
+        with self.assertRaises(ValueError):
+            self.assets.save()
+
+
+class DefaultAccountsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('add_default_accounts')
+
+    def test_that_default_accounts_belong_to_their_group(self):
+        bank = Account.objects.get(code='1100')
+        self.assertEqual('1', bank.parent.code)
+        self.assertEqual('/1/1100/', bank.path)
+        self.assertEqual(1, bank.depth)
+        self.assertIn('1100', Account.objects.subtree(bank.parent).values_list('code', flat=True))
+
+    def test_that_groups_have_their_own_type_and_debit_type(self):
+        financial_accounts = Account.objects.get(code='1')
+        self.assertEqual((Account.BALANCE, Account.DEBIT), (financial_accounts.type, financial_accounts.debit_type))
+        self.assertTrue(financial_accounts.children.filter(debit_type=Account.CREDIT).exists())
+        costs = Account.objects.get(code='4')
+        self.assertEqual((Account.PROFIT_LOSS, Account.CREDIT), (costs.type, costs.debit_type))
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from common.database import configure_connection
+
+
+class CommonConfig(AppConfig):
+    name = 'common'
+
+    def ready(self):
+        connection_created.connect(configure_connection, dispatch_uid='common.configure_connection')
@@ -6,7 +6,7 @@ from django.utils import timezone
 
 class Equalable(models.Model):
     # Fields that do not have to be equal to consider the objects equal, e.g. a primary key
-    exclude_eq = ('uuid', 'created_at', 'updated_at')
+    exclude_eq = ('id', 'uuid', 'created_at', 'updated_at')
 
     class Meta:
         abstract = True
@@ -62,11 +62,14 @@ class UUIDable(models.Model):
     With this behavior mixed in, an object gets a field that is automatically filled with a UUID string when an object
     is created
 
+    The UUID is a unique external id, e.g. for references from outside the database. The primary key is the integer
+    id, which keeps the foreign keys and the indexes on them small.
+
     This class inherits from models.Model, since it adds fields to the Django model. Otherwise,
     these Django does not recognize these fields, e.g. if you want to use them for sorting.
     """
 
-    uuid = models.CharField(max_length=64, editable=False, primary_key=True)
+    uuid = models.CharField(max_length=64, editable=False, unique=True)
 
     class Meta:
         abstract = True
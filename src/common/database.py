@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.backends.base.base import BaseDatabaseWrapper
+from typing import Dict, List, Optional, TypeVar, Union
+
+ModelType = TypeVar('ModelType', bound=models.Model)
+
+
+def apply_database_profile(connection: BaseDatabaseWrapper, profile: Dict[str, Union[int, str]]) -> None:
+    """
+    Set the given pragmas on the given SQLite connection
+
+    Some pragmas, e.g. journal_mode and synchronous, cannot be changed inside a transaction, so this is called when
+    the connection is created.
+
+    :param connection: Database connection, which is left alone if it is not SQLite
+    :param profile: Pragmas by name, see settings.DATABASE_PROFILES
+    """
+
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in profile.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def configure_connection(sender, connection: BaseDatabaseWrapper, **kwargs) -> None:
+    """
+    Apply the database profile of the settings to a new connection, as receiver of the signal connection_created
+    """
+
+    apply_database_profile(connection, settings.DATABASE_PROFILES[settings.DATABASE_PROFILE])
+
+
+def has_fast_paths(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """
+    Return whether the given database is PostgreSQL, for which the code takes faster paths where it has them, e.g.
+    loading rows with COPY and adding up running sums with window functions
+    """
+
+    return connections[using].vendor == 'postgresql'
+
+
+def bulk_insert(manager: models.Manager, objs: List[ModelType], batch_size: Optional[int] = None) -> List[ModelType]:
+    """
+    Insert the given new objects with the fastest way the database of the manager supports
+
+    On PostgreSQL with psycopg 3, all objects are streamed to the table with one COPY statement, which skips the
+    parsing and planning of an INSERT per batch. Other databases use bulk_create. COPY does not return the primary
+    keys, so the caller must look them up, e.g. by UUID, if it needs them.
+    """
+
+    if not has_fast_paths(manager.db) or not objs:
+        return manager.bulk_create(objs, batch_size=batch_size)
+    # This module can only be imported if psycopg or psycopg2 is installed
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    if not is_psycopg3:
+        return manager.bulk_create(objs, batch_size=batch_size)
+
+    connection = connections[manager.db]
+    opts = manager.model._meta
+    fields = [field for field in opts.concrete_fields if not field.primary_key]
+    quote_name = connection.ops.quote_name
+    sql = 'COPY {} ({}) FROM STDIN'.format(quote_name(opts.db_table),
+                                           ', '.join(quote_name(field.column) for field in fields))
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(sql) as copy:
+            for obj in objs:
+                # Like bulk_create, take the foreign keys from related objects that were saved after they were assigned
+                obj._prepare_related_fields_for_save(operation_name='bulk_insert')
+                copy.write_row([field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields])
+    return objs
@@ -0,0 +1,180 @@
+import functools
+import heapq
+import json
+import logging
+import time
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+
+from django.db import connection
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Profilers that are currently running, from the outermost to the innermost
+_active_profilers = ContextVar('active_profilers', default=())  # type: ContextVar[Tuple[Profiler, ...]]
+
+
+class PhaseStatistics:
+    def __init__(self):
+        self.wall_time = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {'wall_time': round(self.wall_time, 6), 'queries': self.queries, 'sql_time': round(self.sql_time, 6)}
+
+
+class Profiler(ContextDecorator):
+    """
+    Record the queries and the wall time of the enclosed code, as a context manager or as a decorator:
+
+        with Profiler('balance') as profiler:
+            Balance(date)
+        print(profiler.report())
+
+    The code can mark its phases, e.g. fetch, compute, render and save, with the function phase. The number of
+    queries, the time spent in the database and the wall time are recorded per phase. Profilers can be nested, the
+    outer profiler records everything the inner profilers record.
+
+    When the profiler ends, its report is logged as JSON with the given log level, and it is attached to the log
+    record as the attribute profile.
+    """
+
+    def __init__(self, name: str, nr_slowest: int = 5, log_level: int = logging.INFO):
+        """
+        :param name: Name of the profiled code, e.g. the report or the command
+        :param nr_slowest: Number of slowest statements that are kept
+        :param log_level: Level of the log message with the report
+        """
+
+        self.name = name
+        self.nr_slowest = nr_slowest
+        self.log_level = log_level
+
+    def __enter__(self) -> 'Profiler':
+        self.queries = 0
+        self.sql_time = 0.0
+        self.wall_time = None  # type: Optional[float]  # Known once the profiler ends
+        self.phases = {}  # type: Dict[str, PhaseStatistics]
+        self.current_phases = []  # type: List[str]
+        self._slowest = []  # type: List[Tuple[float, int, str]]  # Min-heap of (duration, sequence, sql)
+
+        self._execute_wrapper = connection.execute_wrapper(self._record_query)
+        self._execute_wrapper.__enter__()
+        self._token = _active_profilers.set(_active_profilers.get() + (self,))
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wall_time = time.perf_counter() - self._start
+        _active_profilers.reset(self._token)
+        self._execute_wrapper.__exit__(exc_type, exc_val, exc_tb)
+        if logger.isEnabledFor(self.log_level):
+            report = self.report()
+            logger.log(self.log_level, json.dumps(report), extra={'profile': report})
+        return False
+
+    def report(self) -> Dict[str, object]:
+        """
+        Return the recorded statistics in a dictionary that can be serialized as JSON
+        """
+
+        wall_time = self.wall_time if self.wall_time is not None else time.perf_counter() - self._start
+        return {
+            'name': self.name,
+            'wall_time': round(wall_time, 6),
+            'queries': self.queries,
+            'sql_time': round(self.sql_time, 6),
+            'phases': {name: statistics.as_dict() for name, statistics in self.phases.items()},
+            'slowest_queries': [{'sql': sql, 'time': round(duration, 6)}
+                                for duration, _, sql in sorted(self._slowest, reverse=True)],
+        }
+
+    def _record_query(self, execute: Callable, sql: str, params, many: bool, context) -> object:
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.sql_time += duration
+            if self.current_phases:
+                statistics = self.phases[self.current_phases[-1]]
+                statistics.queries += 1
+                statistics.sql_time += duration
+            entry = (duration, self.queries, sql)
+            if len(self._slowest) < self.nr_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif self.nr_slowest:
+                heapq.heappushpop(self._slowest, entry)
+
+    def _enter_phase(self, name: str) -> None:
+        self.phases.setdefault(name, PhaseStatistics())
+        self.current_phases.append(name)
+
+    def _exit_phase(self, name: str, wall_time: float) -> None:
+        self.current_phases.pop()
+        self.phases[name].wall_time += wall_time
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Mark the enclosed code as the given phase of all running profilers
+
+    The queries in the phase are attributed to it, and to none of the phases it is nested in. Without a running
+    profiler, this does nothing.
+    """
+
+    profilers = _active_profilers.get()
+    if not profilers:
+        yield
+        return
+
+    for profiler in profilers:
+        profiler._enter_phase(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start
+        for profiler in profilers:
+            profiler._exit_phase(name, wall_time)
+
+
+def profiled(name: Optional[str] = None) -> Callable:
+    """
+    Decorate a function to be profiled if a profiler is running or the debug log of this module is enabled
+
+    Otherwise, the function is called without any overhead.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        profile_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _active_profilers.get() and not logger.isEnabledFor(logging.DEBUG):
+                return function(*args, **kwargs)
+            with Profiler(profile_name, log_level=logging.DEBUG):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def format_report(report: Dict[str, object]) -> List[str]:
+    """
+    Return the lines of a human readable summary of the given profiler report
+    """
+
+    lines = ['{name}: {wall_time:.3f} s, {queries} queries in {sql_time:.3f} s'.format(**report)]
+    for name, statistics in report['phases'].items():
+        lines.append('  {}: {wall_time:.3f} s, {queries} queries in {sql_time:.3f} s'.format(name, **statistics))
+    if report['slowest_queries']:
+        lines.append('  Slowest queries:')
+        for query in report['slowest_queries']:
+            lines.append('    {:.3f} s: {}'.format(query['time'], query['sql']))
+    return lines
@@ -0,0 +1,75 @@
+from unittest import skipUnless
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from common.behaviors import UUIDable
+from common.database import apply_database_profile, bulk_insert, has_fast_paths
+from contacts.models import Contact
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Database profiles only hold SQLite pragmas')
+class DatabaseProfileTestCase(TestCase):
+    def get_pragma(self, database_connection, name):
+        with database_connection.cursor() as cursor:
+            cursor.execute('PRAGMA {}'.format(name))
+            return cursor.fetchone()[0]
+
+    def test_that_profile_is_applied_to_new_connections(self):
+        new_connection = connections.create_connection('default')
+        try:
+            self.assertEqual(settings.DATABASE_PROFILES['durable']['busy_timeout'],
+                             self.get_pragma(new_connection, 'busy_timeout'))
+            self.assertEqual(2, self.get_pragma(new_connection, 'temp_store'))  # 2 = memory
+        finally:
+            new_connection.close()
+
+    @override_settings(DATABASE_PROFILE='bulk_load')
+    def test_that_profile_can_be_switched_in_settings(self):
+        new_connection = connections.create_connection('default')
+        try:
+            self.assertEqual(settings.DATABASE_PROFILES['bulk_load']['cache_size'],
+                             self.get_pragma(new_connection, 'cache_size'))
+            self.assertEqual(1, self.get_pragma(new_connection, 'synchronous'))  # 1 = normal
+        finally:
+            new_connection.close()
+
+    def test_that_pragmas_are_set_on_the_given_connection(self):
+        cache_size = self.get_pragma(connection, 'cache_size')
+        apply_database_profile(connection, {'cache_size': -1234})
+        self.assertEqual(-1234, self.get_pragma(connection, 'cache_size'))
+        apply_database_profile(connection, {'cache_size': cache_size})
+
+
+class BulkInsertTestCase(TestCase):
+    def make_contacts(self, nr_contacts):
+        now = timezone.now()
+        return [Contact(name='Contact {}'.format(index), uuid=UUIDable.generate_uuid(), created_at=now, updated_at=now)
+                for index in range(nr_contacts)]
+
+    def test_that_all_objects_are_inserted(self):
+        contacts = self.make_contacts(5)
+        self.assertEqual(5, len(bulk_insert(Contact.objects, contacts)))
+        self.assertSetEqual({contact.uuid for contact in contacts},
+                            set(Contact.objects.values_list('uuid', flat=True)))
+
+    def test_that_nothing_is_inserted_without_objects(self):
+        with self.assertNumQueries(0):
+            self.assertListEqual([], bulk_insert(Contact.objects, []))
+
+    @skipUnless(connection.vendor != 'postgresql', 'PostgreSQL loads the objects with COPY')
+    def test_that_other_databases_use_bulk_create(self):
+        self.assertFalse(has_fast_paths())
+        with self.assertNumQueries(2):
+            bulk_insert(Contact.objects, self.make_contacts(5), batch_size=3)
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is only used on PostgreSQL')
+    def test_that_postgresql_loads_the_objects_with_copy(self):
+        self.assertTrue(has_fast_paths())
+        contacts = self.make_contacts(5)
+        bulk_insert(Contact.objects, contacts, batch_size=3)
+        # COPY does not return the primary keys
+        self.assertIsNone(contacts[0].pk)
+        self.assertEqual(5, Contact.objects.count())
@@ -0,0 +1,77 @@
+import logging
+
+from django.test import TestCase
+
+from common.instrumentation import Profiler, format_report, phase, profiled
+from contacts.models import Contact
+
+
+@profiled('count_contacts')
+def count_contacts() -> int:
+    with phase('fetch'):
+        return Contact.objects.count()
+
+
+class ProfilerTestCase(TestCase):
+    def test_that_queries_are_recorded_per_phase(self):
+        with Profiler('test') as profiler:
+            with phase('fetch'):
+                Contact.objects.count()
+                Contact.objects.exists()
+            with phase('save'):
+                Contact.objects.create(name='Owner')
+            Contact.objects.count()
+        report = profiler.report()
+        self.assertEqual('test', report['name'])
+        self.assertEqual(4, report['queries'])
+        self.assertEqual(2, report['phases']['fetch']['queries'])
+        self.assertEqual(1, report['phases']['save']['queries'])
+        self.assertGreaterEqual(report['wall_time'], report['phases']['fetch']['wall_time'])
+        self.assertGreaterEqual(report['sql_time'], report['phases']['fetch']['sql_time'])
+
+    def test_that_the_slowest_queries_are_kept(self):
+        with Profiler('test', nr_slowest=2) as profiler:
+            for _ in range(5):
+                Contact.objects.count()
+        slowest_queries = profiler.report()['slowest_queries']
+        self.assertEqual(2, len(slowest_queries))
+        self.assertIn('SELECT COUNT(*)', slowest_queries[0]['sql'])
+        self.assertGreaterEqual(slowest_queries[0]['time'], slowest_queries[1]['time'])
+
+    def test_that_the_report_is_logged(self):
+        with self.assertLogs('common.instrumentation', level=logging.INFO) as logs:
+            with Profiler('test'):
+                Contact.objects.count()
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual('test', logs.records[0].profile['name'])
+        self.assertIn('"queries": 1', logs.records[0].getMessage())
+
+    def test_that_nested_profilers_are_recorded_by_the_outer_profiler(self):
+        with Profiler('outer') as profiler:
+            count_contacts()
+            Contact.objects.count()
+        report = profiler.report()
+        self.assertEqual(2, report['queries'])
+        self.assertEqual(1, report['phases']['fetch']['queries'])
+
+    def test_that_profiled_functions_are_not_profiled_by_default(self):
+        with self.assertNoLogs('common.instrumentation'):
+            self.assertEqual(0, count_contacts())
+
+    def test_that_profiled_functions_are_logged_in_debug(self):
+        with self.assertLogs('common.instrumentation', level=logging.DEBUG) as logs:
+            count_contacts()
+        self.assertEqual('count_contacts', logs.records[0].profile['name'])
+
+    def test_that_phase_does_nothing_without_profiler(self):
+        with phase('fetch'):
+            self.assertEqual(0, Contact.objects.count())
+
+    def test_that_report_is_formatted(self):
+        with Profiler('test') as profiler:
+            with phase('fetch'):
+                Contact.objects.count()
+        lines = format_report(profiler.report())
+        self.assertTrue(lines[0].startswith('test: '))
+        self.assertTrue(lines[1].startswith('  fetch: '))
+        self.assertIn('1 queries', lines[1])
@@ -1,6 +1,12 @@
+import os.path
+from decimal import Decimal
+from tempfile import TemporaryDirectory
+
 from django.test import TestCase
+from openpyxl import load_workbook
 
-from common.utils import concatenate_matrices, extract_name_from_full_path_to_file, sum_available_elements
+from common.utils import XlsxStreamWriter, concatenate_matrices, extract_name_from_full_path_to_file, \
+    sum_available_elements, write_xlsx, write_xlsx_stream
 
 
 class ExtractNameFromFullPathToFileTestCase(TestCase):
@@ -41,3 +47,62 @@ class SumAvailableElementsTestCase(TestCase):
 
     def test_that_non_elements_are_skipped(self):
         self.assertEqual(3, sum_available_elements([1, None, 2]))
+
+
+class XlsxStreamWriterTestCase(TestCase):
+    contents = [['Account', 'Description', 'Amount'],
+                ['1010', 'Bank', Decimal('1200.00')],
+                ['2010', 'Creditor: Owner', Decimal('1000.00')],
+                [None, 'Total', Decimal('2200.00')]]
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.full_path_to_file = os.path.join(self.tmp_dir.name, 'balance')
+
+    def test_that_rows_from_an_iterator_are_written(self):
+        write_xlsx_stream(iter(self.contents), self.full_path_to_file, currency_columns=('C',))
+        worksheet = load_workbook(self.full_path_to_file + '.xlsx').active
+        self.assertEqual('balance', worksheet.title)
+        self.assertListEqual([list(row) for row in self.contents], [list(row) for row in worksheet.values])
+
+    def test_that_styles_are_applied(self):
+        write_xlsx_stream(iter(self.contents), self.full_path_to_file, currency_columns=('C',))
+        worksheet = load_workbook(self.full_path_to_file + '.xlsx').active
+        self.assertEqual('00BBBBBB', worksheet['A1'].fill.fgColor.rgb)
+        self.assertEqual(XlsxStreamWriter.currency_format, worksheet['C2'].number_format)
+        self.assertEqual('General', worksheet['B2'].number_format)
+        self.assertTrue(worksheet['B4'].font.bold)
+        self.assertEqual('00DDDDDD', worksheet['B4'].fill.fgColor.rgb)
+        self.assertFalse(worksheet['B3'].font.bold)
+
+    def test_that_column_widths_are_based_on_a_sample(self):
+        with XlsxStreamWriter(self.full_path_to_file, sample_size=2) as writer:
+            writer.write_sheet(iter(self.contents), 'Balance', has_total_row=False)
+        worksheet = load_workbook(self.full_path_to_file + '.xlsx')['Balance']
+        self.assertEqual(int(len('Description') * 1.2), worksheet.column_dimensions['B'].width)
+        self.assertFalse(worksheet['B4'].font.bold)
+
+    def test_that_multiple_sheets_can_be_written(self):
+        with XlsxStreamWriter(self.full_path_to_file + '.xlsx') as writer:
+            writer.write_sheet(self.contents, 'First')
+            writer.write_sheet(self.contents, 'Second')
+        self.assertListEqual(['First', 'Second'], load_workbook(self.full_path_to_file + '.xlsx').sheetnames)
+
+
+class WriteXlsxTestCase(TestCase):
+    contents = [['Code', 'Name', 'Amount'],
+                ['1010', 'Bank', Decimal('1200.00')],
+                [None, 'Total', Decimal('1200.00')]]
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.full_path_to_file = os.path.join(self.tmp_dir.name, 'balance')
+
+    def test_that_currency_format_is_applied_below_the_header(self):
+        write_xlsx(self.contents, self.full_path_to_file)
+        worksheet = load_workbook(self.full_path_to_file + '.xlsx').active
+        self.assertEqual('General', worksheet['C1'].number_format)
+        self.assertEqual('"€"#,##0.00', worksheet['C2'].number_format)
+        self.assertTrue(worksheet['B3'].font.bold)
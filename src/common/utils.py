@@ -2,17 +2,22 @@ import csv
 import os.path
 from copy import copy
 from decimal import Decimal
+from itertools import islice
 
 from datetime import datetime
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
 from openpyxl.styles.numbers import FORMAT_CURRENCY_EUR_SIMPLE
-from openpyxl.utils import get_column_letter
-from typing import Optional, Union
+from openpyxl.utils import column_index_from_string, get_column_letter
+from typing import Iterable, Optional, Sequence, Union
+
+from common.instrumentation import phase
 
 Numeric = Union[Decimal, float, int]
 MatrixElement = Union[Numeric, str, datetime, None]
 Matrix = [[MatrixElement]]
+Rows = Iterable[Sequence[MatrixElement]]  # Matrix-shaped contents that can be streamed row by row
 
 
 def write_csv(contents: [[str]], full_path_to_file: str) -> None:
@@ -25,7 +30,7 @@ def write_csv(contents: [[str]], full_path_to_file: str) -> None:
 
 # TODO: Write a wrapper around openpyxl, that represents an Excel file, including its path to file to save it
 def write_xlsx(contents: [[str]], full_path_to_file: str, workbook: Workbook = None,
-               worksheet_name: str = None) -> Workbook:
+               worksheet_name: str = None, currency_columns: Sequence[str] = ('C', 'F')) -> Workbook:
     if not worksheet_name:
         worksheet_name = extract_name_from_full_path_to_file(full_path_to_file)
 
@@ -34,47 +39,180 @@ def write_xlsx(contents: [[str]], full_path_to_file: str, workbook: Workbook = N
     if os.path.splitext(full_path_to_file)[-1] == '':
         full_path_to_file += '.xlsx'
 
-    if not workbook:
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = worksheet_name
-    else:
-        worksheet = workbook.create_sheet(worksheet_name)
-
-    # Set the column widths proportional to the content length. Works only approximately for nontrue type fonts.
-    column_widths = [0] * len(contents[0])
-    for line in contents:
-        worksheet.append(line)
-        for i, cell in enumerate(line):
-            cell_width = len(str(cell))
-            if cell_width > column_widths[i]:
-                column_widths[i] = int(cell_width * 1.2)
-    for i, column_width in enumerate(column_widths):
-        worksheet.column_dimensions[get_column_letter(i + 1)].width = column_width
-
-    # Set currency. Must be set after the column widths, otherwise they disappear
-    # TODO: With the file wrapper, make helper functions for these kinds of operations
-    for cell in worksheet['C0'][1:]:
-        cell.number_format = '"€"#,##0.00'
-    for cell in worksheet['F0'][1:]:
-        cell.number_format = '"€"#,##0.00'
-
-    # Highlight the header
-    for i in range(len(column_widths)):
-        worksheet['{}1'.format(get_column_letter(i + 1))].fill = PatternFill('solid', fgColor='BBBBBB')
-
-    # Highlight the totals row
-    default_font = worksheet['A1'].font
-    bold_font = copy(default_font)
-    bold_font.bold = True
-    for i in range(len(column_widths)):
-        worksheet['{}{}'.format(get_column_letter(i + 1), len(contents))].fill = PatternFill('solid', fgColor='DDDDDD')
-        worksheet['{}{}'.format(get_column_letter(i + 1), len(contents))].font = bold_font
-
-    workbook.save(full_path_to_file)
+    with phase('render'):
+        if not workbook:
+            workbook = Workbook()
+            worksheet = workbook.active
+            worksheet.title = worksheet_name
+        else:
+            worksheet = workbook.create_sheet(worksheet_name)
+
+        # Set the column widths proportional to the content length. Works only approximately for nontrue type fonts.
+        column_widths = [0] * len(contents[0])
+        for line in contents:
+            worksheet.append(line)
+            for i, cell in enumerate(line):
+                cell_width = len(str(cell))
+                if cell_width > column_widths[i]:
+                    column_widths[i] = int(cell_width * 1.2)
+        for i, column_width in enumerate(column_widths):
+            worksheet.column_dimensions[get_column_letter(i + 1)].width = column_width
+
+        # Set currency. Must be set after the column widths, otherwise they disappear
+        # TODO: With the file wrapper, make helper functions for these kinds of operations
+        for column in currency_columns:
+            for cell in worksheet[column][1:]:
+                cell.number_format = '"€"#,##0.00'
+
+        # Highlight the header
+        for i in range(len(column_widths)):
+            worksheet['{}1'.format(get_column_letter(i + 1))].fill = PatternFill('solid', fgColor='BBBBBB')
+
+        # Highlight the totals row
+        default_font = worksheet['A1'].font
+        bold_font = copy(default_font)
+        bold_font.bold = True
+        for i in range(len(column_widths)):
+            total_cell = worksheet['{}{}'.format(get_column_letter(i + 1), len(contents))]
+            total_cell.fill = PatternFill('solid', fgColor='DDDDDD')
+            total_cell.font = bold_font
+
+    with phase('save'):
+        workbook.save(full_path_to_file)
     return workbook
 
 
+class XlsxStreamWriter:
+    """
+    Excel file that is written row by row, using the write-only mode of openpyxl
+
+    Rows are written to the file as they come in, so the memory use does not depend on the number of rows. Since
+    write-only workbooks cannot be changed afterwards, the column widths are based on the first rows of each sheet,
+    and all styles are applied while writing. The file is saved when leaving the context:
+
+        with XlsxStreamWriter('path/to/file.xlsx') as writer:
+            writer.write_sheet(rows, 'Sheet name', currency_columns=('C', 'F'))
+    """
+
+    currency_format = '"€"#,##0.00'
+    header_fill = PatternFill('solid', fgColor='BBBBBB')
+    total_fill = PatternFill('solid', fgColor='DDDDDD')
+    total_font = Font(bold=True)
+
+    def __init__(self, full_path_to_file: str, sample_size: int = 100):
+        """
+        :param full_path_to_file: Full path to the file, the extension .xlsx is added if it has none
+        :param sample_size: Number of rows per sheet that is used to determine the column widths
+        """
+
+        # If the full path to the file does not have an extension, we add the default extension.
+        # If it has an extension however, we keep whatever the client passes.
+        if os.path.splitext(full_path_to_file)[-1] == '':
+            full_path_to_file += '.xlsx'
+        self.full_path_to_file = full_path_to_file
+        self.sample_size = sample_size
+        self.workbook = Workbook(write_only=True)
+
+    def __enter__(self) -> 'XlsxStreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.save()
+
+    def write_sheet(self, rows: Rows, worksheet_name: str = None, currency_columns: Sequence[str] = (),
+                    has_total_row: bool = True) -> None:
+        """
+        Write the given rows to a new sheet
+
+        :param rows: Matrix-shaped contents, of which the first row is the header
+        :param worksheet_name: Name of the sheet, defaults to the name of the file
+        :param currency_columns: Letters of the columns that contain amounts in euros
+        :param has_total_row: Whether the last row is a total row, which is highlighted
+        """
+
+        with phase('render'):
+            self._write_sheet(rows, worksheet_name, currency_columns, has_total_row)
+
+    def _write_sheet(self, rows: Rows, worksheet_name: Optional[str], currency_columns: Sequence[str],
+                     has_total_row: bool) -> None:
+        worksheet = self.workbook.create_sheet(worksheet_name or extract_name_from_full_path_to_file(
+            self.full_path_to_file))
+        currency_indices = {column_index_from_string(column) - 1 for column in currency_columns}
+
+        # Set the column widths proportional to the content length of the first rows, since they must be known
+        # before the first row is written. Works only approximately for nontrue type fonts.
+        rows = iter(rows)
+        sample = list(islice(rows, self.sample_size))
+        if not sample:
+            return
+        column_widths = [0] * max(len(row) for row in sample)
+        for row in sample:
+            for i, value in enumerate(row):
+                column_widths[i] = max(column_widths[i], int(len(str(value)) * 1.2))
+        for i, column_width in enumerate(column_widths):
+            worksheet.column_dimensions[get_column_letter(i + 1)].width = column_width
+
+        worksheet.append(self._style_row(worksheet, sample[0], fill=self.header_fill))
+        previous_row = None
+        for row in self._chain(sample[1:], rows):
+            if previous_row is not None:
+                worksheet.append(self._style_row(worksheet, previous_row, currency_indices=currency_indices))
+            previous_row = row
+        # The last row is only known once all rows have been read
+        if previous_row is not None:
+            if has_total_row:
+                worksheet.append(self._style_row(worksheet, previous_row, currency_indices=currency_indices,
+                                                 fill=self.total_fill, font=self.total_font))
+            else:
+                worksheet.append(self._style_row(worksheet, previous_row, currency_indices=currency_indices))
+
+    def save(self) -> None:
+        with phase('save'):
+            self.workbook.save(self.full_path_to_file)
+
+    @staticmethod
+    def _chain(sample: list, rows: Rows) -> Rows:
+        yield from sample
+        yield from rows
+
+    def _style_row(self, worksheet, row: Sequence[MatrixElement], currency_indices: set = frozenset(),
+                   fill: PatternFill = None, font: Font = None) -> list:
+        """
+        Return the row with the values that need styling wrapped in cells
+        """
+
+        if not currency_indices and not fill and not font:
+            return list(row)
+
+        styled_row = []
+        for i, value in enumerate(row):
+            if i not in currency_indices and not fill and not font:
+                styled_row.append(value)
+                continue
+            cell = WriteOnlyCell(worksheet, value=value)
+            if i in currency_indices:
+                cell.number_format = self.currency_format
+            if fill:
+                cell.fill = fill
+            if font:
+                cell.font = font
+            styled_row.append(cell)
+        return styled_row
+
+
+def write_xlsx_stream(rows: Rows, full_path_to_file: str, worksheet_name: str = None,
+                      currency_columns: Sequence[str] = (), has_total_row: bool = True) -> None:
+    """
+    Write the given rows to an Excel file with a single sheet, without keeping them in memory
+
+    See XlsxStreamWriter.write_sheet for the parameters.
+    """
+
+    with XlsxStreamWriter(full_path_to_file) as writer:
+        writer.write_sheet(rows, worksheet_name, currency_columns=currency_columns, has_total_row=has_total_row)
+
+
 def extract_name_from_full_path_to_file(full_path_to_file: str) -> str:
     """
     Extract a sane name from a given filename
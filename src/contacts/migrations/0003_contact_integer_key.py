@@ -0,0 +1,42 @@
+# The primary key of the contacts changes from the UUID to an integer id. The contacts are copied to a new table, which
+# replaces the old one in contacts.0004, after the accounts and transactions refer to the new table.
+
+from django.db import migrations, models
+
+
+def copy_contacts(apps, schema_editor):
+    Contact = apps.get_model('contacts', 'Contact')
+    NewContact = apps.get_model('contacts', 'NewContact')
+    NewContact.objects.bulk_create(
+        (NewContact(uuid=contact.uuid, created_at=contact.created_at, updated_at=contact.updated_at,
+                    name=contact.name, account=contact.account, email=contact.email)
+         for contact in Contact.objects.order_by('created_at', 'uuid').iterator()),
+        batch_size=1000)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0002_auto_20190422_1759'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewContact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('uuid', models.CharField(editable=False, max_length=64, unique=True)),
+                ('name', models.CharField(max_length=64)),
+                ('account', models.CharField(blank=True, default=None, help_text='Bank account of the contact', max_length=64, null=True)),
+                ('email', models.EmailField(blank=True, default=None, max_length=254, null=True, unique=True)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        # The contacts are copied back in contacts.0004, once their old table is restored
+        migrations.RunPython(copy_contacts, migrations.RunPython.noop),
+    ]
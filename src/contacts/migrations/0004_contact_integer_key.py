@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def copy_contacts_back(apps, schema_editor):
+    Contact = apps.get_model('contacts', 'Contact')
+    NewContact = apps.get_model('contacts', 'NewContact')
+    Contact.objects.bulk_create(
+        (Contact(uuid=contact.uuid, created_at=contact.created_at, updated_at=contact.updated_at,
+                 name=contact.name, account=contact.account, email=contact.email)
+         for contact in NewContact.objects.order_by('id').iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_integer_keys'),
+        ('contacts', '0003_contact_integer_key'),
+    ]
+
+    operations = [
+        # Reversed last, when the old table is restored, so the contacts are copied back with their UUID keys
+        migrations.RunPython(migrations.RunPython.noop, copy_contacts_back),
+        migrations.DeleteModel(
+            name='Contact',
+        ),
+        migrations.RenameModel(
+            old_name='NewContact',
+            new_name='Contact',
+        ),
+    ]
@@ -0,0 +1,31 @@
+from typing import Dict, Iterable, Optional
+
+from ledger.models import Account
+
+
+class AccountTable:
+    """
+    Table of the accounts that the lines of a report refer to by primary key
+
+    All lines of a report share one table, so a line only holds the primary key of its account. Accounts that are not
+    in the table yet are fetched when one of them is resolved, all in one query. When the table is pickled, e.g. to
+    cache a report, only the primary keys are kept, and the accounts are fetched again once they are rendered.
+    """
+
+    def __init__(self, accounts: Iterable[Account] = ()):
+        self._accounts = {account.pk: account for account in accounts}  # type: Dict[int, Optional[Account]]
+
+    def __getitem__(self, pk: int) -> Account:
+        if self._accounts.get(pk) is None:
+            self._accounts.setdefault(pk, None)
+            missing_pks = [missing_pk for missing_pk, account in self._accounts.items() if account is None]
+            self._accounts.update(Account.objects.in_bulk(missing_pks))
+            if self._accounts[pk] is None:
+                raise Account.DoesNotExist('Account {} does not exist'.format(pk))
+        return self._accounts[pk]
+
+    def __getstate__(self) -> Dict[str, object]:
+        return {'pks': list(self._accounts)}
+
+    def __setstate__(self, state: Dict[str, object]) -> None:
+        self._accounts = dict.fromkeys(state['pks'])
@@ -1,6 +1,22 @@
 from django.contrib import admin
+from django.db.transaction import atomic
 
-from ledger.models import Ledger, Transaction
+from ledger.models import AccountPeriodTotal, Ledger, Transaction, TransactionLine
+
+
+class TransactionLineInline(admin.TabularInline):
+    model = TransactionLine
+    extra = 0
+
+    # The lines are written by Transaction.save
+    fields = ('account', 'amount')
+    readonly_fields = ('account', 'amount')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Transaction)
@@ -10,8 +26,30 @@ class TransactionAdmin(admin.ModelAdmin):
     list_filter = ('debit_account', 'credit_account', 'contact')
 
     fields = ('uuid', 'created_at', 'updated_at', 'date', 'description', 'invoice_number',
-              'contact', 'debit_account', 'credit_account', 'amount')
-    readonly_fields = ('uuid', 'created_at', 'updated_at')
+              'contact', 'debit_account', 'credit_account', 'amount', 'kind')
+    # Opening and closing entries are made by closing the book year, and are left out of the period totals
+    readonly_fields = ('uuid', 'created_at', 'updated_at', 'kind')
+    inlines = (TransactionLineInline,)
+
+    def has_change_permission(self, request, obj=None):
+        if obj and obj.ledger.is_closed:
+            return False
+        return super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        if obj and obj.ledger.is_closed:
+            return False
+        return super().has_delete_permission(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        # The queryset delete bypasses Transaction.delete, so the period totals and versions are updated here
+        with atomic():
+            transactions = list(queryset.select_related('ledger').prefetch_related('lines'))
+            for transaction in transactions:
+                transaction.check_ledger_is_open()
+            AccountPeriodTotal.objects.remove_transactions(transactions)
+            queryset.delete()
+            Ledger.bump_versions(transaction.ledger_id for transaction in transactions)
 
 
 class TransactionInline(admin.TabularInline):
@@ -20,16 +58,38 @@ class TransactionInline(admin.TabularInline):
     extra = 4
 
     exclude = ('created_at', 'updated_at')
+    readonly_fields = ('kind',)
+
+    def has_add_permission(self, request, obj=None):
+        if obj and obj.is_closed:
+            return False
+        return super().has_add_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        if obj and obj.is_closed:
+            return False
+        return super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        if obj and obj.is_closed:
+            return False
+        return super().has_delete_permission(request, obj)
 
 
 @admin.register(Ledger)
 class LedgerAdmin(admin.ModelAdmin):
-    list_display = ('year',)
+    list_display = ('year', 'closed_at')
 
-    fields = ('year',)
+    fields = ('year', 'closed_at')
+    readonly_fields = ('closed_at',)
     inlines = (TransactionInline,)
 
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
         queryset = queryset.order_by('year')
         return queryset
+
+    def has_delete_permission(self, request, obj=None):
+        if obj and obj.is_closed:
+            return False
+        return super().has_delete_permission(request, obj)
@@ -1,43 +1,93 @@
 from decimal import Decimal
+from functools import reduce
+from operator import or_
 
 import datetime
-from django.db.models import QuerySet, Sum
-from typing import List, Optional
+from django.db.models import Q, QuerySet
+from typing import Iterable, List, Optional, Tuple, Union
 
+from common.database import has_fast_paths
+from common.instrumentation import phase, profiled
 from common.utils import Numeric, write_csv
-from ledger.models import Account, ChartOfAccounts, Transaction
+from ledger.account_table import AccountTable
+from ledger.cache import cache_report, get_cached_report, get_ledger_versions, make_report_key
+from ledger.models import Account, AccountPeriodTotal, ChartOfAccounts, Ledger, Transaction, TransactionLine
+from ledger.totals import AccountTotals, get_account_totals, get_daily_account_totals, get_running_account_totals, \
+    roll_up_totals
 
 
 class BalanceItem:
-    account: Account
-    value: Optional[Numeric]
+    # Balances can hold many items, e.g. in a BalanceSeries, so they only store the primary key of their account
+    __slots__ = ('account_id', 'value', '_account_table')
 
-    def __init__(self, account: Account, value: Numeric = None):
-        self.account = account
-        self.value = Decimal(value).quantize(Decimal('.01')) if value is not None else None
+    def __init__(self, account: Union[Account, int], value: Numeric = None,
+                 account_table: Optional[AccountTable] = None, quantize: bool = True):
+        """
+        :param account: Account, or primary key of an account in the account table
+        :param value: Value of the account on the balance
+        :param account_table: Table in which the account is resolved, shared by all items of a report
+        :param quantize: Whether to round the value to cents. The reports pass False for their sums, which already
+                         are decimals with two decimal places.
+        """
+
+        if isinstance(account, Account):
+            self.account_id = account.pk
+            self._account_table = account_table or AccountTable([account])
+        else:
+            self.account_id = account
+            self._account_table = account_table or AccountTable()
+        self.value = Decimal(value).quantize(Decimal('.01')) if value is not None and quantize else value
+
+    @property
+    def account(self) -> Account:
+        return self._account_table[self.account_id]
 
     def __eq__(self, other):
-        return self.account == other.account and self.value == other.value
+        return self.account_id == other.account_id and self.value == other.value
 
+    def __repr__(self):
+        return 'BalanceItem({}, {})'.format(self.account_id, self.value)
 
-class Balance:
-    debit_balance_items: List[BalanceItem]
-    credit_balance_items: List[BalanceItem]
 
+class Balance:
     equity_code = '1900'
     equity_name = 'Eigen vermogen'
 
-    def __init__(self, date: datetime.date):
+    @profiled('Balance')
+    def __init__(self, date: datetime.date, start_date: Optional[datetime.date] = None, depth: Optional[int] = None):
         """
         Generate a balance on the given date by collecting all transactions prior to this date
+
+        Complete months are taken from the materialized AccountPeriodTotals, only the transactions in the last,
+        incomplete month are summed separately. Book years that are closed are skipped: their balance is carried
+        forward in the opening entries of the next book year.
+
+        With a start date, a difference balance is generated instead: the movements of the accounts from the start
+        date up to and including the date. This equals the balance on the date minus the balance on the day before
+        the start date, but only the transactions in between are summed.
+
+        With a depth, the balance is reported at that depth of the hierarchy of accounts: the accounts below it are
+        folded into their group at that depth, see roll_up_totals.
+
+        The balance is cached until one of the ledgers up to the year of the date changes, see Ledger.version.
         """
 
-        # TODO: Also enable a starting_date, so one can calculate a difference balance
         # TODO: Input for who to make the balance, instead of assuming there is only one user owning transactions
 
         self.date = date
+        self.start_date = start_date
+        self.depth = depth
         self.accounts = Account.objects.filter(type=Account.BALANCE)
-        self._calculate_balance()
+
+        with phase('fetch'):
+            cache_key = make_report_key('balance', self.start_date, self.date, self.depth,
+                                        get_ledger_versions(until_year=self.date.year))
+            cached_items = get_cached_report(cache_key)
+        if cached_items is not None:
+            self.debit_balance_items, self.credit_balance_items = cached_items
+        else:
+            self._calculate_balance()
+            cache_report(cache_key, (self.debit_balance_items, self.credit_balance_items))
 
     # TODO: Write system tests for this function
     def _calculate_balance(self):
@@ -45,62 +95,246 @@ class Balance:
         Calculate and store in the object all balance items
         """
 
-        debit_transactions = Transaction.objects.filter(debit_account__in=self.accounts, date__lte=self.date)
-        credit_transactions = Transaction.objects.filter(credit_account__in=self.accounts, date__lte=self.date)
-        self.debit_balance_items = []
-        self.credit_balance_items = []
-        accounts = self.accounts.order_by('code')
+        with phase('fetch'):
+            equity = self._get_equity_account()
+            if self.start_date is None:
+                sources = self._get_sources(self.date)
+            else:
+                sources = self._get_movement_sources([self.start_date - datetime.timedelta(days=1), self.date])
+            totals = get_account_totals(*sources)
+            accounts = list(self.accounts.exclude(pk=equity.pk).order_by('path'))
+
+        with phase('compute'):
+            if self.depth is not None:
+                totals = roll_up_totals(totals, accounts, self.depth)
+            self._set_balance_items(accounts, equity, totals)
+
+    @classmethod
+    def from_account_totals(cls, date: datetime.date, accounts: List[Account], equity: Account,
+                            totals: AccountTotals, account_table: Optional[AccountTable] = None) -> 'Balance':
+        """
+        Create the balance on the given date from the debit sum and credit sum of every account up to that date,
+        without querying the database
+
+        :param date: Date of the balance
+        :param accounts: Balance accounts other than the equity account, in order of path
+        :param equity: Equity account
+        :param totals: Debit sum and credit sum per account, see get_account_totals
+        :param account_table: Table that holds the accounts, to share it with other balances
+        """
+
+        balance = cls.__new__(cls)
+        balance.date = date
+        balance.start_date = None
+        balance.depth = None
+        balance.accounts = Account.objects.filter(type=Account.BALANCE)
+        balance._set_balance_items(accounts, equity, totals, account_table)
+        return balance
+
+    @classmethod
+    def _get_equity_account(cls) -> Account:
+        """
+        Return the equity account, creating it if it does not exist yet
+        """
+
+        # Add equity item, which is the result of all other transactions
+        # TODO: Take equity from chart of accounts, should not be created here
+        equity, _ = Account.objects.get_or_create(chart=ChartOfAccounts.objects.get(), name=cls.equity_name,
+                                                  defaults={'code': cls.equity_code, 'type': Account.BALANCE,
+                                                            'debit_type': Account.CREDIT})
+        return equity
+
+    def _set_balance_items(self, accounts: List[Account], equity: Account, totals: AccountTotals,
+                           account_table: Optional[AccountTable] = None) -> None:
+        """
+        Store in the object the balance items of the given accounts and the equity account
+        """
+
+        account_table = account_table or AccountTable(accounts + [equity])
+        debit_balance_items = []
+        credit_balance_items = []
         for account in accounts:
-            account_result = self._get_account_result(account, debit_transactions, credit_transactions)
+            debit_sum, credit_sum = totals.get(account.pk, (0, 0))
+            account_result = self._get_account_result(account, debit_sum, credit_sum)
             if account_result == 0:
                 continue
             if account.debit_type == Account.DEBIT:
-                self.debit_balance_items.append(BalanceItem(account, account_result))
+                debit_balance_items.append(BalanceItem(account.pk, account_result, account_table, quantize=False))
             else:
-                self.credit_balance_items.append(BalanceItem(account, account_result))
+                credit_balance_items.append(BalanceItem(account.pk, account_result, account_table, quantize=False))
 
-        # Add equity item, which is the result of all other transactions
-        # TODO: Take equity from chart of accounts, should not be created here
-        equity, _ = Account.objects.get_or_create(chart=ChartOfAccounts.objects.get(), name=self.equity_name,
-                                                  defaults={'code': self.equity_code, 'type': Account.BALANCE,
-                                                            'debit_type': Account.CREDIT})
-        self.credit_balance_items.append(BalanceItem(equity, self.debit_sum - self.credit_sum))
+        # The equity account itself is left out above: since all transactions are in balance, the difference
+        # between the other balance items already includes both its own transactions and the result of the open
+        # book years
+        equity_value = sum([item.value for item in debit_balance_items]) - \
+            sum([item.value for item in credit_balance_items])
+        credit_balance_items.append(BalanceItem(equity.pk, equity_value, account_table))
+        self.debit_balance_items = debit_balance_items
+        self.credit_balance_items = credit_balance_items
+
+    @staticmethod
+    def _get_sources(date: datetime.date) -> Tuple[QuerySet, QuerySet]:
+        """
+        Return the transaction lines and period totals that together make up the balance on the given date
+
+        The balance starts from the opening entries of the first book year after the latest closed one, so closed book
+        years are not summed again. Whole months are read from the period totals, which contain regular transactions
+        only. The transactions of the last, incomplete month and all opening and closing entries are summed from the
+        transaction lines.
+        """
+
+        period_start = AccountPeriodTotal.period_of(date + datetime.timedelta(days=1))
+        lines = TransactionLine.objects.filter(
+            Q(date__gte=period_start, date__lte=date) |
+            Q(kind__in=[Transaction.OPENING, Transaction.CLOSING], date__lte=date))
+        period_totals = AccountPeriodTotal.objects.filter(period__lt=period_start)
+
+        latest_closed_year = Ledger.get_latest_closed_year(before=date.year)
+        if latest_closed_year is not None:
+            lines = lines.filter(ledger__year__gt=latest_closed_year)
+            period_totals = period_totals.filter(ledger__year__gt=latest_closed_year)
+        return lines, period_totals
+
+    @staticmethod
+    def _get_movement_sources(dates: List[datetime.date]) -> Tuple[QuerySet, QuerySet]:
+        """
+        Return the transaction lines and period totals that hold the movements after the first of the given dates, up
+        to and including the last one
 
-    def _get_account_result(self, account: Account, debit_transactions: QuerySet,
-                            credit_transactions: QuerySet) -> Decimal:
+        Opening entries are left out, since they only carry forward the balance of a closed book year, whose
+        transactions are counted already. Months that lie completely between two of the dates are read from the
+        period totals. The months that are split by one of the dates, and all closing entries, are summed from the
+        transaction lines.
         """
-        Get the balance account result from the given transactions
+
+        first_date, last_date = dates[0], dates[-1]
+        split_periods = {AccountPeriodTotal.period_of(date) for date in dates
+                         if date + datetime.timedelta(days=1) != AccountPeriodTotal.next_period_of(date)}
+
+        in_split_period = (Q(date__gte=period, date__lt=AccountPeriodTotal.next_period_of(period))
+                           for period in split_periods)
+        lines = TransactionLine.objects \
+            .filter(date__gt=first_date, date__lte=last_date) \
+            .exclude(kind=Transaction.OPENING) \
+            .filter(reduce(or_, in_split_period, Q(kind=Transaction.CLOSING)))
+        period_totals = AccountPeriodTotal.objects \
+            .filter(period__gt=first_date, period__lte=last_date) \
+            .exclude(period__in=split_periods)
+        return lines, period_totals
+
+    def _get_account_result(self, account: Account, debit_sum: Numeric, credit_sum: Numeric) -> Numeric:
+        """
+        Get the balance account result from the summed debit and credit transactions of the account
 
         For accounts of debit_type 'debit', the result is positive if the debit transactions are greater than the
         credit transactions for this account. For accounts of debit_type 'credit', the result is positive if the
         credit transactions are greater than the debit transactions.
         """
 
-        account_debits = debit_transactions.filter(debit_account=account)
-        account_debits_sum = account_debits.aggregate(Sum('amount'))['amount__sum'] or 0
-        account_credits = credit_transactions.filter(credit_account=account)
-        account_credits_sum = account_credits.aggregate(Sum('amount'))['amount__sum'] or 0
         if account.debit_type == Account.DEBIT:
-            return account_debits_sum - account_credits_sum
+            return debit_sum - credit_sum
         else:
-            return account_credits_sum - account_debits_sum
+            return credit_sum - debit_sum
+
+    @property
+    def debit_balance_items(self) -> List[BalanceItem]:
+        return self._debit_balance_items
+
+    @debit_balance_items.setter
+    def debit_balance_items(self, items: List[BalanceItem]) -> None:
+        self._debit_balance_items = items
+        self._debit_sum = None
+
+    @property
+    def credit_balance_items(self) -> List[BalanceItem]:
+        return self._credit_balance_items
+
+    @credit_balance_items.setter
+    def credit_balance_items(self, items: List[BalanceItem]) -> None:
+        self._credit_balance_items = items
+        self._credit_sum = None
 
     @property
     def debit_sum(self) -> Decimal:
         """
         Return the sum of all debit balance items
+
+        The sum is computed once, until other debit balance items are set.
         """
 
-        return sum([item.value for item in self.debit_balance_items])
+        if self._debit_sum is None:
+            self._debit_sum = sum([item.value for item in self.debit_balance_items])
+        return self._debit_sum
 
     @property
     def credit_sum(self) -> Decimal:
         """
         Return the sum of all credit balance items
+
+        The sum is computed once, until other credit balance items are set.
         """
 
-        return sum([item.value for item in self.credit_balance_items])
+        if self._credit_sum is None:
+            self._credit_sum = sum([item.value for item in self.credit_balance_items])
+        return self._credit_sum
 
     @property
     def total_line(self) -> [str, str, str, str]:
         return ['Total', str(self.debit_sum), 'Total', str(self.credit_sum)]
+
+
+class BalanceSeries:
+    balances: List[Balance]
+
+    @profiled('BalanceSeries')
+    def __init__(self, dates: Iterable[datetime.date]):
+        """
+        Generate the balances on all given dates, e.g. every month end of a book year, in order of date
+
+        The balance on the first date is summed like a single Balance. The balances on the other dates are found by
+        adding the movements since the first date, which are fetched per day in a single query and then added up in
+        one ordered pass. This is much cheaper than summing the complete history for each date. On PostgreSQL, the
+        database adds up the movements with window functions instead, in the same query as the balance on the first
+        date, so every date only takes the latest running sums.
+        """
+
+        self.dates = sorted(set(dates))
+        assert self.dates, 'Pass at least one date'
+
+        with phase('fetch'):
+            equity = Balance._get_equity_account()
+            accounts = list(Account.objects.filter(type=Account.BALANCE).exclude(pk=equity.pk).order_by('path'))
+            running = has_fast_paths()
+            if running:
+                totals = {}
+                daily_totals = get_running_account_totals(Balance._get_sources(self.dates[0]),
+                                                          Balance._get_movement_sources(self.dates))
+            else:
+                totals = get_account_totals(*Balance._get_sources(self.dates[0]))
+                daily_totals = get_daily_account_totals(*Balance._get_movement_sources(self.dates))
+
+        with phase('compute'):
+            account_table = AccountTable(accounts + [equity])
+            self.balances = []
+            days = sorted(daily_totals)
+            day_index = 0
+            for date in self.dates:
+                while day_index < len(days) and days[day_index] <= date:
+                    if running:
+                        totals.update(daily_totals[days[day_index]])
+                        day_index += 1
+                        continue
+                    for account_pk, (debit, credit) in daily_totals[days[day_index]].items():
+                        debit_sum, credit_sum = totals.get(account_pk, (0, 0))
+                        totals[account_pk] = (debit_sum + debit, credit_sum + credit)
+                    day_index += 1
+                self.balances.append(Balance.from_account_totals(date, accounts, equity, totals, account_table))
+
+
+def get_month_ends(year: int) -> List[datetime.date]:
+    """
+    Return the last day of every month of the given year
+    """
+
+    return [AccountPeriodTotal.next_period_of(datetime.date(year=year, month=month, day=1)) -
+            datetime.timedelta(days=1) for month in range(1, 13)]
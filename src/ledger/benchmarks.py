@@ -0,0 +1,348 @@
+import inspect
+import json
+import logging
+import os.path
+import random
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+
+import datetime
+from django.core.management import call_command
+from django.db import connection
+from django.db.transaction import atomic
+from django.test.utils import override_settings
+from django.utils import timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from accounts.models import Account, ChartOfAccounts
+from common.instrumentation import Profiler
+from contacts.models import Contact
+from ledger.balance import Balance
+from ledger.cache import get_report_cache
+from ledger.exporters import LedgerExporter
+from ledger.importers import LedgerImporter
+from ledger.models import AccountPeriodTotal, Ledger, Transaction
+from ledger.profit_loss import ProfitLoss
+from ledger.totals import DECIMAL_ENGINE, ENGINES
+
+Result = Dict[str, object]  # Measurement of one benchmark at one size
+
+
+class SyntheticLedgerGenerator:
+    """
+    Generate a realistic, reproducible bookkeeping: the default chart of accounts, contacts and ledgers of several
+    years filled with transactions
+
+    The same seed always generates the same contents, so benchmark runs on different versions of the code can be
+    compared.
+    """
+
+    def __init__(self, seed: int = 0, nr_contacts: int = 50, batch_size: int = 5000):
+        self.random = random.Random(seed)
+        self.nr_contacts = nr_contacts
+        self.batch_size = batch_size
+        self.contacts = []  # type: List[Contact]
+
+    def generate(self, years: List[int], nr_transactions: int) -> List[Ledger]:
+        """
+        Generate ledgers for the given years with nr_transactions transactions in total, spread evenly over the years
+
+        :return: The generated ledgers
+        """
+
+        chart = self.generate_chart()
+        contacts = self.generate_contacts()
+        # Transactions are booked on the accounts, not on the groups they belong to
+        accounts = Account.objects.filter(chart=chart, children__isnull=True).order_by('code')
+        profit_loss_accounts = list(accounts.filter(type=Account.PROFIT_LOSS))
+        balance_accounts = list(accounts.filter(type=Account.BALANCE))
+
+        ledgers = []
+        for index, year in enumerate(years):
+            ledger, _ = Ledger.objects.get_or_create(chart=chart, year=year)
+            # The first years get the remainder, so the total number of transactions is exact
+            nr_in_year = nr_transactions // len(years) + (1 if index < nr_transactions % len(years) else 0)
+            transactions = self._generate_transactions(ledger, nr_in_year, profit_loss_accounts, balance_accounts,
+                                                       contacts)
+            self._save_transactions(transactions)
+            ledgers.append(ledger)
+        return ledgers
+
+    def generate_chart(self) -> ChartOfAccounts:
+        """
+        Return the chart of accounts, creating the default one if there is none yet
+        """
+
+        if not ChartOfAccounts.objects.exists():
+            call_command('add_default_accounts')
+        return ChartOfAccounts.objects.get()
+
+    def generate_contacts(self) -> List[Contact]:
+        """
+        Create the contacts that are linked to part of the transactions
+        """
+
+        now = timezone.now()
+        contacts = [Contact(uuid=Contact.generate_uuid(), created_at=now, updated_at=now,
+                            name='Contact {:04d}'.format(number), account='NL00BANK{:010d}'.format(number))
+                    for number in range(1, self.nr_contacts + 1)]
+        Contact.objects.bulk_create(contacts)
+        self.contacts = list(Contact.objects.filter(uuid__in=[contact.uuid for contact in contacts]).order_by('name'))
+        return self.contacts
+
+    def _generate_transactions(self, ledger: Ledger, nr_transactions: int, profit_loss_accounts: List[Account],
+                               balance_accounts: List[Account], contacts: List[Contact]) -> Iterator[Transaction]:
+        """
+        Generate transactions in the given ledger, in order of date
+
+        Most transactions book a cost or revenue against a balance account, the others move money between two balance
+        accounts.
+        """
+
+        start_of_year = datetime.date(year=ledger.year, month=1, day=1)
+        nr_days = (datetime.date(year=ledger.year, month=12, day=31) - start_of_year).days + 1
+        days = sorted(self.random.randrange(nr_days) for _ in range(nr_transactions))
+        for number, day in enumerate(days, start=1):
+            balance_account = self.random.choice(balance_accounts)
+            if self.random.random() < 0.8:
+                other_account = self.random.choice(profit_loss_accounts)
+            else:
+                other_account = self.random.choice([account for account in balance_accounts
+                                                    if account != balance_account])
+            if self.random.random() < 0.5:
+                debit_account, credit_account = balance_account, other_account
+            else:
+                debit_account, credit_account = other_account, balance_account
+            contact = self.random.choice(contacts) if contacts and self.random.random() < 0.3 else None
+            yield Transaction(ledger=ledger, date=start_of_year + datetime.timedelta(days=day),
+                              description='Transaction {} {:07d}'.format(ledger.year, number),
+                              invoice_number='INV{}{:07d}'.format(ledger.year, number) if contact else '',
+                              contact=contact, debit_account=debit_account, credit_account=credit_account,
+                              amount=Decimal(self.random.randrange(100, 500000)) / 100)
+
+    def _save_transactions(self, transactions: Iterator[Transaction]) -> None:
+        """
+        Write the given transactions in batches, including their lines and period totals
+        """
+
+        batch = []
+        with atomic():
+            for transaction in transactions:
+                now = timezone.now()
+                transaction.uuid = Transaction.generate_uuid()
+                transaction.created_at = transaction.updated_at = now
+                transaction.fingerprint = transaction.make_fingerprint()
+                batch.append(transaction)
+                if len(batch) >= self.batch_size:
+                    self._save_batch(batch)
+                    batch = []
+            self._save_batch(batch)
+
+    @staticmethod
+    def _save_batch(batch: List[Transaction]) -> None:
+        Transaction.objects.bulk_create_with_lines(batch)
+        Ledger.bump_versions(transaction.ledger_id for transaction in batch)
+
+
+@contextmanager
+def measure(result: Result) -> Iterator[Result]:
+    """
+    Measure the wall time, the queries and the peak memory of the enclosed code, and store them in result
+
+    The peak memory is the maximum of the memory allocated by Python, measured with tracemalloc. Tracing the memory
+    slows down the code, so wall times are only comparable with other measurements that trace the memory as well.
+    """
+
+    tracemalloc.start()
+    try:
+        with Profiler(result['name'], log_level=logging.DEBUG) as profiler:
+            yield result
+    finally:
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        report = profiler.report()
+        result.update(wall_time=report['wall_time'], queries=report['queries'], sql_time=report['sql_time'],
+                      phases=report['phases'])
+
+
+class BenchmarkSuite:
+    """
+    Time the reports, the importer and the exporter on synthetic ledgers of several sizes
+
+    For each size, the database is filled with that number of transactions, which are removed again afterwards. Each
+    benchmark is run once per size, on the ledger of the last year. The reports are run with every engine, whose
+    results are checked to be exactly equal first.
+    """
+
+    default_sizes = (10000, 100000, 1000000)
+
+    def __init__(self, output_dir: str, sizes: List[int] = default_sizes, nr_years: int = 3, seed: int = 0,
+                 log: Optional[Callable[[str], None]] = None):
+        """
+        :param output_dir: Directory for the exported and imported files
+        :param sizes: Total numbers of transactions to run the benchmarks with
+        :param nr_years: Number of book years the transactions are spread over
+        :param seed: Seed of the generated contents
+        :param log: Function that is called with a message for every finished benchmark
+        """
+
+        self.output_dir = output_dir
+        self.sizes = sizes
+        self.nr_years = nr_years
+        self.seed = seed
+        self.log = log or (lambda message: None)
+        self.engine_mismatches = []  # type: List[Dict[str, object]]
+
+    def run(self) -> Dict[str, object]:
+        """
+        Run all benchmarks at all sizes
+
+        :return: Dictionary with the settings of the run and a list of results
+        """
+
+        results = []
+        for size in self.sizes:
+            results.extend(self.run_size(size))
+        return {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'seed': self.seed,
+            'nr_years': self.nr_years,
+            'results': results,
+            'engine_mismatches': self.engine_mismatches,
+        }
+
+    def run_size(self, size: int) -> List[Result]:
+        years = list(range(2018, 2018 + self.nr_years))
+        generator = SyntheticLedgerGenerator(seed=self.seed)
+        ledgers = generator.generate(years, size)
+        try:
+            for name in self.verify_engines(ledgers[-1]):
+                self.log('{} ({} transactions): results differ from the decimal engine'.format(name, size))
+                self.engine_mismatches.append({'name': name, 'size': size})
+            return [self._run_benchmark(name, size, function, preparation)
+                    for name, function, preparation in self._get_benchmarks(ledgers[-1])]
+        finally:
+            with atomic():
+                Ledger.objects.filter(pk__in=[ledger.pk for ledger in ledgers]).delete()
+                Contact.objects.filter(pk__in=[contact.pk for contact in generator.contacts]).delete()
+
+    def _get_benchmarks(self, ledger: Ledger) -> Iterator[Tuple[str, Callable, Optional[Callable]]]:
+        """
+        Generate the name, the function and the preparation of each benchmark on the given ledger, in the order they
+        are run. The preparation is not measured.
+
+        The importer is benchmarked last: it imports the exported ledger, after its transactions are removed.
+        """
+
+        end_of_year = datetime.date(year=ledger.year, month=12, day=31)
+        for engine in ENGINES:
+            with_engine = override_settings(REPORT_ENGINE=engine)
+            yield 'balance[{}]'.format(engine), with_engine(lambda: Balance(end_of_year)), None
+            yield 'profit_loss[{}]'.format(engine), with_engine(lambda: ProfitLoss(ledger)), None
+        for method_name in self.get_exporter_methods():
+            path = os.path.join(self.output_dir, '{}.xlsx'.format(method_name))
+            yield ('exporter.{}'.format(method_name),
+                   lambda method_name=method_name, path=path: getattr(LedgerExporter(ledger), method_name)(path),
+                   None)
+
+        import_path = os.path.join(self.output_dir, 'import.xlsx')
+
+        def prepare_import():
+            LedgerExporter(ledger).write_ledger_to_xlsx(import_path)
+            with atomic():
+                AccountPeriodTotal.objects.filter(ledger=ledger).delete()
+                ledger.transactions.all().delete()
+                Ledger.bump_versions([ledger.pk])
+
+        yield 'importer', lambda: LedgerImporter().import_transactions_from_xlsx(import_path), prepare_import
+
+    @staticmethod
+    def verify_engines(ledger: Ledger) -> List[str]:
+        """
+        Compute the balance and the profit loss of the given ledger with every engine, see ledger.totals
+
+        :return: Names of the reports of which the results of an engine differ from those of the decimal engine
+        """
+
+        end_of_year = datetime.date(year=ledger.year, month=12, day=31)
+        results = {}
+        for engine in ENGINES:
+            with override_settings(REPORT_ENGINE=engine):
+                get_report_cache().clear()
+                balance = Balance(end_of_year)
+                profit_loss = ProfitLoss(ledger)
+            results[engine] = {
+                'balance': [(item.account.pk, item.value)
+                            for item in balance.debit_balance_items + balance.credit_balance_items],
+                'profit_loss': [(line.account.pk, line.debit, line.credit)
+                                for line in profit_loss.profit_loss_lines + [profit_loss.total] if line],
+            }
+        return ['{}[{}]'.format(name, engine) for engine in ENGINES for name, result in results[engine].items()
+                if result != results[DECIMAL_ENGINE][name]]
+
+    @staticmethod
+    def get_exporter_methods() -> List[str]:
+        """
+        Return the names of the write_* methods of the exporter that only need the path to the file, i.e. all other
+        parameters have a default
+        """
+
+        method_names = []
+        for name, method in inspect.getmembers(LedgerExporter, inspect.isfunction):
+            parameters = list(inspect.signature(method).parameters.values())
+            if name.startswith('write_') and [parameter.name for parameter in parameters[:2]] == \
+                    ['self', 'full_path_to_file'] and \
+                    all(parameter.default is not parameter.empty for parameter in parameters[2:]):
+                method_names.append(name)
+        return method_names
+
+    def _run_benchmark(self, name: str, size: int, function: Callable, preparation: Optional[Callable]) -> Result:
+        if preparation:
+            preparation()
+        # Measure the computation of the reports, not the cache
+        get_report_cache().clear()
+        with measure({'name': name, 'size': size}) as result:
+            function()
+        self.log('{name} ({size} transactions): {wall_time:.3f} s, {queries} queries, {peak_memory} bytes'
+                 .format(**result))
+        return result
+
+
+def save_results(results: Dict[str, object], full_path_to_file: str) -> None:
+    with open(full_path_to_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(full_path_to_file: str) -> Dict[str, object]:
+    with open(full_path_to_file) as f:
+        return json.load(f)
+
+
+def compare_results(results: Dict[str, object], baseline: Dict[str, object],
+                    tolerance: float = 0.2) -> List[Dict[str, object]]:
+    """
+    Compare the results of a benchmark run with those of a baseline run
+
+    :param results: Results of the current run
+    :param baseline: Results of an earlier run
+    :param tolerance: Relative increase of the wall time or the peak memory that is not considered a regression
+    :return: For every benchmark in both runs, the relative change of each measurement and whether it regressed
+    """
+
+    baseline_results = {(result['name'], result['size']): result for result in baseline['results']}
+    comparisons = []
+    for result in results['results']:
+        baseline_result = baseline_results.get((result['name'], result['size']))
+        if not baseline_result:
+            continue
+        comparison = {'name': result['name'], 'size': result['size']}
+        for key in ('wall_time', 'queries', 'peak_memory'):
+            comparison[key] = result[key] / baseline_result[key] if baseline_result[key] else None
+        # Any extra query is a regression, since the number of queries does not depend on the machine
+        comparison['regression'] = result['queries'] > baseline_result['queries'] or \
+            any(comparison[key] is not None and comparison[key] > 1 + tolerance
+                for key in ('wall_time', 'peak_memory'))
+        comparisons.append(comparison)
+    return comparisons
@@ -0,0 +1,51 @@
+import hashlib
+
+from django.core.cache import BaseCache, caches
+from django.db.transaction import on_commit
+from typing import List, Optional, Tuple
+
+from ledger.models import Ledger
+
+REPORT_CACHE = 'reports'  # Alias of the cache in settings.CACHES
+
+
+def get_report_cache() -> BaseCache:
+    return caches[REPORT_CACHE]
+
+
+def make_report_key(report_type: str, *parts) -> str:
+    """
+    Return the cache key of a report of the given type, which is computed from the given parts
+
+    The parts must contain the versions of all ledgers the report is based on, so the key changes with every change
+    of their transactions.
+    """
+
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return 'report:{}:{}'.format(report_type, digest)
+
+
+def get_ledger_versions(until_year: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Return the primary key and the version of all ledgers, or of the ledgers up to and including the given year
+    """
+
+    ledgers = Ledger.objects.order_by('pk')
+    if until_year is not None:
+        ledgers = ledgers.filter(year__lte=until_year)
+    return list(ledgers.values_list('pk', 'version'))
+
+
+def get_cached_report(key: str) -> Optional[object]:
+    return get_report_cache().get(key)
+
+
+def cache_report(key: str, value: object) -> None:
+    """
+    Store the given report in the cache once the current database transaction is committed
+
+    A report that is computed inside a transaction that is rolled back is never stored, since the versions it is
+    stored with are rolled back as well and could be used again for other contents.
+    """
+
+    on_commit(lambda: get_report_cache().set(key, value))
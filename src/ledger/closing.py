@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+import datetime
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from common.instrumentation import profiled
+from ledger.balance import Balance
+from ledger.models import Account, Ledger, LedgerClosedError, Transaction
+from ledger.profit_loss import ProfitLoss
+
+
+@profiled()
+def close_ledger(ledger: Ledger) -> Ledger:
+    """
+    Close the book year of the given ledger
+
+    The result of every profit/loss account is moved into the equity account with closing entries at the end of the
+    year. The balance at the end of the year is carried forward to the ledger of the next year with opening entries,
+    against the equity account. After closing, the transactions of the ledger can no longer be changed.
+
+    :param ledger: Ledger to close
+    :return: Ledger of the next book year, holding the opening entries
+    """
+
+    check_ledger_can_be_closed(ledger)
+    end_of_year = datetime.date(year=ledger.year, month=12, day=31)
+    with atomic():
+        balance = Balance(end_of_year)
+        equity = balance.credit_balance_items[-1].account
+
+        profit_loss = ProfitLoss(ledger)
+        for line in profit_loss.profit_loss_lines:
+            # A debit line means the account was credited more than debited
+            _create_entry(ledger, end_of_year, Transaction.CLOSING, 'Closing {}'.format(line.account.name),
+                          line.account, equity, (line.debit or 0) - (line.credit or 0))
+
+        next_ledger, _ = Ledger.objects.get_or_create(chart=ledger.chart, year=ledger.year + 1)
+        if next_ledger.is_closed:
+            raise LedgerClosedError('Ledger {} is already closed'.format(next_ledger))
+        next_ledger.transactions.filter(kind=Transaction.OPENING).delete()
+        Ledger.bump_versions([next_ledger.pk])
+        start_of_next_year = end_of_year + datetime.timedelta(days=1)
+        for item in balance.debit_balance_items:
+            _create_entry(next_ledger, start_of_next_year, Transaction.OPENING,
+                          'Opening balance {}'.format(item.account.name), item.account, equity, item.value)
+        for item in balance.credit_balance_items[:-1]:
+            _create_entry(next_ledger, start_of_next_year, Transaction.OPENING,
+                          'Opening balance {}'.format(item.account.name), equity, item.account, item.value)
+
+        ledger.closed_at = timezone.now()
+        ledger.save()
+    return next_ledger
+
+
+def check_ledger_can_be_closed(ledger: Ledger) -> None:
+    """
+    Raise a LedgerClosedError if the book year of the given ledger cannot be closed
+    """
+
+    if ledger.is_closed:
+        raise LedgerClosedError('Ledger {} is already closed'.format(ledger))
+    if Ledger.objects.filter(chart=ledger.chart, year__lt=ledger.year, closed_at__isnull=True).exists():
+        raise LedgerClosedError('All ledgers before {} must be closed first'.format(ledger))
+    if Ledger.objects.filter(chart=ledger.chart, year=ledger.year + 1, closed_at__isnull=False).exists():
+        raise LedgerClosedError('Ledger {} is already closed'.format(ledger.year + 1))
+
+
+def reopen_ledger(ledger: Ledger) -> None:
+    """
+    Undo the closing of the given ledger, by removing its closing entries and the opening entries of the next year
+    """
+
+    if Ledger.objects.filter(chart=ledger.chart, year__gt=ledger.year, closed_at__isnull=False).exists():
+        raise LedgerClosedError('All ledgers after {} must be reopened first'.format(ledger))
+
+    with atomic():
+        ledger.closed_at = None
+        ledger.save()
+        ledger.transactions.filter(kind=Transaction.CLOSING).delete()
+        next_ledgers = Ledger.objects.filter(chart=ledger.chart, year=ledger.year + 1)
+        Transaction.objects.filter(ledger__in=next_ledgers, kind=Transaction.OPENING).delete()
+        Ledger.bump_versions([ledger.pk] + [next_ledger.pk for next_ledger in next_ledgers])
+
+
+def _create_entry(ledger: Ledger, date: datetime.date, kind: str, description: str,
+                  debit_account: Account, credit_account: Account, amount: Decimal) -> None:
+    """
+    Create an opening or closing entry, swapping the accounts if the amount is negative
+    """
+
+    if amount < 0:
+        debit_account, credit_account, amount = credit_account, debit_account, -amount
+    if amount == 0:
+        return
+    Transaction.objects.create(ledger=ledger, date=date, kind=kind, description=description,
+                               debit_account=debit_account, credit_account=credit_account, amount=amount)
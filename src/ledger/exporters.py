@@ -1,27 +1,80 @@
+import calendar
 import os.path
+from decimal import Decimal
 
+import datetime
 from django.utils import timezone
+from django.utils.functional import cached_property
+from openpyxl.utils import get_column_letter
+from typing import Iterable, List, Optional, Tuple
 
-from common.utils import Matrix, concatenate_matrices, sum_available_elements, write_xlsx
-from ledger.balance import Balance
-from ledger.models import Ledger
-from ledger.profit_loss import ProfitLoss
+from common.instrumentation import profiled
+from common.utils import Matrix, Rows, XlsxStreamWriter, concatenate_matrices, sum_available_elements, write_xlsx, \
+    write_xlsx_stream
+from ledger.balance import Balance, BalanceItem, BalanceSeries, get_month_ends
+from ledger.general_ledger import GeneralLedger, GeneralLedgerEntry
+from ledger.models import Account, Ledger
+from ledger.profit_loss import ProfitLoss, ProfitLossCube
 
 
 class LedgerExporter:
+    chunk_size = 2000  # Number of transactions fetched from the database at once
+
     def __init__(self, ledger: Ledger):
         self.ledger = ledger
-        self.profit_loss = ProfitLoss(ledger=self.ledger)
+
+    @cached_property
+    def profit_loss(self) -> ProfitLoss:
+        """
+        Profit loss of the ledger, computed on first access
+        """
+
+        return ProfitLoss(ledger=self.ledger)
+
+    @cached_property
+    def balance(self) -> Balance:
+        """
+        Balance at the end of the book year of the ledger, computed on first access
+        """
+
         end_of_year = timezone.datetime(year=self.ledger.year, month=12, day=31).date()
-        self.balance = Balance(end_of_year)
+        return Balance(end_of_year)
 
+    @profiled()
     def write_ledger_to_xlsx(self, full_path_to_file: str) -> None:
+        """
+        Write all transactions of the ledger to an Excel file, streaming the rows to the file
+
+        :param full_path_to_file: Full path to a file
+        """
+
         # TODO: Remove contact from transaction, it's already on the associated account
-        # TODO: Support transactions with multiple credit and debit accounts
-        # TODO: Set the value columns to currency €
         contents = self._generate_contents_from_ledger(self.ledger)
-        write_xlsx(contents, full_path_to_file)
+        write_xlsx_stream(contents, full_path_to_file, currency_columns=('H', 'I'), has_total_row=False)
+
+    @profiled()
+    def write_general_ledger_to_xlsx(self, full_path_to_file: str,
+                                     accounts: Optional[Iterable[Account]] = None) -> None:
+        """
+        Write every mutation of the accounts in the ledger to an Excel file, with a worksheet per account that starts
+        with its opening balance and shows its balance after every mutation, streaming the rows to the file
 
+        :param full_path_to_file: Full path to a file
+        :param accounts: Accounts to write, by default all accounts that have an opening balance or any mutations
+        """
+
+        general_ledger = GeneralLedger(self.ledger, accounts)
+        with XlsxStreamWriter(full_path_to_file) as writer:
+            for account, opening_balance, entries in general_ledger.generate_accounts():
+                contents = self._generate_contents_from_general_ledger_account(general_ledger, opening_balance, entries)
+                # Account names can hold characters that are not allowed in worksheet names, codes cannot
+                writer.write_sheet(contents, account.code, currency_columns=('D', 'E', 'F'))
+            if not writer.workbook.worksheets:
+                # A workbook needs at least one worksheet
+                contents = self._generate_contents_from_general_ledger_account(general_ledger, Decimal(0), [])
+                writer.write_sheet(contents, 'General ledger', currency_columns=('D', 'E', 'F'))
+
+    @profiled()
     def write_profit_loss_to_xlsx(self, full_path_to_file: str) -> None:
         """
         Write the given profit loss to an Excel file
@@ -32,6 +85,7 @@ class LedgerExporter:
         contents = self._generate_contents_from_profit_loss(self.profit_loss)
         write_xlsx(contents, full_path_to_file)
 
+    @profiled()
     def write_balance_to_xlsx(self, full_path_to_file: str) -> None:
         """
         Write the given balance to an Excel file
@@ -42,6 +96,49 @@ class LedgerExporter:
         contents = self._generate_contents_from_balance(self.balance)
         write_xlsx(contents, full_path_to_file)
 
+    @profiled()
+    def write_balance_series_to_xlsx(self, full_path_to_file: str,
+                                     dates: Optional[List[datetime.date]] = None) -> None:
+        """
+        Write the balances on the given dates to an Excel file, in a single worksheet with a column per date
+
+        :param full_path_to_file: Full path to a file
+        :param dates: Dates of the balances, by default the end of every month of the book year
+        """
+
+        balance_series = BalanceSeries(dates or get_month_ends(self.ledger.year))
+        contents = self._generate_contents_from_balance_series(balance_series)
+        # The first two columns hold the account, the others hold the amounts
+        currency_columns = [get_column_letter(index) for index in range(3, len(contents[0]) + 1)]
+        write_xlsx(contents, full_path_to_file, currency_columns=currency_columns)
+
+    @profiled()
+    def write_profit_loss_comparison_to_xlsx(self, full_path_to_file: str, nr_years: int = 5) -> None:
+        """
+        Write the profit loss of the book year of the ledger and the years before it to an Excel file
+
+        The first worksheet compares the results per account year over year, the second one shows the monthly trend
+        per account.
+
+        :param full_path_to_file: Full path to a file
+        :param nr_years: Number of book years to compare, up to and including the year of the ledger
+        """
+
+        cube = ProfitLossCube(range(self.ledger.year - nr_years + 1, self.ledger.year + 1))
+        if os.path.splitext(full_path_to_file)[-1] == '':
+            full_path_to_file += '.xlsx'
+
+        years_contents = self._generate_year_contents_from_profit_loss_cube(cube)
+        currency_columns = [get_column_letter(index) for index in range(3, len(years_contents[0]) + 1)]
+        workbook = write_xlsx(years_contents, full_path_to_file, worksheet_name='Years',
+                              currency_columns=currency_columns)
+
+        months_contents = self._generate_month_contents_from_profit_loss_cube(cube)
+        currency_columns = [get_column_letter(index) for index in range(4, len(months_contents[0]) + 1)]
+        write_xlsx(months_contents, full_path_to_file, workbook=workbook, worksheet_name='Months',
+                   currency_columns=currency_columns)
+
+    @profiled()
     def write_full_financials_to_xlsx(self, full_path_to_file: str) -> None:
         """
         Write the given profit loss and balance to an Excel file, each in a separate worksheet
@@ -57,21 +154,59 @@ class LedgerExporter:
         balance_contents = self._generate_contents_from_balance(self.balance)
         write_xlsx(balance_contents, full_path_to_file, workbook=workbook, worksheet_name='Balance')
 
-    def _generate_contents_from_ledger(self, ledger: Ledger) -> Matrix:
-        transactions = ledger.transactions.all()
-        header = ['ID', 'Date', 'Description', 'Invoice number', 'Contact',
-                  'Account code', 'Account name', 'Debit', 'Credit']
-        contents = [header]
-        for index, transaction in enumerate(transactions, start=1):
-            debit_contact = transaction.debit_account.contact.name if transaction.debit_account.contact else None
-            credit_contact = transaction.credit_account.contact.name if transaction.credit_account.contact else None
-            contents.append(
-                [index, transaction.date, transaction.description, transaction.invoice_number, debit_contact,
-                 transaction.debit_account.code, transaction.debit_account.name, transaction.amount, None])
-            contents.append([None, None, None, None, credit_contact,
-                             transaction.credit_account.code, transaction.credit_account.name, None,
-                             transaction.amount])
-        return contents
+    def _generate_contents_from_ledger(self, ledger: Ledger) -> Rows:
+        """
+        Generate the contents from a Ledger, one row at a time
+
+        Each transaction line is a row, and the first row of a transaction holds its ID, date, description and invoice
+        number. The transactions, the accounts and their contacts are fetched in the same query as the lines, which
+        are read in chunks. On PostgreSQL, the chunks are read from a server-side cursor, so the database does not send
+        all lines at once either.
+
+        :param ledger: Ledger to export
+        :return: Matrix-shaped contents
+        """
+
+        lines = ledger.transaction_lines.select_related('transaction', 'account__contact') \
+            .order_by('date', 'transaction__description', 'transaction', 'pk')
+        yield ['ID', 'Date', 'Description', 'Invoice number', 'Contact',
+               'Account code', 'Account name', 'Debit', 'Credit']
+        index, transaction_id = 0, None
+        for line in lines.iterator(chunk_size=self.chunk_size):
+            contact = line.account.contact.name if line.account.contact else None
+            debit, credit = (line.amount, None) if line.amount >= 0 else (None, -line.amount)
+            if line.transaction_id != transaction_id:
+                index, transaction_id = index + 1, line.transaction_id
+                transaction = line.transaction
+                yield [index, transaction.date, transaction.description, transaction.invoice_number, contact,
+                       line.account.code, line.account.name, debit, credit]
+            else:
+                yield [None, None, None, None, contact, line.account.code, line.account.name, debit, credit]
+
+    @staticmethod
+    def _generate_contents_from_general_ledger_account(general_ledger: GeneralLedger, opening_balance: Decimal,
+                                                       entries: Iterable[GeneralLedgerEntry]) -> Rows:
+        """
+        Generate the contents of one account of a GeneralLedger, one row at a time
+
+        The first row after the header holds the opening balance, the last row the total mutations and the closing
+        balance.
+
+        :param general_ledger: GeneralLedger the account belongs to
+        :param opening_balance: Opening balance of the account
+        :param entries: Transaction lines of the account, with the balance after each line
+        :return: Matrix-shaped contents
+        """
+
+        yield ['Date', 'Description', 'Invoice number', 'Debit', 'Credit', 'Balance']
+        yield [general_ledger.start_date, 'Opening balance', None, None, None, opening_balance]
+        total_debit, total_credit, balance = Decimal(0), Decimal(0), opening_balance
+        for line, balance in entries:
+            debit, credit = (line.amount, None) if line.amount >= 0 else (None, -line.amount)
+            total_debit += debit or 0
+            total_credit += credit or 0
+            yield [line.date, line.transaction.description, line.transaction.invoice_number, debit, credit, balance]
+        yield [general_ledger.end_date, 'Closing balance', None, total_debit, total_credit, balance]
 
     def _generate_contents_from_profit_loss(self, profit_loss) -> Matrix:
         """
@@ -86,8 +221,9 @@ class LedgerExporter:
         for line in profit_loss.profit_loss_lines:
             contents.append([line.account.code, line.account.name, line.debit, line.credit])
 
-        total_debit = sum_available_elements(line.debit for line in profit_loss.profit_loss_lines)
-        total_credit = sum_available_elements(line.credit for line in profit_loss.profit_loss_lines)
+        # A side without any amounts counts as zero
+        total_debit = sum_available_elements(line.debit for line in profit_loss.profit_loss_lines) or 0
+        total_credit = sum_available_elements(line.credit for line in profit_loss.profit_loss_lines) or 0
         # TODO: Create a transaction that goes on the balance
         if total_debit > total_credit:
             profit = total_debit - total_credit
@@ -122,3 +258,90 @@ class LedgerExporter:
         contents = concatenate_matrices(debit_contents, credit_contents)
         contents.append([None, 'Total', total, None, 'Total', total])
         return contents
+
+    def _generate_contents_from_balance_series(self, balance_series: BalanceSeries) -> Matrix:
+        """
+        Generate the contents from a BalanceSeries, with a row per account and a column per date
+
+        The debit accounts come first, followed by the credit accounts. Each side ends with its total.
+
+        :param balance_series: BalanceSeries to export
+        :return: Matrix-shaped contents
+        """
+
+        balances = balance_series.balances
+        contents = [['Account', 'Description'] + [balance.date for balance in balances]]
+        for account, values in self._get_values_per_account([balance.debit_balance_items for balance in balances]):
+            contents.append([account.code, account.name] + values)
+        contents.append([None, 'Total debit'] + [balance.debit_sum for balance in balances])
+        for account, values in self._get_values_per_account([balance.credit_balance_items for balance in balances]):
+            contents.append([account.code, account.name] + values)
+        contents.append([None, 'Total credit'] + [balance.credit_sum for balance in balances])
+        return contents
+
+    @staticmethod
+    def _get_values_per_account(items_per_date: List[List[BalanceItem]]) -> List[Tuple[Account, List[Decimal]]]:
+        """
+        Return every account that has an item on any of the dates, with its value on each date
+
+        The accounts are ordered by code, except for the equity account, which comes last like in a Balance.
+        """
+
+        accounts = {}
+        values = {}
+        for column, items in enumerate(items_per_date):
+            for item in items:
+                if item.account_id not in accounts:
+                    accounts[item.account_id] = item.account
+                values.setdefault(item.account_id, [None] * len(items_per_date))[column] = item.value
+        ordered_accounts = sorted(accounts.values(),
+                                  key=lambda account: (account.name == Balance.equity_name, account.code))
+        return [(account, values[account.pk]) for account in ordered_accounts]
+
+    def _generate_year_contents_from_profit_loss_cube(self, cube: ProfitLossCube) -> Matrix:
+        """
+        Generate the contents from a ProfitLossCube, with a row per account, a column with the result of each year
+        and a column with the change of each year compared to the year before
+
+        :param cube: ProfitLossCube to export
+        :return: Matrix-shaped contents
+        """
+
+        header = ['Account', 'Description'] + cube.years + \
+            ['Change {}'.format(year) for year in cube.years[1:]]
+        contents = [header]
+        for account in cube.accounts:
+            results = [cube.get_result(account, year) for year in cube.years]
+            contents.append([account.code, account.name] + results + self._get_changes(results))
+        totals = [cube.get_total(year) for year in cube.years]
+        contents.append([None, 'Total'] + totals + self._get_changes(totals))
+        return contents
+
+    def _generate_month_contents_from_profit_loss_cube(self, cube: ProfitLossCube) -> Matrix:
+        """
+        Generate the contents from a ProfitLossCube, with a row per account and year and a column per month
+
+        :param cube: ProfitLossCube to export
+        :return: Matrix-shaped contents
+        """
+
+        months = range(1, 13)
+        header = ['Account', 'Description', 'Year'] + [calendar.month_abbr[month] for month in months] + ['Total']
+        contents = [header]
+        for account in cube.accounts:
+            for year in cube.years:
+                contents.append([account.code, account.name, year] +
+                                [cube.get_result(account, year, month) for month in months] +
+                                [cube.get_result(account, year)])
+        for year in cube.years:
+            contents.append([None, 'Total', year] + [cube.get_total(year, month) for month in months] +
+                            [cube.get_total(year)])
+        return contents
+
+    @staticmethod
+    def _get_changes(values: List[Decimal]) -> List[Decimal]:
+        """
+        Return the change of every value compared to the value before it
+        """
+
+        return [value - previous_value for previous_value, value in zip(values, values[1:])]
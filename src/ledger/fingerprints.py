@@ -0,0 +1,37 @@
+import hashlib
+from decimal import Decimal
+
+import datetime
+from typing import Iterable, Tuple
+
+from common.utils import Numeric
+
+
+def make_fingerprint(date: datetime.date, ledger_id: int, description: str, invoice_number: str,
+                     debit_account_id: int, credit_account_id: int, amount: Numeric) -> str:
+    """
+    Return a hash of the content of a transaction, which is equal for transactions that are considered the same
+
+    It only works on plain values and not on model instances. The migrations that filled the fingerprints hold a copy
+    of it, so changing the hash needs a new migration that recalculates the fingerprints.
+    """
+
+    amount = Decimal(amount).quantize(Decimal('.01'))
+    content = '|'.join([date.isoformat(), str(ledger_id), str(description), str(invoice_number or ''),
+                        str(debit_account_id), str(credit_account_id), str(amount)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def make_entry_fingerprint(date: datetime.date, ledger_id: int, description: str, invoice_number: str,
+                           lines: Iterable[Tuple[int, Numeric]]) -> str:
+    """
+    Return a hash of the content of a transaction with more than one debit line or credit line
+
+    The lines are pairs of an account id and a signed amount, which are hashed in sorted order, so the order in which
+    the lines were entered does not matter.
+    """
+
+    lines = sorted((account_id, Decimal(amount).quantize(Decimal('.01'))) for account_id, amount in lines)
+    content = '|'.join([date.isoformat(), str(ledger_id), str(description), str(invoice_number or '')] +
+                       ['{}:{}'.format(account_id, amount) for account_id, amount in lines])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
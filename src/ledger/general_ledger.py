@@ -0,0 +1,96 @@
+from decimal import Decimal
+from itertools import groupby
+from operator import attrgetter
+
+import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from common.instrumentation import phase, profiled
+from ledger.balance import Balance
+from ledger.models import Account, Ledger, Transaction, TransactionLine
+from ledger.totals import get_account_totals
+
+ZERO = Decimal(0)
+
+# A transaction line of an account, with the balance of the account after it
+GeneralLedgerEntry = Tuple[TransactionLine, Decimal]
+
+
+class GeneralLedger:
+    chunk_size = 2000  # Number of transaction lines fetched from the database at once
+
+    @profiled('GeneralLedger')
+    def __init__(self, ledger: Ledger, accounts: Optional[Iterable[Account]] = None):
+        """
+        Generate every mutation of the accounts in the book year of the given ledger, with the balance of the account
+        after each mutation
+
+        Every account starts from its opening balance, which is the balance at the end of the year before for balance
+        accounts and zero for profit/loss accounts. The opening entries of the ledger only carry that balance forward,
+        so they are not repeated as mutations. The mutations are read in a single ordered query, and the running
+        balance is added up while they are streamed, so the query does not sum the earlier mutations for every line.
+
+        :param ledger: Ledger of the book year
+        :param accounts: Accounts to report, by default all accounts that have an opening balance or any mutations
+        """
+
+        self.ledger = ledger
+        self.start_date = datetime.date(year=ledger.year, month=1, day=1)
+        self.end_date = datetime.date(year=ledger.year, month=12, day=31)
+        self.selected_pks = {account.pk for account in accounts} if accounts is not None else None
+
+        with phase('fetch'):
+            accounts = Account.objects.order_by('path', 'pk')
+            if self.selected_pks is not None:
+                accounts = accounts.filter(pk__in=self.selected_pks)
+            self.accounts = list(accounts)  # type: List[Account]
+            totals = get_account_totals(*Balance._get_sources(self.start_date - datetime.timedelta(days=1)))
+            self.opening_balances = {account.pk: self._get_balance(account, *totals[account.pk])
+                                     for account in self.accounts
+                                     if account.type == Account.BALANCE and account.pk in totals}
+
+    def generate_accounts(self) -> Iterator[Tuple[Account, Decimal, Iterator[GeneralLedgerEntry]]]:
+        """
+        Generate every reported account in order of path, with its opening balance and its entries in order of date
+
+        The entries of all accounts come from the same stream of transaction lines, so the entries of an account must
+        be read before the next account is generated.
+        """
+
+        lines = TransactionLine.objects \
+            .filter(ledger=self.ledger) \
+            .exclude(kind=Transaction.OPENING) \
+            .select_related('transaction') \
+            .order_by('account__path', 'account_id', 'date', 'transaction_id', 'pk')
+        if self.selected_pks is not None:
+            lines = lines.filter(account__in=self.selected_pks)
+        lines_per_account = groupby(lines.iterator(chunk_size=self.chunk_size), key=attrgetter('account_id'))
+
+        account_pk, account_lines = next(lines_per_account, (None, None))
+        for account in self.accounts:
+            opening_balance = self.opening_balances.get(account.pk, ZERO)
+            if account.pk == account_pk:
+                yield account, opening_balance, self._generate_entries(account, opening_balance, account_lines)
+                account_pk, account_lines = next(lines_per_account, (None, None))
+            elif opening_balance or self.selected_pks is not None:
+                yield account, opening_balance, iter(())
+
+    def _generate_entries(self, account: Account, opening_balance: Decimal,
+                          lines: Iterable[TransactionLine]) -> Iterator[GeneralLedgerEntry]:
+        """
+        Generate the given lines of the account, with the running balance after each line
+        """
+
+        balance = opening_balance
+        for line in lines:
+            balance += self._get_balance(account, line.amount, ZERO)
+            yield line, balance
+
+    @staticmethod
+    def _get_balance(account: Account, debit: Decimal, credit: Decimal) -> Decimal:
+        """
+        Return the balance of the account from its debits and credits, which is positive if the account has the side
+        of its debit type
+        """
+
+        return debit - credit if account.debit_type == Account.DEBIT else credit - debit
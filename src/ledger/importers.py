@@ -1,13 +1,16 @@
-from typing import Optional
-
-from typing import Optional
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils import timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from openpyxl import load_workbook
 
 from accounts.models import Account, ChartOfAccounts
-from common.utils import Matrix
+from common.instrumentation import phase, profiled
+from common.utils import Numeric, Rows
 from contacts.models import Contact
-from ledger.models import Transaction
+from ledger.models import AccountPeriodTotal, Ledger, LedgerClosedError, Transaction, UnbalancedTransactionError, \
+    parse_amount
 
 
 class LedgerImportError(Exception):
@@ -15,100 +18,234 @@ class LedgerImportError(Exception):
 
 
 class LedgerImporter:
-    def __init__(self):
-        self.transactions = list(Transaction.objects.all())
+    columns = ('ID', 'Date', 'Description', 'Invoice number', 'Contact', 'Account code', 'Account name', 'Debit',
+               'Credit')
+
+    accounts: Dict[str, Account]
+    contacts: Dict[str, Contact]
+    ledgers: Dict[int, Ledger]
+
+    def __init__(self, batch_size: int = 1000):
+        """
+        :param batch_size: Number of transactions that are written to the database at once
+        """
 
+        self.batch_size = batch_size
+
+        # Transactions and references that are not yet written to the database
+        self.pending_transactions = {}  # type: Dict[str, Transaction]  # By fingerprint
+        self.pending_contacts = []  # type: List[Contact]
+
+    @profiled()
     def import_transactions_from_xlsx(self, full_path_to_file: str) -> None:
         contents = self._read_xlsx(full_path_to_file)
         self._parse_contents(contents)
 
-    def _read_xlsx(self, full_path_to_file: str) -> Matrix:
+    def _read_xlsx(self, full_path_to_file: str) -> Iterator[tuple]:
         """
-        Read an Excel file with one sheet and return the contents as a Matrix
+        Read an Excel file with one sheet and yield its rows one by one, without loading the whole sheet in memory
         """
 
         workbook = load_workbook(filename=full_path_to_file, read_only=True)
-        worksheet = workbook.active
-        return list(worksheet.values)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
 
-    def _parse_contents(self, contents: Matrix):
+    def _parse_contents(self, contents: Rows):
         """
-        Create transactions from the given input data
+        Create transactions from the given input data, of which the first row is the header
+
+        The rows are parsed as they come in, so the input can be streamed.
+
+        All transactions are written in batches, in one database transaction: if one row is invalid, nothing is
+        imported.
         """
 
-        chart = ChartOfAccounts.objects.get()
-        header = contents.pop(0)
+        with atomic():
+            with phase('fetch'):
+                self._load_references()
+            self._parse_rows(contents)
+            self._flush()
+
+    def _load_references(self):
+        """
+        Load all accounts, contacts and ledgers in memory, so they do not have to be fetched per row
+        """
+
+        self.chart = ChartOfAccounts.objects.get()
+        self.accounts = {account.code: account
+                         for account in Account.objects.filter(chart=self.chart).select_related('contact')}
+        self.contacts = {}
+        for contact in Contact.objects.order_by('-created_at'):
+            # Contact names are not unique: keep the oldest contact for each name
+            self.contacts[contact.name] = contact
+        self.ledgers = {ledger.year: ledger for ledger in Ledger.objects.filter(chart=self.chart)}
+
+    def _parse_rows(self, contents: Rows):
+        rows = iter(contents)
+        columns = self._get_column_indices(next(rows))
         transaction = None
-        for index, row in enumerate(contents, start=2):  # Row 1 = header, row 2 = first data row
+        lines = []  # type: List[Tuple[Account, Numeric]]  # Lines of the current transaction
+        last_index = None  # Last row of the current transaction
+        for index, row in enumerate(rows, start=2):  # Row 1 = header, row 2 = first data row
             if not any(row):
                 # Skip empty rows
                 continue
 
-            if row[header.index('ID')] is None:
+            if row[columns['ID']] is None:
                 assert transaction is not None, 'The column ID is mandatory'
             else:
                 # A new transaction is started. Save the old one and start a new one.
-                self._save_transaction(transaction)
+                self._add_transaction(transaction, lines, last_index)
                 transaction = Transaction()
+                lines = []
+            last_index = index
 
-            transaction_datetime = row[header.index('Date')]
+            transaction_datetime = row[columns['Date']]
             if transaction_datetime:
                 transaction.date = transaction_datetime.date()
-            transaction.description = row[header.index('Description')] or transaction.description
-            transaction.invoice_number = row[header.index('Invoice number')] or transaction.invoice_number
+            transaction.description = row[columns['Description']] or transaction.description
+            transaction.invoice_number = row[columns['Invoice number']] or transaction.invoice_number
 
             # Fetch the correct contact
-            contact_name = row[header.index('Contact')]
+            contact_name = row[columns['Contact']]
             if contact_name:
-                transaction.contact, _ = Contact.objects.get_or_create(name=contact_name)
+                transaction.contact = self._get_contact(contact_name)
 
             # Fetch the correct account
-            account_code = row[header.index('Account code')]
+            account_code = row[columns['Account code']]
             try:
-                account = Account.objects.get(chart=chart, code=account_code)
-            except Account.DoesNotExist as e:
-                account_name = row[header.index('Account name')]
+                account = self.accounts[account_code]
+            except KeyError as e:
+                account_name = row[columns['Account name']]
                 msg = 'Account with code {} ({}) does not exist in row {}'.format(account_code, account_name, index)
                 raise LedgerImportError(msg) from e
 
-            debit_amount = row[header.index('Debit')]
-            credit_amount = row[header.index('Credit')]
+            debit_amount = row[columns['Debit']]
+            credit_amount = row[columns['Credit']]
             if debit_amount is not None:
                 assert credit_amount is None, 'Row {} has a debit and a credit amount set'.format(index)
-                transaction.debit_account = account
-                if transaction.amount:
-                    if transaction.amount != debit_amount:
-                        msg = 'Transaction in row {} is not in balance'.format(index)
-                        raise LedgerImportError(msg)
-                else:
-                    transaction.amount = debit_amount
+                lines.append((account, parse_amount(debit_amount)))
             elif credit_amount is not None:
-                transaction.credit_account = account
-                if transaction.amount:
-                    if transaction.amount != credit_amount:
-                        msg = 'Transaction in row {} is not in balance'.format(index)
-                        raise LedgerImportError(msg)
-                else:
-                    transaction.amount = credit_amount
+                lines.append((account, -parse_amount(credit_amount)))
             else:
                 msg = 'Row {} has neither a debit nor a credit amount set'.format(index)
                 raise LedgerImportError(msg)
 
         # Save the last transaction
-        self._save_transaction(transaction)
+        self._add_transaction(transaction, lines, last_index)
+
+    def _get_column_indices(self, header: tuple) -> Dict[str, int]:
+        """
+        Return the index of each column in the rows, based on the given header
+        """
+
+        missing_columns = [column for column in self.columns if column not in header]
+        if missing_columns:
+            msg = 'The columns {} are missing in the header'.format(', '.join(missing_columns))
+            raise LedgerImportError(msg)
+        return {column: list(header).index(column) for column in self.columns}
+
+    def _get_contact(self, name: str) -> Contact:
+        """
+        Return the contact with the given name, or a new one that is created with the next batch
+        """
+
+        contact = self.contacts.get(name)
+        if not contact:
+            now = timezone.now()
+            contact = Contact(uuid=Contact.generate_uuid(), created_at=now, updated_at=now, name=name)
+            self.contacts[name] = contact
+            self.pending_contacts.append(contact)
+        return contact
+
+    def _get_ledger(self, year: int) -> Ledger:
+        """
+        Return the ledger of the given year, or create it
+
+        A new ledger is saved right away, since the fingerprint of a transaction contains the id of its ledger.
+        """
+
+        ledger = self.ledgers.get(year)
+        if not ledger:
+            ledger = Ledger.objects.create(chart=self.chart, year=year)
+            self.ledgers[year] = ledger
+        return ledger
 
-    def _save_transaction(self, transaction: Optional[Transaction]):
+    def _add_transaction(self, transaction: Optional[Transaction], lines: List[Tuple[Account, Numeric]],
+                         last_index: Optional[int]):
         """
-        Update or create the current transaction
+        Add the current transaction with the given lines to the next batch, replacing an existing transaction with the
+        same fingerprint
+
+        :param last_index: Number of the last row of the transaction, to refer to in errors
         """
 
         if not transaction:
             return
 
+        transaction.set_lines(lines)
+        try:
+            transaction.check_balance()
+        except UnbalancedTransactionError as e:
+            raise LedgerImportError('Transaction in row {} is not in balance'.format(last_index)) from e
+        if not getattr(transaction, 'ledger', None):
+            transaction.ledger = self._get_ledger(transaction.date.year)
         transaction.clean()
-        # TODO: Bulk create transactions
-        existing_transaction = next((t for t in self.transactions if t == transaction), None)
-        if existing_transaction:
-            existing_transaction.delete()
-        transaction.save()
-        self.transactions.append(transaction)
+        if transaction.ledger.is_closed:
+            raise LedgerClosedError('Ledger {} is closed, no transactions can be imported'.format(transaction.ledger))
+        now = timezone.now()
+        transaction.uuid = Transaction.generate_uuid()
+        transaction.created_at = transaction.updated_at = now
+        transaction.fingerprint = transaction.make_fingerprint()
+
+        # A transaction that occurs twice in the import replaces the earlier one. Transactions that already exist in
+        # the database are replaced when the batch is written.
+        self.pending_transactions.pop(transaction.fingerprint, None)
+        self.pending_transactions[transaction.fingerprint] = transaction
+        if len(self.pending_transactions) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """
+        Write the pending contacts and transactions to the database, replacing existing transactions
+        """
+
+        with phase('save'):
+            self._delete_existing_transactions()
+
+            Contact.objects.bulk_create(self.pending_contacts)
+            if any(contact.pk is None for contact in self.pending_contacts):
+                # The database does not return the ids of the created rows, so look them up by their UUID
+                ids = dict(Contact.objects.filter(uuid__in=[contact.uuid for contact in self.pending_contacts])
+                           .values_list('uuid', 'id'))
+                for contact in self.pending_contacts:
+                    contact.pk = ids[contact.uuid]
+            self.pending_contacts = []
+
+            transactions = list(self.pending_transactions.values())
+            Transaction.objects.bulk_create_with_lines(transactions, batch_size=self.batch_size)
+            Ledger.bump_versions(transaction.ledger_id for transaction in transactions)
+            self.pending_transactions = {}
+
+    def _delete_existing_transactions(self):
+        """
+        Delete the transactions in the database that are replaced by the pending transactions
+
+        Existing transactions are found by their indexed fingerprint, so only the pending transactions are compared.
+        """
+
+        fingerprints = list(self.pending_transactions)
+        chunk_size = connection.ops.bulk_batch_size(['fingerprint'], fingerprints)
+        for start in range(0, len(fingerprints), chunk_size):
+            existing_transactions = Transaction.objects.filter(fingerprint__in=fingerprints[start:start + chunk_size])
+            existing_transactions = list(existing_transactions.select_related('ledger').prefetch_related('lines'))
+            if not existing_transactions:
+                continue
+            for transaction in existing_transactions:
+                transaction.check_ledger_is_open()
+            # The lines are prefetched, since the period totals need them after the transactions are deleted
+            Transaction.objects.filter(pk__in=[t.pk for t in existing_transactions]).delete()
+            AccountPeriodTotal.objects.remove_transactions(existing_transactions)
+            Ledger.bump_versions(transaction.ledger_id for transaction in existing_transactions)
@@ -1,18 +1,38 @@
 import os.path
+from contextlib import nullcontext
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 
+from common.instrumentation import Profiler, format_report
+from ledger.closing import check_ledger_can_be_closed, close_ledger
 from ledger.exporters import LedgerExporter
-from ledger.models import Ledger
+from ledger.models import Ledger, LedgerClosedError
 
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        year = options['year']
-        exporter = LedgerExporter(Ledger.objects.get(year=year))
-        finance_filename = os.path.join(settings.BASE_DIR, 'tmp', 'finance_{}'.format(year))
-        exporter.write_full_financials_to_xlsx(finance_filename)
+        profiler = Profiler('end_book_year') if options['profile'] else nullcontext()
+        with profiler:
+            year = options['year']
+            ledger = Ledger.objects.get(year=year)
+            try:
+                # Check before exporting, so no financials are written for a book year that cannot be closed
+                if not options['export_only']:
+                    check_ledger_can_be_closed(ledger)
+                exporter = LedgerExporter(ledger)
+                finance_filename = os.path.join(settings.BASE_DIR, 'tmp', 'finance_{}'.format(year))
+                exporter.write_full_financials_to_xlsx(finance_filename)
+                if not options['export_only']:
+                    close_ledger(ledger)
+            except LedgerClosedError as e:
+                raise CommandError(str(e))
+        if options['profile']:
+            self.stdout.write('\n'.join(format_report(profiler.report())))
 
     def add_arguments(self, parser):
         parser.add_argument('year', type=int, action='store')
+        parser.add_argument('--export-only', dest='export_only', action='store_true', default=False,
+                            help='Only export the financials, without closing the book year')
+        parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                            help='Report the number of queries and the time spent per phase')
@@ -1,12 +1,23 @@
+from contextlib import nullcontext
+
 from django.core.management import BaseCommand
 
+from common.instrumentation import Profiler, format_report
 from ledger.importers import LedgerImporter
 
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        importer = LedgerImporter()
-        importer.import_transactions_from_xlsx(options['file'])
+        profiler = Profiler('import_ledger') if options['profile'] else nullcontext()
+        with profiler:
+            importer = LedgerImporter(batch_size=options['batch_size'])
+            importer.import_transactions_from_xlsx(options['file'])
+        if options['profile']:
+            self.stdout.write('\n'.join(format_report(profiler.report())))
 
     def add_arguments(self, parser):
         parser.add_argument('file', type=str, action='store', help='Path to the file to import')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, action='store', default=1000,
+                            help='Number of transactions that are written to the database at once')
+        parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                            help='Report the number of queries and the time spent per phase')
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand, CommandError
+
+from ledger.models import AccountPeriodTotal
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the materialized period totals from the transactions and verify them'
+
+    def handle(self, *args, **options):
+        if not options['check_only']:
+            AccountPeriodTotal.objects.rebuild()
+
+        differences = AccountPeriodTotal.objects.verify()
+        for ledger, account, period in differences:
+            self.stderr.write('Period total of account {} in ledger {} for {} differs from the transactions'.format(
+                account, ledger, period))
+        if differences:
+            raise CommandError('{} period totals differ from the transactions'.format(len(differences)))
+        self.stdout.write('All period totals match the transactions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check-only', dest='check_only', action='store_true', default=False,
+                            help='Only verify the period totals, without rebuilding them')
@@ -0,0 +1,68 @@
+import os.path
+from typing import Optional
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from ledger.benchmarks import BenchmarkSuite, compare_results, load_results, save_results
+
+
+class Command(BaseCommand):
+    help = 'Time the reports, the importer and the exporter on synthetic ledgers, in a separate database'
+
+    def handle(self, *args, **options):
+        output_dir = os.path.join(settings.BASE_DIR, 'tmp', 'benchmarks')
+        os.makedirs(output_dir, exist_ok=True)
+        output = options['output'] or os.path.join(
+            output_dir, 'benchmark_{}.json'.format(timezone.now().strftime('%Y%m%d_%H%M%S')))
+
+        # Never touch the bookkeeping itself: the benchmarks run in a database that is created for them
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            # The default test database of SQLite is in memory, which would not measure the disk access
+            connection.settings_dict['TEST']['NAME'] = os.path.join(output_dir, 'benchmark.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            suite = BenchmarkSuite(output_dir, sizes=options['sizes'], nr_years=options['years'],
+                                   seed=options['seed'], log=self.stdout.write)
+            results = suite.run()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        save_results(results, output)
+        self.stdout.write('Results written to {}'.format(output))
+        if results['engine_mismatches']:
+            raise CommandError('The results of {} differ between the engines'.format(
+                ', '.join(sorted({mismatch['name'] for mismatch in results['engine_mismatches']}))))
+
+        if options['baseline']:
+            comparisons = compare_results(results, load_results(options['baseline']), options['tolerance'])
+            for comparison in comparisons:
+                self.stdout.write('{} ({} transactions): wall time x{}, queries x{}, peak memory x{}{}'.format(
+                    comparison['name'], comparison['size'],
+                    *[self._format_ratio(comparison[key]) for key in ('wall_time', 'queries', 'peak_memory')],
+                    ' REGRESSION' if comparison['regression'] else ''))
+            regressions = [comparison for comparison in comparisons if comparison['regression']]
+            if regressions:
+                raise CommandError('{} benchmarks regressed compared to {}'.format(len(regressions),
+                                                                                   options['baseline']))
+
+    @staticmethod
+    def _format_ratio(ratio: Optional[float]) -> str:
+        return '{:.2f}'.format(ratio) if ratio is not None else '-'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', default=list(BenchmarkSuite.default_sizes),
+                            help='Total numbers of transactions to run the benchmarks with')
+        parser.add_argument('--years', dest='years', type=int, action='store', default=3,
+                            help='Number of book years the transactions are spread over')
+        parser.add_argument('--seed', dest='seed', type=int, action='store', default=0,
+                            help='Seed of the generated transactions, use the same seed to compare runs')
+        parser.add_argument('--output', dest='output', type=str, action='store', default=None,
+                            help='Path to the JSON file the results are written to')
+        parser.add_argument('--baseline', dest='baseline', type=str, action='store', default=None,
+                            help='Path to the JSON file of an earlier run to compare the results with')
+        parser.add_argument('--tolerance', dest='tolerance', type=float, action='store', default=0.2,
+                            help='Relative increase of wall time or peak memory that is not reported as regression')
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def fill_period_totals(apps, schema_editor):
+    """
+    Sum the existing transactions per ledger, account and month, like AccountPeriodTotal.objects.rebuild
+    """
+
+    Transaction = apps.get_model('ledger', 'Transaction')
+    AccountPeriodTotal = apps.get_model('ledger', 'AccountPeriodTotal')
+
+    totals = {}
+    for side, account_field in (('debit', 'debit_account'), ('credit', 'credit_account')):
+        rows = Transaction.objects.order_by() \
+            .values_list('ledger', account_field, TruncMonth('date')) \
+            .annotate(amount=Sum('amount'))
+        for ledger_id, account_id, period, amount in rows:
+            total = totals.setdefault((ledger_id, account_id, period), {'debit': 0, 'credit': 0})
+            total[side] += amount
+
+    AccountPeriodTotal.objects.bulk_create(
+        (AccountPeriodTotal(ledger_id=ledger_id, account_id=account_id, period=period, **total)
+         for (ledger_id, account_id, period), total in totals.items()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('ledger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountPeriodTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the month')),
+                ('debit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('credit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='accounts.account')),
+                ('ledger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='ledger.ledger')),
+            ],
+            options={
+                'ordering': ['ledger', 'account', 'period'],
+                'unique_together': {('ledger', 'account', 'period')},
+            },
+        ),
+        migrations.RunPython(fill_period_totals, migrations.RunPython.noop),
+    ]
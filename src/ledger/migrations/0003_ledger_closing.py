@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0002_account_period_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledger',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, default=None, help_text='Moment the book year was closed, after which it cannot be changed', null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='kind',
+            field=models.CharField(choices=[('regular', 'Regular transaction'), ('opening', 'Opening balance, carried forward from the previous book year'), ('closing', 'Closing entry, moving the result of the book year into equity')], default='regular', max_length=16),
+        ),
+    ]
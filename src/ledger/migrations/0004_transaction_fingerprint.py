@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:46
+
+import hashlib
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def make_fingerprint(date, ledger_id, description, invoice_number, debit_account_id, credit_account_id, amount):
+    """
+    Copy of ledger.fingerprints.make_fingerprint at the time of this migration
+    """
+
+    amount = Decimal(amount).quantize(Decimal('.01'))
+    content = '|'.join([date.isoformat(), str(ledger_id), str(description), str(invoice_number or ''),
+                        str(debit_account_id), str(credit_account_id), str(amount)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def fill_fingerprints(apps, schema_editor):
+    Transaction = apps.get_model('ledger', 'Transaction')
+    chunk_size = 2000
+    # The transactions are read and updated per chunk, so they do not all have to fit in memory
+    transactions = []
+    for transaction in Transaction.objects.order_by('pk').iterator(chunk_size=chunk_size):
+        transaction.fingerprint = make_fingerprint(
+            transaction.date, transaction.ledger_id, transaction.description, transaction.invoice_number,
+            transaction.debit_account_id, transaction.credit_account_id, transaction.amount)
+        transactions.append(transaction)
+        if len(transactions) == chunk_size:
+            Transaction.objects.bulk_update(transactions, ['fingerprint'], batch_size=1000)
+            transactions = []
+    Transaction.objects.bulk_update(transactions, ['fingerprint'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0003_ledger_closing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(db_index=True, default='', editable=False, help_text='Hash of the content, used to find duplicate transactions', max_length=64),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('contacts', '0002_auto_20190422_1759'),
+        ('ledger', '0004_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['ledger', 'date'], include=('debit_account', 'credit_account', 'amount', 'kind'), name='transaction_ledger_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['debit_account', 'date', 'amount'], include=('ledger', 'kind'), name='transaction_debit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['credit_account', 'date', 'amount'], include=('ledger', 'kind'), name='transaction_credit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date'], include=('debit_account', 'credit_account', 'amount', 'kind'), name='transaction_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['kind', 'date'], name='transaction_kind_date_idx'),
+        ),
+    ]
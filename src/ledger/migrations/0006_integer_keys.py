@@ -0,0 +1,212 @@
+# The primary keys of the ledgers and transactions change from the UUID to an integer id. They are copied to new
+# tables, referring to the new tables of the accounts and contacts, after which the new tables replace the old ones.
+# The fingerprints are recalculated, since they contain the ids of the ledger and the accounts.
+
+import hashlib
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def make_fingerprint(date, ledger_id, description, invoice_number, debit_account_id, credit_account_id, amount):
+    """
+    Copy of ledger.fingerprints.make_fingerprint at the time of this migration
+    """
+
+    amount = Decimal(amount).quantize(Decimal('.01'))
+    content = '|'.join([date.isoformat(), str(ledger_id), str(description), str(invoice_number or ''),
+                        str(debit_account_id), str(credit_account_id), str(amount)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def copy_ledgers_and_transactions(apps, schema_editor):
+    Ledger = apps.get_model('ledger', 'Ledger')
+    NewLedger = apps.get_model('ledger', 'NewLedger')
+    Transaction = apps.get_model('ledger', 'Transaction')
+    NewTransaction = apps.get_model('ledger', 'NewTransaction')
+    AccountPeriodTotal = apps.get_model('ledger', 'AccountPeriodTotal')
+    NewAccountPeriodTotal = apps.get_model('ledger', 'NewAccountPeriodTotal')
+    chart_ids = dict(apps.get_model('accounts', 'NewChartOfAccounts').objects.values_list('uuid', 'id'))
+    account_ids = dict(apps.get_model('accounts', 'NewAccount').objects.values_list('uuid', 'id'))
+    contact_ids = dict(apps.get_model('contacts', 'NewContact').objects.values_list('uuid', 'id'))
+
+    NewLedger.objects.bulk_create(
+        NewLedger(uuid=ledger.uuid, created_at=ledger.created_at, updated_at=ledger.updated_at,
+                  chart_id=chart_ids[ledger.chart_id], year=ledger.year, closed_at=ledger.closed_at)
+        for ledger in Ledger.objects.order_by('year', 'uuid'))
+    ledger_ids = dict(NewLedger.objects.values_list('uuid', 'id'))
+
+    def copy_transaction(transaction):
+        ledger_id = ledger_ids[transaction.ledger_id]
+        debit_account_id = account_ids[transaction.debit_account_id]
+        credit_account_id = account_ids[transaction.credit_account_id]
+        return NewTransaction(
+            uuid=transaction.uuid, created_at=transaction.created_at, updated_at=transaction.updated_at,
+            date=transaction.date, ledger_id=ledger_id, description=transaction.description,
+            invoice_number=transaction.invoice_number, contact_id=contact_ids.get(transaction.contact_id),
+            debit_account_id=debit_account_id, credit_account_id=credit_account_id, amount=transaction.amount,
+            kind=transaction.kind,
+            fingerprint=make_fingerprint(transaction.date, ledger_id, transaction.description,
+                                         transaction.invoice_number, debit_account_id, credit_account_id,
+                                         transaction.amount))
+
+    NewTransaction.objects.bulk_create(
+        (copy_transaction(transaction)
+         for transaction in Transaction.objects.order_by('date', 'created_at', 'uuid').iterator(chunk_size=2000)),
+        batch_size=1000)
+
+    NewAccountPeriodTotal.objects.bulk_create(
+        (NewAccountPeriodTotal(ledger_id=ledger_ids[total.ledger_id], account_id=account_ids[total.account_id],
+                               period=total.period, debit=total.debit, credit=total.credit)
+         for total in AccountPeriodTotal.objects.order_by('id').iterator(chunk_size=2000)),
+        batch_size=1000)
+
+
+def copy_ledgers_and_transactions_back(apps, schema_editor):
+    Ledger = apps.get_model('ledger', 'Ledger')
+    NewLedger = apps.get_model('ledger', 'NewLedger')
+    Transaction = apps.get_model('ledger', 'Transaction')
+    NewTransaction = apps.get_model('ledger', 'NewTransaction')
+    AccountPeriodTotal = apps.get_model('ledger', 'AccountPeriodTotal')
+    NewAccountPeriodTotal = apps.get_model('ledger', 'NewAccountPeriodTotal')
+    chart_uuids = dict(apps.get_model('accounts', 'NewChartOfAccounts').objects.values_list('id', 'uuid'))
+    account_uuids = dict(apps.get_model('accounts', 'NewAccount').objects.values_list('id', 'uuid'))
+    contact_uuids = dict(apps.get_model('contacts', 'NewContact').objects.values_list('id', 'uuid'))
+
+    Ledger.objects.bulk_create(
+        Ledger(uuid=ledger.uuid, created_at=ledger.created_at, updated_at=ledger.updated_at,
+               chart_id=chart_uuids[ledger.chart_id], year=ledger.year, closed_at=ledger.closed_at)
+        for ledger in NewLedger.objects.order_by('id'))
+    ledger_uuids = dict(NewLedger.objects.values_list('id', 'uuid'))
+
+    def copy_transaction_back(transaction):
+        ledger_id = ledger_uuids[transaction.ledger_id]
+        debit_account_id = account_uuids[transaction.debit_account_id]
+        credit_account_id = account_uuids[transaction.credit_account_id]
+        return Transaction(
+            uuid=transaction.uuid, created_at=transaction.created_at, updated_at=transaction.updated_at,
+            date=transaction.date, ledger_id=ledger_id, description=transaction.description,
+            invoice_number=transaction.invoice_number, contact_id=contact_uuids.get(transaction.contact_id),
+            debit_account_id=debit_account_id, credit_account_id=credit_account_id, amount=transaction.amount,
+            kind=transaction.kind,
+            fingerprint=make_fingerprint(transaction.date, ledger_id, transaction.description,
+                                         transaction.invoice_number, debit_account_id, credit_account_id,
+                                         transaction.amount))
+
+    Transaction.objects.bulk_create(
+        (copy_transaction_back(transaction)
+         for transaction in NewTransaction.objects.order_by('id').iterator(chunk_size=2000)),
+        batch_size=1000)
+
+    AccountPeriodTotal.objects.bulk_create(
+        (AccountPeriodTotal(ledger_id=ledger_uuids[total.ledger_id], account_id=account_uuids[total.account_id],
+                            period=total.period, debit=total.debit, credit=total.credit)
+         for total in NewAccountPeriodTotal.objects.order_by('id').iterator(chunk_size=2000)),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_integer_keys'),
+        ('contacts', '0003_contact_integer_key'),
+        ('ledger', '0005_transaction_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('uuid', models.CharField(editable=False, max_length=64, unique=True)),
+                ('year', models.IntegerField()),
+                ('closed_at', models.DateTimeField(blank=True, default=None, help_text='Moment the book year was closed, after which it cannot be changed', null=True)),
+                ('chart', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledgers', to='accounts.newchartofaccounts')),
+            ],
+            options={
+                'ordering': ['chart', 'year'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NewTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('uuid', models.CharField(editable=False, max_length=64, unique=True)),
+                ('date', models.DateField(help_text='Transaction date')),
+                ('description', models.CharField(help_text='Long description of the transaction', max_length=128)),
+                ('invoice_number', models.CharField(blank=True, default='', help_text='Invoice number from invoicee', max_length=32)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('kind', models.CharField(choices=[('regular', 'Regular transaction'), ('opening', 'Opening balance, carried forward from the previous book year'), ('closing', 'Closing entry, moving the result of the book year into equity')], default='regular', max_length=16)),
+                ('fingerprint', models.CharField(db_index=True, default='', editable=False, help_text='Hash of the content, used to find duplicate transactions', max_length=64)),
+                ('contact', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='contacts.newcontact')),
+                ('credit_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='credit_transactions', to='accounts.newaccount')),
+                ('debit_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='debit_transactions', to='accounts.newaccount')),
+                ('ledger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='ledger.newledger')),
+            ],
+            options={
+                'ordering': ['date', 'description'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NewAccountPeriodTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the month')),
+                ('debit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('credit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='accounts.newaccount')),
+                ('ledger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='ledger.newledger')),
+            ],
+            options={
+                'ordering': ['ledger', 'account', 'period'],
+                'unique_together': {('ledger', 'account', 'period')},
+            },
+        ),
+        migrations.RunPython(copy_ledgers_and_transactions, copy_ledgers_and_transactions_back),
+        migrations.DeleteModel(
+            name='AccountPeriodTotal',
+        ),
+        migrations.DeleteModel(
+            name='Transaction',
+        ),
+        migrations.DeleteModel(
+            name='Ledger',
+        ),
+        migrations.RenameModel(
+            old_name='NewLedger',
+            new_name='Ledger',
+        ),
+        migrations.RenameModel(
+            old_name='NewTransaction',
+            new_name='Transaction',
+        ),
+        migrations.RenameModel(
+            old_name='NewAccountPeriodTotal',
+            new_name='AccountPeriodTotal',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['ledger', 'date'], include=('debit_account', 'credit_account', 'amount', 'kind'), name='transaction_ledger_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['debit_account', 'date', 'amount'], include=('ledger', 'kind'), name='transaction_debit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['credit_account', 'date', 'amount'], include=('ledger', 'kind'), name='transaction_credit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date'], include=('debit_account', 'credit_account', 'amount', 'kind'), name='transaction_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['kind', 'date'], name='transaction_kind_date_idx'),
+        ),
+    ]
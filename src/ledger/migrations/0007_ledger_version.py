@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0006_integer_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledger',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Counter that is increased on every change of the ledger or its transactions, used to invalidate cached reports'),
+        ),
+    ]
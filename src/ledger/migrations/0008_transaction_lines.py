@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_lines(apps, schema_editor):
+    """
+    Create the debit line and the credit line of every existing transaction
+    """
+
+    Transaction = apps.get_model('ledger', 'Transaction')
+    TransactionLine = apps.get_model('ledger', 'TransactionLine')
+
+    def make_lines(transaction):
+        for account_id, amount in ((transaction.debit_account_id, transaction.amount),
+                                   (transaction.credit_account_id, -transaction.amount)):
+            yield TransactionLine(transaction_id=transaction.id, ledger_id=transaction.ledger_id, account_id=account_id,
+                                  date=transaction.date, kind=transaction.kind, amount=amount)
+
+    TransactionLine.objects.bulk_create(
+        (line for transaction in Transaction.objects.order_by('id').iterator(chunk_size=2000)
+         for line in make_lines(transaction)),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_integer_keys'),
+        ('ledger', '0007_ledger_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Date of the transaction')),
+                ('kind', models.CharField(choices=[('regular', 'Regular transaction'), ('opening', 'Opening balance, carried forward from the previous book year'), ('closing', 'Closing entry, moving the result of the book year into equity')], default='regular', max_length=16)),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Positive for debit, negative for credit', max_digits=10)),
+            ],
+            options={
+                'ordering': ['transaction', 'id'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_debit_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_credit_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_date_idx',
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Amount of a transaction with one debit and one credit line', max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='credit_account',
+            field=models.ForeignKey(blank=True, help_text='Credit account of a transaction with one debit and one credit line', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='credit_transactions', to='accounts.account'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='debit_account',
+            field=models.ForeignKey(blank=True, help_text='Debit account of a transaction with one debit and one credit line', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='debit_transactions', to='accounts.account'),
+        ),
+        migrations.AddField(
+            model_name='transactionline',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='transaction_lines', to='accounts.account'),
+        ),
+        migrations.AddField(
+            model_name='transactionline',
+            name='ledger',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transaction_lines', to='ledger.ledger'),
+        ),
+        migrations.AddField(
+            model_name='transactionline',
+            name='transaction',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='ledger.transaction'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionline',
+            index=models.Index(fields=['account', 'date', 'amount'], include=('ledger', 'kind'), name='line_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionline',
+            index=models.Index(fields=['ledger', 'date'], include=('account', 'amount', 'kind'), name='line_ledger_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionline',
+            index=models.Index(fields=['date'], include=('account', 'amount', 'kind'), name='line_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionline',
+            index=models.Index(fields=['kind', 'date'], name='line_kind_date_idx'),
+        ),
+        migrations.RunPython(create_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_account_hierarchy'),
+        ('ledger', '0008_transaction_lines'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accountperiodtotal',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='accounts.account'),
+        ),
+        migrations.AddIndex(
+            model_name='accountperiodtotal',
+            index=models.Index(fields=['period', 'account'], include=('ledger', 'debit', 'credit'), name='period_total_period_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0009_period_total_period_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accountperiodtotal',
+            name='ledger',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='period_totals', to='ledger.ledger'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='ledger',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='ledger.ledger'),
+        ),
+    ]
@@ -1,19 +1,70 @@
 from decimal import Decimal
+from functools import reduce
+from operator import or_
 
+import datetime
 from django.db import models
+from django.db.models import Aggregate, Case, F, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from django.db.transaction import atomic
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from accounts.models import Account, ChartOfAccounts
 from common.behaviors import Equalable, Timestampable, UUIDable
+from common.database import bulk_insert
+from common.utils import Numeric
 from contacts.models import Contact
+from ledger.fingerprints import make_entry_fingerprint, make_fingerprint
+
+CENT = Decimal('.01')
+
+
+class LedgerClosedError(Exception):
+    pass
+
+
+class UnbalancedTransactionError(Exception):
+    pass
+
+
+def parse_amount(value: Union[Numeric, str]) -> Decimal:
+    """
+    Return the given amount as a decimal with two decimal places, ignoring currency signs and thousands separators
+    """
+
+    if isinstance(value, str):
+        value = value.replace('€', '').replace('$', '').replace(',', '')
+    return Decimal(value).quantize(CENT)
 
 
 class Ledger(UUIDable, Timestampable, Equalable, models.Model):
     chart = models.ForeignKey(ChartOfAccounts, on_delete=models.PROTECT, related_name='ledgers')
     year = models.IntegerField()
+    closed_at = models.DateTimeField(null=True, blank=True, default=None,
+                                     help_text='Moment the book year was closed, after which it cannot be changed')
+    version = models.PositiveIntegerField(default=0, editable=False,
+                                          help_text='Counter that is increased on every change of the ledger or its '
+                                                    'transactions, used to invalidate cached reports')
+
+    # The version changes without changing what the ledger is
+    exclude_eq = Equalable.exclude_eq + ('version',)
 
     class Meta:
         ordering = ['chart', 'year']
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+
+        if 'update_fields' not in kwargs:
+            # The version is only changed by bump_versions, so an outdated instance never writes back an older version
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        with atomic():
+            super().save(*args, **kwargs)
+            Ledger.bump_versions([self.pk])
+
     def clean(self):
         # TODO: Remove once there can be multiple ChartOfAccounts
         if not getattr(self, 'chart', None):
@@ -23,24 +74,125 @@ class Ledger(UUIDable, Timestampable, Equalable, models.Model):
     def __str__(self):
         return str(self.year)
 
+    @property
+    def is_closed(self) -> bool:
+        return self.closed_at is not None
+
+    @classmethod
+    def get_latest_closed_year(cls, before: int) -> Optional[int]:
+        """
+        Return the year of the latest closed ledger before the given year, or None if there is none
+        """
+
+        return cls.objects.filter(closed_at__isnull=False, year__lt=before).order_by('-year') \
+            .values_list('year', flat=True).first()
+
+    @classmethod
+    def bump_versions(cls, ledger_ids: Iterable[int]) -> None:
+        """
+        Increase the version of the given ledgers, to mark that their reports have changed
+
+        Code that changes transactions without Transaction.save or Transaction.delete, e.g. with bulk_create or a
+        queryset delete, must call this method for the ledgers of these transactions.
+        """
+
+        cls.objects.filter(pk__in=set(ledger_ids)).update(version=models.F('version') + 1)
+
+
+class TransactionManager(models.Manager):
+    def bulk_create_with_lines(self, transactions: List['Transaction'],
+                               batch_size: Optional[int] = None) -> List['Transaction']:
+        """
+        Create the given transactions and their lines, and add them to the period totals
+
+        Like bulk_create, this bypasses Transaction.save, so the caller must set the UUIDs and timestamps of the
+        transactions, and bump the versions of their ledgers. The rows are written with bulk_insert, so PostgreSQL
+        loads them with COPY.
+        """
+
+        transactions = bulk_insert(self, transactions, batch_size=batch_size)
+        if any(transaction.pk is None for transaction in transactions):
+            # The database does not return the ids of the created rows, so look them up by their UUID
+            ids = dict(self.filter(uuid__in=[transaction.uuid for transaction in transactions])
+                       .values_list('uuid', 'id'))
+            for transaction in transactions:
+                transaction.pk = ids[transaction.uuid]
+        bulk_insert(TransactionLine.objects, [line for transaction in transactions
+                                              for line in transaction._prepare_lines()], batch_size=batch_size)
+        AccountPeriodTotal.objects.add_transactions(transactions)
+        return transactions
+
 
 class Transaction(UUIDable, Timestampable, Equalable, models.Model):
-    # Get rid of UUIDable and use ids instead
+    REGULAR = 'regular'
+    OPENING = 'opening'
+    CLOSING = 'closing'
+    CHOICES_KIND = (
+        (REGULAR, 'Regular transaction'),
+        (OPENING, 'Opening balance, carried forward from the previous book year'),
+        (CLOSING, 'Closing entry, moving the result of the book year into equity'),
+    )
+
     date = models.DateField(help_text='Transaction date')
-    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, related_name='transactions')
+    # The index on the ledger and the date below serves the ledger, so the foreign key needs no index of its own
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, related_name='transactions', db_index=False)
     description = models.CharField(max_length=128, help_text='Long description of the transaction')
     invoice_number = models.CharField(max_length=32, blank=True, default='', help_text='Invoice number from invoicee')
     contact = models.ForeignKey(Contact, null=True, blank=True, default=None, related_name='transactions',
                                 on_delete=models.PROTECT)
-    debit_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='debit_transactions')
-    credit_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='credit_transactions')
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    debit_account = models.ForeignKey(Account, null=True, blank=True, on_delete=models.PROTECT,
+                                      related_name='debit_transactions',
+                                      help_text='Debit account of a transaction with one debit and one credit line')
+    credit_account = models.ForeignKey(Account, null=True, blank=True, on_delete=models.PROTECT,
+                                       related_name='credit_transactions',
+                                       help_text='Credit account of a transaction with one debit and one credit line')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                 help_text='Amount of a transaction with one debit and one credit line')
+    kind = models.CharField(max_length=16, choices=CHOICES_KIND, default=REGULAR)
+    fingerprint = models.CharField(max_length=64, db_index=True, editable=False, default='',
+                                   help_text='Hash of the content, used to find duplicate transactions')
+
+    # The amounts of a transaction are booked in its lines, see TransactionLine. A transaction from one debit account
+    # to one credit account is entered with debit_account, credit_account and amount, from which Transaction.save
+    # derives its two lines. A transaction with more lines is entered with set_lines, and leaves these fields empty.
+    _lines = None  # type: Optional[List[TransactionLine]]
 
-    # TODO: Think of a way how to model multiple debit lines and credit lines in one transaction,
-    #       e.g. with model TransactionDetail
+    objects = TransactionManager()
 
     class Meta:
         ordering = ['date', 'description']
+        # The reports find their amounts through the indexes of TransactionLine
+        indexes = [
+            models.Index(fields=['ledger', 'date'], name='transaction_ledger_date_idx',
+                         include=['debit_account', 'credit_account', 'amount', 'kind']),
+            models.Index(fields=['kind', 'date'], name='transaction_kind_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with atomic():
+            previous = Transaction.objects.filter(pk=self.pk).first() if self.pk else None
+            self.check_ledger_is_open()
+            if previous:
+                previous.check_ledger_is_open()
+            self.check_balance()
+            self.fingerprint = self.make_fingerprint()
+            lines = self._prepare_lines()
+            if previous:
+                AccountPeriodTotal.objects.remove_transactions([previous])
+                previous.lines.all().delete()
+            super().save(*args, **kwargs)
+            TransactionLine.objects.bulk_create(lines)
+            AccountPeriodTotal.objects.add_transactions([self])
+            Ledger.bump_versions([self.ledger_id] + ([previous.ledger_id] if previous else []))
+
+    def delete(self, *args, **kwargs):
+        self.check_ledger_is_open()
+        with atomic():
+            # The lines are needed for the period totals, before they are deleted together with the transaction
+            AccountPeriodTotal.objects.remove_transactions([self])
+            result = super().delete(*args, **kwargs)
+            Ledger.bump_versions([self.ledger_id])
+        return result
 
     def clean(self):
         if not getattr(self, 'ledger', None):
@@ -50,10 +202,323 @@ class Transaction(UUIDable, Timestampable, Equalable, models.Model):
             self.description = str(self.description)
         if self.invoice_number:
             self.invoice_number = str(self.invoice_number)
-        if not getattr(self, 'contact', None):
-            self.contact = self.debit_account.contact or self.credit_account.contact
         if isinstance(self.amount, str):
-            self.amount = Decimal(self.amount.replace('€', '').replace('$', ''). replace(',', ''))
+            self.amount = parse_amount(self.amount)
+        if not getattr(self, 'contact', None):
+            if self.is_simple:
+                self.contact = self.debit_account.contact or self.credit_account.contact
+            else:
+                self.contact = next((line.account.contact for line in self.get_lines() if line.account.contact), None)
 
     def __str__(self):
+        if not self.is_simple:
+            return '{} - {}: {} lines'.format(self.date, self.description, len(self.get_lines()))
         return '{} - {}->{}: {}'.format(self.date, self.debit_account.code, self.credit_account.code, self.amount)
+
+    @property
+    def is_simple(self) -> bool:
+        """
+        Return whether this transaction has one debit line and one credit line, entered with its own fields
+        """
+
+        return self._lines is None and self.debit_account_id is not None
+
+    def get_lines(self) -> List['TransactionLine']:
+        """
+        Return the lines of this transaction, including lines that are not saved yet
+        """
+
+        if self._lines is not None:
+            return self._lines
+        if self.is_simple:
+            amount = Decimal(self.amount)
+            return [TransactionLine(account_id=self.debit_account_id, amount=amount),
+                    TransactionLine(account_id=self.credit_account_id, amount=-amount)]
+        if self.pk is None:
+            return []
+        # Remember the lines, since saving the transaction writes them again
+        self._lines = list(self.lines.all())
+        return self._lines
+
+    def set_lines(self, lines: Iterable[Tuple[Account, Numeric]]) -> None:
+        """
+        Replace the lines of this transaction, which are written when the transaction is saved
+
+        :param lines: Pairs of an account and an amount, which is positive for debit and negative for credit. One debit
+                      line and one credit line of the same amount are stored as a simple transaction.
+        """
+
+        lines = [(account, parse_amount(amount)) for account, amount in lines]
+        debit_lines = [line for line in lines if line[1] > 0]
+        credit_lines = [line for line in lines if line[1] < 0]
+        if len(lines) == 2 and len(debit_lines) == 1 and len(credit_lines) == 1 and \
+                debit_lines[0][1] == -credit_lines[0][1]:
+            (self.debit_account, self.amount), (self.credit_account, _) = debit_lines[0], credit_lines[0]
+            self._lines = None
+        else:
+            self.debit_account = self.credit_account = self.amount = None
+            self._lines = [TransactionLine(account=account, amount=amount) for account, amount in lines]
+
+    def check_balance(self) -> None:
+        """
+        Raise an UnbalancedTransactionError if the debit amounts of the lines differ from the credit amounts
+        """
+
+        lines = self.get_lines()
+        if len(lines) < 2 or sum(Decimal(line.amount) for line in lines) != 0:
+            raise UnbalancedTransactionError('Transaction {} on {} is not in balance'.format(self.description,
+                                                                                             self.date))
+
+    def make_fingerprint(self) -> str:
+        """
+        Return the hash of the content of this transaction, see Transaction.fingerprint
+        """
+
+        if not self.is_simple:
+            return make_entry_fingerprint(self.date, self.ledger_id, self.description, self.invoice_number,
+                                          [(line.account_id, line.amount) for line in self.get_lines()])
+        return make_fingerprint(self.date, self.ledger_id, self.description, self.invoice_number,
+                                self.debit_account_id, self.credit_account_id, self.amount)
+
+    def check_ledger_is_open(self):
+        if self.ledger.is_closed:
+            msg = 'Ledger {} is closed, its transactions cannot be changed'.format(self.ledger)
+            raise LedgerClosedError(msg)
+
+    def _prepare_lines(self) -> List['TransactionLine']:
+        """
+        Return the lines of this transaction as new rows, with the date, ledger and kind of the transaction
+        """
+
+        lines = self.get_lines()
+        for line in lines:
+            line.pk = None
+            line.transaction = self
+            line.ledger_id = self.ledger_id
+            line.date = self.date
+            line.kind = self.kind
+        return lines
+
+
+class TransactionLine(models.Model):
+    """
+    Amount of a transaction that is booked on one account, which is positive for debit and negative for credit
+
+    The lines of a transaction sum to zero. The date, ledger and kind of the transaction are copied to its lines, so
+    the reports sum the amounts per account in one pass over this table. Transaction.save writes the lines, code that
+    bypasses it must use Transaction.objects.bulk_create_with_lines.
+    """
+
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='lines')
+    # The indexes below start with the ledger and the account, so these foreign keys need no index of their own
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, related_name='transaction_lines', db_index=False)
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='transaction_lines', db_index=False)
+    date = models.DateField(help_text='Date of the transaction')
+    kind = models.CharField(max_length=16, choices=Transaction.CHOICES_KIND, default=Transaction.REGULAR)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, help_text='Positive for debit, negative for credit')
+
+    class Meta:
+        ordering = ['transaction', 'id']
+        # Indexes for the access paths of the reports. The included columns make them covering on databases that
+        # support it, e.g. PostgreSQL, and are ignored by other databases.
+        indexes = [
+            models.Index(fields=['account', 'date', 'amount'], name='line_account_date_idx',
+                         include=['ledger', 'kind']),
+            models.Index(fields=['ledger', 'date'], name='line_ledger_date_idx', include=['account', 'amount', 'kind']),
+            models.Index(fields=['date'], name='line_date_idx', include=['account', 'amount', 'kind']),
+            models.Index(fields=['kind', 'date'], name='line_kind_date_idx'),
+        ]
+
+    def __str__(self):
+        return '{} - {}: {}'.format(self.date, self.account_id, self.amount)
+
+    @staticmethod
+    def debit_sum(amount_sum: Callable[..., Aggregate] = Sum) -> Aggregate:
+        """
+        Return an aggregate of the debit amounts of lines, which sums the positive amounts with a FILTER clause
+
+        Databases without FILTER clauses get an equivalent CASE expression from Django. Like any sum, the result is
+        NULL if there are no debit lines.
+
+        :param amount_sum: Aggregate function with the signature of Sum, e.g. to sum in cents
+        """
+
+        return amount_sum('amount', filter=Q(amount__gt=0))
+
+    @staticmethod
+    def credit_sum(amount_sum: Callable[..., Aggregate] = Sum) -> Aggregate:
+        """
+        Return an aggregate of the credit amounts of lines, which sums the negated negative amounts, see debit_sum
+        """
+
+        return amount_sum(-F('amount'), filter=Q(amount__lt=0))
+
+
+PeriodKey = Tuple[int, int, datetime.date]  # Ledger, account, period
+PeriodTotals = Dict[PeriodKey, Tuple[Decimal, Decimal]]  # Debit total and credit total per key
+
+
+class AccountPeriodTotalManager(models.Manager):
+    def add_transactions(self, transactions: Iterable[Transaction]) -> None:
+        """
+        Add the amounts of the given transactions to the period totals
+        """
+
+        self.apply(self._get_deltas(transactions, sign=1))
+
+    def remove_transactions(self, transactions: Iterable[Transaction]) -> None:
+        """
+        Subtract the amounts of the given transactions from the period totals
+        """
+
+        self.apply(self._get_deltas(transactions, sign=-1))
+
+    def apply(self, deltas: PeriodTotals, batch_size: int = 500) -> None:
+        """
+        Add the given debit and credit amounts to the period totals, creating the ones that do not exist yet
+
+        The amounts are added by the database, in UPDATE statements that add them to the stored totals, so concurrent
+        transactions that change the same totals cannot overwrite each other's amounts.
+
+        :param deltas: Debit and credit amounts per ledger, account and period
+        :param batch_size: Number of totals that are updated per statement
+        """
+
+        if not deltas:
+            return
+
+        with atomic():
+            # Totals that already exist, also when another transaction just created them, are left alone
+            self.bulk_create([AccountPeriodTotal(ledger_id=ledger, account_id=account, period=period)
+                              for ledger, account, period in deltas], ignore_conflicts=True)
+
+            keys = list(deltas)
+            for start in range(0, len(keys), batch_size):
+                conditions = {key: Q(ledger=key[0], account=key[1], period=key[2])
+                              for key in keys[start:start + batch_size]}
+                self.filter(reduce(or_, conditions.values())).update(
+                    debit=F('debit') + self._make_case(conditions, {key: deltas[key][0] for key in conditions}),
+                    credit=F('credit') + self._make_case(conditions, {key: deltas[key][1] for key in conditions}))
+
+    def _make_case(self, conditions: Dict[PeriodKey, Q], amounts: Dict[PeriodKey, Decimal]) -> Case:
+        """
+        Return an expression that picks the amount of the period total it is evaluated on
+        """
+
+        output_field = self.model._meta.get_field('debit')
+        return Case(*(When(conditions[key], then=Value(amount, output_field=output_field))
+                      for key, amount in amounts.items()), default=Value(0, output_field=output_field),
+                    output_field=output_field)
+
+    def rebuild(self) -> None:
+        """
+        Replace all period totals by totals calculated from scratch from the transactions
+        """
+
+        with atomic():
+            self.all().delete()
+            self.bulk_create([AccountPeriodTotal(ledger_id=ledger, account_id=account, period=period,
+                                                 debit=debit, credit=credit)
+                              for (ledger, account, period), (debit, credit) in self.get_raw_totals().items()],
+                             batch_size=1000)
+            # Reports that were based on the old totals are no longer valid
+            Ledger.objects.update(version=models.F('version') + 1)
+
+    def verify(self) -> [PeriodKey]:
+        """
+        Compare the period totals with totals calculated from the transactions
+
+        :return: Keys of all period totals that differ from the transactions
+        """
+
+        cent = Decimal('.01')
+        raw_totals = self.get_raw_totals()
+        stored_totals = {(total.ledger_id, total.account_id, total.period): (total.debit, total.credit)
+                         for total in self.all()}
+        differences = []
+        for key in sorted(set(raw_totals) | set(stored_totals), key=str):
+            raw_debit, raw_credit = raw_totals.get(key, (0, 0))
+            stored_debit, stored_credit = stored_totals.get(key, (0, 0))
+            if Decimal(raw_debit - stored_debit).quantize(cent) != 0 or \
+                    Decimal(raw_credit - stored_credit).quantize(cent) != 0:
+                differences.append(key)
+        return differences
+
+    @staticmethod
+    def get_raw_totals() -> PeriodTotals:
+        """
+        Calculate the period totals from the transactions
+        """
+
+        lines = TransactionLine.objects.filter(kind=Transaction.REGULAR).order_by().annotate(period=TruncMonth('date'))
+        totals = lines.values_list('ledger', 'account', 'period') \
+            .annotate(debit=TransactionLine.debit_sum(), credit=TransactionLine.credit_sum())
+        return {(ledger, account, period): (debit or Decimal(0), credit or Decimal(0))
+                for ledger, account, period, debit, credit in totals}
+
+    @staticmethod
+    def _get_deltas(transactions: Iterable[Transaction], sign: int) -> PeriodTotals:
+        deltas = {}
+        for transaction in transactions:
+            if transaction.kind != Transaction.REGULAR:
+                continue
+            period = AccountPeriodTotal.period_of(transaction.date)
+            for line in transaction.get_lines():
+                key = (transaction.ledger_id, line.account_id, period)
+                debit, credit = deltas.get(key, (0, 0))
+                amount = sign * Decimal(line.amount)
+                if line.amount >= 0:
+                    deltas[key] = (debit + amount, credit)
+                else:
+                    deltas[key] = (debit, credit - amount)
+        return deltas
+
+
+class AccountPeriodTotal(models.Model):
+    """
+    Materialized debit and credit totals of all regular transactions of an account in a ledger, per month
+
+    Opening and closing entries are left out, so the totals of a ledger are its movements of the book year.
+
+    Transaction.save and Transaction.delete keep these totals up to date. Code that bypasses these methods, e.g. with
+    bulk_create, must update the totals through the manager. The management command rebuild_period_totals
+    recalculates them from scratch.
+    """
+
+    # The unique index on the ledger, account and period serves the ledger
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, related_name='period_totals', db_index=False)
+    # Indexed together with the period below, the balance reads the totals before a period through that index, where
+    # SQLite would rather scan an index on the account alone
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='period_totals', db_index=False)
+    period = models.DateField(help_text='First day of the month')
+    debit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    credit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = AccountPeriodTotalManager()
+
+    class Meta:
+        ordering = ['ledger', 'account', 'period']
+        unique_together = ('ledger', 'account', 'period')
+        indexes = [
+            models.Index(fields=['period', 'account'], name='period_total_period_idx',
+                         include=['ledger', 'debit', 'credit']),
+        ]
+
+    def __str__(self):
+        return '{} - {} {}: {}/{}'.format(self.ledger, self.account_id, self.period, self.debit, self.credit)
+
+    @staticmethod
+    def period_of(date: datetime.date) -> datetime.date:
+        """
+        Return the period the given date falls in, i.e. the first day of its month
+        """
+
+        return date.replace(day=1)
+
+    @classmethod
+    def next_period_of(cls, date: datetime.date) -> datetime.date:
+        """
+        Return the period after the one the given date falls in, i.e. the first day of the next month
+        """
+
+        return cls.period_of(cls.period_of(date) + datetime.timedelta(days=31))
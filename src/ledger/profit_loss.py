@@ -1,53 +1,172 @@
 from decimal import Decimal
 
 from django.db.models import Sum
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
+from common.instrumentation import phase, profiled
 from common.utils import Numeric
-from ledger.models import Account, Ledger
+from ledger.account_table import AccountTable
+from ledger.cache import cache_report, get_cached_report, get_ledger_versions, make_report_key
+from ledger.models import Account, AccountPeriodTotal, Ledger
+from ledger.totals import get_account_totals, roll_up_totals
 
 
 class ProfitLossLine:
-    def __init__(self, account: Account, debit: Optional[Numeric], credit: Optional[Numeric]):
+    # Like a BalanceItem, a line only stores the primary key of its account
+    __slots__ = ('account_id', 'debit', 'credit', '_account_table')
+
+    def __init__(self, account: Union[Account, int], debit: Optional[Numeric], credit: Optional[Numeric],
+                 account_table: Optional[AccountTable] = None, quantize: bool = True):
+        """
+        :param account: Account, or primary key of an account in the account table
+        :param debit: Debit amount, if any
+        :param credit: Credit amount, if any
+        :param account_table: Table in which the account is resolved, shared by all lines of a report
+        :param quantize: Whether to round the amounts to cents, see BalanceItem
+        """
+
         assert account is not None
         assert debit is not None or credit is not None
 
-        self.account = account
-        self.debit = Decimal(debit).quantize(Decimal('.01')) if debit is not None else None
-        self.credit = Decimal(credit).quantize(Decimal('.01')) if credit is not None else None
+        if isinstance(account, Account):
+            self.account_id = account.pk
+            self._account_table = account_table or AccountTable([account])
+        else:
+            self.account_id = account
+            self._account_table = account_table or AccountTable()
+        if quantize:
+            debit = Decimal(debit).quantize(Decimal('.01')) if debit is not None else None
+            credit = Decimal(credit).quantize(Decimal('.01')) if credit is not None else None
+        self.debit = debit
+        self.credit = credit
+
+    @property
+    def account(self) -> Account:
+        return self._account_table[self.account_id]
 
     def __eq__(self, other):
-        return self.account == other.account and self.debit == other.debit and self.credit == other.credit
+        return self.account_id == other.account_id and self.debit == other.debit and self.credit == other.credit
+
+    def __repr__(self):
+        return 'ProfitLossLine({}, {}, {})'.format(self.account_id, self.debit, self.credit)
 
 
 class ProfitLoss:
-    def __init__(self, ledger: Ledger):
-        accounts = Account.objects.filter(type=Account.PROFIT_LOSS)
-
-        self.profit_loss_lines = []
-        sum_losses = sum_revenues = 0
-        for account in accounts:
-            account_losses = ledger.transactions.filter(debit_account=account)
-            account_losses_sum = account_losses.aggregate(Sum('amount'))['amount__sum'] or 0
-            account_revenues = ledger.transactions.filter(credit_account=account)
-            account_revenues_sum = account_revenues.aggregate(Sum('amount'))['amount__sum'] or 0
-            account_result = account_revenues_sum - account_losses_sum
-            if account_result > 0:
-                self.profit_loss_lines.append(ProfitLossLine(account, account_result, None))
-            elif account_result < 0:
-                self.profit_loss_lines.append(ProfitLossLine(account, None, -account_result))
-            sum_losses += account_losses_sum
-            sum_revenues += account_revenues_sum
-
-        result = sum_revenues - sum_losses
-        if result > 0:
-            profit, _ = Account.objects.get_or_create(chart=ledger.chart, name='Profit',
-                                                      defaults={'code': 5999, 'type': Account.PROFIT_LOSS,
-                                                                'debit_type': Account.DEBIT})
-
-            self.total = ProfitLossLine(profit, result, None)
-        elif result < 0:
-            loss, _ = Account.objects.get_or_create(chart=ledger.chart, name='Loss',
-                                                    defaults={'code': 4999, 'type': Account.PROFIT_LOSS,
-                                                              'debit_type': Account.CREDIT})
-            self.total = ProfitLossLine(loss, None, -result)
+    @profiled('ProfitLoss')
+    def __init__(self, ledger: Ledger, depth: Optional[int] = None):
+        """
+        Generate the profit and loss of the given ledger, from its materialized AccountPeriodTotals
+
+        With a depth, the profit and loss is reported at that depth of the hierarchy of accounts: the accounts below it
+        are folded into their group at that depth, see roll_up_totals.
+
+        The result is cached until the ledger changes, see Ledger.version.
+        """
+
+        self.depth = depth
+        with phase('fetch'):
+            version = Ledger.objects.filter(pk=ledger.pk).values_list('version', flat=True).get()
+            cache_key = make_report_key('profit_loss', ledger.pk, self.depth, version)
+            cached_lines = get_cached_report(cache_key)
+        if cached_lines is not None:
+            self.profit_loss_lines, self.total = cached_lines
+        else:
+            self._calculate_profit_loss(ledger)
+            cache_report(cache_key, (self.profit_loss_lines, self.total))
+
+    def _calculate_profit_loss(self, ledger: Ledger):
+        self.total = None
+        with phase('fetch'):
+            accounts = list(Account.objects.filter(type=Account.PROFIT_LOSS).order_by('path'))
+            totals = get_account_totals(period_totals=ledger.period_totals.all())
+
+        with phase('compute'):
+            if self.depth is not None:
+                totals = roll_up_totals(totals, accounts, self.depth)
+            account_table = AccountTable(accounts)
+            self.profit_loss_lines = []
+            sum_losses = sum_revenues = 0
+            for account in accounts:
+                account_losses_sum, account_revenues_sum = totals.get(account.pk, (0, 0))
+                account_result = account_revenues_sum - account_losses_sum
+                if account_result > 0:
+                    self.profit_loss_lines.append(ProfitLossLine(account.pk, account_result, None, account_table,
+                                                                 quantize=False))
+                elif account_result < 0:
+                    self.profit_loss_lines.append(ProfitLossLine(account.pk, None, -account_result, account_table,
+                                                                 quantize=False))
+                sum_losses += account_losses_sum
+                sum_revenues += account_revenues_sum
+
+            result = sum_revenues - sum_losses
+            if result > 0:
+                profit, _ = Account.objects.get_or_create(chart=ledger.chart, name='Profit',
+                                                          defaults={'code': 5999, 'type': Account.PROFIT_LOSS,
+                                                                    'debit_type': Account.DEBIT})
+
+                self.total = ProfitLossLine(profit, result, None)
+            elif result < 0:
+                loss, _ = Account.objects.get_or_create(chart=ledger.chart, name='Loss',
+                                                        defaults={'code': 4999, 'type': Account.PROFIT_LOSS,
+                                                                  'debit_type': Account.CREDIT})
+                self.total = ProfitLossLine(loss, None, -result)
+
+
+class ProfitLossCube:
+    accounts: List[Account]
+    years: List[int]
+    results: Dict[Tuple[int, int, int], Decimal]
+
+    @profiled('ProfitLossCube')
+    def __init__(self, years: Iterable[int]):
+        """
+        Generate the profit and loss per account, per book year and per month of the given years
+
+        All results are read from the materialized AccountPeriodTotals in a single grouped query, so the cost does not
+        depend on the number of years, months or accounts. The result of an account is its revenues minus its
+        losses, so costs are negative.
+
+        The cube is cached until one of the ledgers up to the last year changes, see Ledger.version.
+        """
+
+        self.years = sorted(set(years))
+        assert self.years, 'Pass at least one year'
+
+        with phase('fetch'):
+            cache_key = make_report_key('profit_loss_cube', self.years,
+                                        get_ledger_versions(until_year=self.years[-1]))
+            cached_cube = get_cached_report(cache_key)
+        if cached_cube is not None:
+            self.accounts, self.results = cached_cube
+        else:
+            self._calculate_cube()
+            cache_report(cache_key, (self.accounts, self.results))
+
+    def _calculate_cube(self):
+        with phase('fetch'):
+            rows = AccountPeriodTotal.objects \
+                .filter(ledger__year__in=self.years, account__type=Account.PROFIT_LOSS) \
+                .order_by() \
+                .values('account', 'ledger__year', 'period') \
+                .annotate(debit=Sum('debit'), credit=Sum('credit'))
+            self.results = {}
+            for row in rows:
+                key = (row['account'], row['ledger__year'], row['period'].month)
+                self.results[key] = self.results.get(key, 0) + row['credit'] - row['debit']
+            account_pks = {account_pk for account_pk, _, _ in self.results}
+            self.accounts = list(Account.objects.filter(pk__in=account_pks).order_by('path'))
+
+    def get_result(self, account: Account, year: int, month: Optional[int] = None) -> Decimal:
+        """
+        Return the result of the given account in the given year, or in the given month of that year
+        """
+
+        months = [month] if month is not None else range(1, 13)
+        return sum((self.results.get((account.pk, year, month), Decimal(0)) for month in months), Decimal(0))
+
+    def get_total(self, year: int, month: Optional[int] = None) -> Decimal:
+        """
+        Return the result of all accounts in the given year, or in the given month of that year
+        """
+
+        return sum((self.get_result(account, year, month) for account in self.accounts), Decimal(0))
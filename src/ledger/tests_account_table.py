@@ -0,0 +1,44 @@
+import pickle
+from decimal import Decimal
+
+from django.test import TestCase
+
+from common.test_mixins import AccountRequiringMixin
+from ledger.account_table import AccountTable
+from ledger.balance import BalanceItem
+from ledger.models import Account
+from ledger.profit_loss import ProfitLossLine
+
+
+class AccountTableTestCase(AccountRequiringMixin, TestCase):
+    def test_that_accounts_are_resolved_without_query_if_known(self):
+        account_table = AccountTable([self.bank, self.sales])
+        with self.assertNumQueries(0):
+            self.assertIs(self.bank, account_table[self.bank.pk])
+
+    def test_that_unknown_accounts_are_fetched_together(self):
+        account_table = pickle.loads(pickle.dumps(AccountTable([self.bank, self.sales, self.creditor_owner])))
+        with self.assertNumQueries(1):
+            accounts = [account_table[account.pk] for account in (self.bank, self.sales, self.creditor_owner)]
+        self.assertListEqual([self.bank, self.sales, self.creditor_owner], accounts)
+
+    def test_that_missing_account_raises(self):
+        with self.assertRaises(Account.DoesNotExist):
+            AccountTable()[0]
+
+    def test_that_items_share_the_table_and_resolve_lazily(self):
+        account_table = pickle.loads(pickle.dumps(AccountTable([self.bank, self.creditor_owner])))
+        items = [BalanceItem(self.bank.pk, 100, account_table), BalanceItem(self.creditor_owner.pk, 100, account_table)]
+        with self.assertNumQueries(0):
+            self.assertEqual(BalanceItem(self.bank, Decimal(100)), items[0])
+        with self.assertNumQueries(1):
+            accounts = [item.account for item in items]
+        self.assertListEqual([self.bank, self.creditor_owner], accounts)
+
+    def test_that_lines_are_slotted(self):
+        item = BalanceItem(self.bank, 100)
+        line = ProfitLossLine(self.sales, 100, None)
+        self.assertFalse(hasattr(item, '__dict__'))
+        self.assertFalse(hasattr(line, '__dict__'))
+        self.assertEqual(ProfitLossLine(self.sales.pk, 100, None), pickle.loads(pickle.dumps(line)))
+        self.assertNotEqual(BalanceItem(self.sales, 100), item)
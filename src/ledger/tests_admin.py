@@ -0,0 +1,62 @@
+from datetime import date
+
+from django.contrib.admin import site
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from common.test_mixins import TransactionRequiringMixin
+from ledger.admin import TransactionAdmin, TransactionInline
+from ledger.balance import Balance, BalanceItem
+from ledger.cache import get_report_cache
+from ledger.closing import close_ledger
+from ledger.models import AccountPeriodTotal, Ledger, Transaction
+
+
+class TransactionAdminTestCase(TransactionRequiringMixin, TestCase):
+    def setUp(self):
+        get_report_cache().clear()
+        self.addCleanup(get_report_cache().clear)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@physical.nl', 'admin'))
+        self.end_of_year = date(2018, 12, 31)
+
+    def delete_selected(self, *transactions):
+        return self.client.post(reverse('admin:ledger_transaction_changelist'),
+                                {'action': 'delete_selected', 'post': 'yes',
+                                 ACTION_CHECKBOX_NAME: [transaction.pk for transaction in transactions]})
+
+    def test_that_deleted_selection_is_removed_from_the_reports(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Balance(self.end_of_year)
+        sales = self.ledger.transactions.get(description='Sales')
+        response = self.delete_selected(sales)
+        self.assertEqual(302, response.status_code)
+        self.assertFalse(Transaction.objects.filter(pk=sales.pk).exists())
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+        self.assertIn(BalanceItem(self.bank, 800), Balance(self.end_of_year).debit_balance_items)
+
+    def test_that_transactions_of_closed_ledger_are_not_deleted(self):
+        close_ledger(Ledger.objects.get(pk=self.ledger.pk))
+        response = self.delete_selected(*self.ledger.transactions.all())
+        self.assertEqual(403, response.status_code)
+        self.assertEqual(4, self.ledger.transactions.filter(kind=Transaction.REGULAR).count())
+
+    def test_that_kind_cannot_be_changed(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='admin')
+        transaction = self.ledger.transactions.get(description='Sales')
+        self.assertNotIn('kind', TransactionAdmin(Transaction, site).get_form(request, transaction).base_fields)
+        self.assertNotIn('kind', TransactionInline(Ledger, site).get_formset(request, self.ledger).form.base_fields)
+
+
+class LedgerAdminTestCase(TransactionRequiringMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@physical.nl', 'admin'))
+
+    def test_that_closed_ledger_is_not_deleted(self):
+        ledger = Ledger.objects.get(pk=self.ledger.pk)
+        close_ledger(ledger)
+        response = self.client.post(reverse('admin:ledger_ledger_delete', args=[ledger.pk]), {'post': 'yes'})
+        self.assertEqual(403, response.status_code)
+        self.assertTrue(Ledger.objects.filter(pk=ledger.pk).exists())
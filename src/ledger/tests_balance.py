@@ -1,12 +1,15 @@
 from decimal import Decimal
+
+from datetime import date, timedelta
 from unittest import skip
 
-from django.test import TestCase
-from unittest.mock import Mock
+from django.test import TestCase, override_settings
+from unittest.mock import Mock, patch
 
 from common.test_mixins import AccountRequiringMixin, LedgerRequiringMixin
-from ledger.balance import Balance, BalanceItem
-from ledger.models import Account, Transaction
+from ledger.balance import Balance, BalanceItem, BalanceSeries, get_month_ends
+from ledger.closing import close_ledger
+from ledger.models import Account, Ledger, Transaction
 
 
 class BalanceItemTestCase(AccountRequiringMixin,  TestCase):
@@ -56,43 +59,52 @@ class BalanceTestCase(LedgerRequiringMixin, TestCase):
         self.assertListEqual(expected_credit_items, balance.credit_balance_items)
 
     def test_get_account_result_positive_debit_account(self):
-        Transaction.objects.create(uuid='1', ledger=self.ledger, date=self.date, description='Payment received',
-                                   debit_account=self.bank, credit_account=self.creditor_owner, amount=300)
-        Transaction.objects.create(uuid='2', ledger=self.ledger, date=self.date, description='Payment made',
-                                   debit_account=self.creditor_owner, credit_account=self.bank, amount=200)
-        result = Balance._get_account_result(Mock(Balance), self.bank,
-                                             Transaction.objects.filter(uuid='1'), Transaction.objects.filter(uuid='2'))
+        result = Balance._get_account_result(Mock(Balance), self.bank, Decimal(300), Decimal(200))
         self.assertEqual(Decimal(100), result)
 
     def test_get_account_result_negative_debit_account(self):
-        Transaction.objects.create(uuid='1', ledger=self.ledger, date=self.date, description='Payment received',
-                                   debit_account=self.bank, credit_account=self.creditor_owner, amount=200)
-        Transaction.objects.create(uuid='2', ledger=self.ledger, date=self.date, description='Payment made',
-                                   debit_account=self.creditor_owner, credit_account=self.bank, amount=300)
-        result = Balance._get_account_result(Mock(Balance), self.bank,
-                                             Transaction.objects.filter(uuid='1'), Transaction.objects.filter(uuid='2'))
+        result = Balance._get_account_result(Mock(Balance), self.bank, Decimal(200), Decimal(300))
         self.assertEqual(Decimal(-100), result)
 
     def test_get_account_result_positive_credit_account(self):
-        Transaction.objects.create(uuid='1', ledger=self.ledger, date=self.date, description='Accountant sent invoice',
-                                   debit_account=self.administration, credit_account=self.creditor_accountant,
-                                   amount=300)
-        Transaction.objects.create(uuid='2', ledger=self.ledger, date=self.date, description='Invoice partly paid',
-                                   debit_account=self.creditor_accountant, credit_account=self.bank, amount=200)
-        result = Balance._get_account_result(Mock(Balance), self.creditor_accountant,
-                                             Transaction.objects.filter(uuid='2'), Transaction.objects.filter(uuid='1'))
+        result = Balance._get_account_result(Mock(Balance), self.creditor_accountant, Decimal(200), Decimal(300))
         self.assertEqual(Decimal(100), result)
 
     def test_get_account_result_negative_credit_account(self):
-        Transaction.objects.create(uuid='1', ledger=self.ledger, date=self.date, description='Accountant sent invoice',
-                                   debit_account=self.administration, credit_account=self.creditor_accountant,
-                                   amount=200)
-        Transaction.objects.create(uuid='2', ledger=self.ledger, date=self.date, description='Previous invoice paid',
-                                   debit_account=self.creditor_accountant, credit_account=self.bank, amount=300)
-        result = Balance._get_account_result(Mock(Balance), self.creditor_accountant,
-                                             Transaction.objects.filter(uuid='2'), Transaction.objects.filter(uuid='1'))
+        result = Balance._get_account_result(Mock(Balance), self.creditor_accountant, Decimal(300), Decimal(200))
         self.assertEqual(Decimal(-100), result)
 
+    def test_that_transactions_after_date_are_ignored(self):
+        Transaction.objects.create(ledger=self.ledger, date=self.date, description='Initial investment',
+                                   debit_account=self.bank, credit_account=self.creditor_owner, amount=1000)
+        Transaction.objects.create(ledger=self.ledger, date=self.date + timedelta(days=1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+
+        balance = Balance(self.date)
+        self.assertListEqual([BalanceItem(self.bank, 1000)], balance.debit_balance_items)
+
+        balance = Balance(self.date + timedelta(days=1))
+        self.assertListEqual([BalanceItem(self.bank, 1400)], balance.debit_balance_items)
+
+    def test_that_number_of_queries_does_not_depend_on_number_of_accounts(self):
+        Transaction.objects.create(ledger=self.ledger, date=self.date, description='Initial investment',
+                                   debit_account=self.bank, credit_account=self.creditor_owner, amount=1000)
+        Balance(self.date)  # Creates the equity account
+
+        # Ledger versions, chart of accounts, equity account, latest closed ledger, totals and accounts
+        with self.assertNumQueries(6):
+            Balance(self.date)
+
+        for code in range(3000, 3050):
+            account = Account.objects.create(chart=self.chart, code=str(code), name='Account {}'.format(code),
+                                              type=Account.BALANCE, debit_type=Account.DEBIT)
+            Transaction.objects.create(ledger=self.ledger, date=self.date, description='Transfer',
+                                       debit_account=account, credit_account=self.creditor_owner, amount=10)
+        with self.assertNumQueries(6):
+            balance = Balance(self.date)
+        self.assertEqual(51, len(balance.debit_balance_items))
+        self.assertEqual(Decimal(1500), balance.debit_sum)
+
     def test_debit_and_credit_sum(self):
         balance = Balance(self.date)
         self.assertEqual(Decimal(0), balance.debit_sum)
@@ -103,3 +115,111 @@ class BalanceTestCase(LedgerRequiringMixin, TestCase):
                                         BalanceItem(account=self.creditor_accountant, value=Decimal(200))]
         self.assertEqual(Decimal(500), balance.debit_sum)
         self.assertEqual(Decimal(700), balance.credit_sum)
+
+
+class BalanceSeriesTestCase(LedgerRequiringMixin, TestCase):
+    def setUp(self):
+        # Closing changes the ledger instance, so do not share it between tests
+        self.ledger = Ledger.objects.get(pk=self.ledger.pk)
+        for day, amount in ((date(2018, 1, 10), 1000), (date(2018, 3, 15), 100), (date(2018, 3, 31), 50),
+                            (date(2018, 7, 1), 25)):
+            Transaction.objects.create(ledger=self.ledger, date=day, description='Investment',
+                                       debit_account=self.bank, credit_account=self.creditor_owner, amount=amount)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 2, 20), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+
+    def assertBalancesEqual(self, balances):
+        for balance in balances:
+            expected_balance = Balance(balance.date)
+            self.assertListEqual(expected_balance.debit_balance_items, balance.debit_balance_items)
+            self.assertListEqual(expected_balance.credit_balance_items, balance.credit_balance_items)
+
+    def test_that_series_equals_single_balances(self):
+        dates = get_month_ends(self.year) + [date(2018, 3, 15), date(2018, 1, 5), date(2019, 1, 1)]
+        balance_series = BalanceSeries(dates)
+        self.assertListEqual(sorted(dates), [balance.date for balance in balance_series.balances])
+        self.assertEqual(Decimal(1575), balance_series.balances[-1].debit_sum)
+        self.assertBalancesEqual(balance_series.balances)
+
+    def test_that_series_equals_single_balances_over_closed_year(self):
+        next_ledger = close_ledger(self.ledger)
+        Transaction.objects.create(ledger=next_ledger, date=date(2019, 2, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=200)
+        balance_series = BalanceSeries(get_month_ends(2018) + get_month_ends(2019))
+        self.assertEqual(Decimal(1775), balance_series.balances[-1].debit_sum)
+        self.assertBalancesEqual(balance_series.balances)
+
+    def test_that_number_of_queries_does_not_depend_on_number_of_dates(self):
+        BalanceSeries([self.date])  # Creates the equity account
+
+        # Chart of accounts, equity account, accounts, latest closed ledger, totals and movements
+        with self.assertNumQueries(6):
+            BalanceSeries([date(2018, 6, 30)])
+        with self.assertNumQueries(6):
+            BalanceSeries(get_month_ends(2017) + get_month_ends(2018))
+
+    @patch('ledger.balance.has_fast_paths', return_value=True)
+    def test_that_running_sums_equal_single_balances(self, _):
+        next_ledger = close_ledger(self.ledger)
+        Transaction.objects.create(ledger=next_ledger, date=date(2019, 2, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=200)
+        dates = get_month_ends(2018) + get_month_ends(2019) + [date(2018, 3, 15), date(2018, 1, 5)]
+        for engine in ('decimal', 'cents'):
+            with self.subTest(engine=engine), override_settings(REPORT_ENGINE=engine):
+                balance_series = BalanceSeries(dates)
+                self.assertEqual(Decimal(1775), balance_series.balances[-1].debit_sum)
+                self.assertBalancesEqual(balance_series.balances)
+
+    @patch('ledger.balance.has_fast_paths', return_value=True)
+    def test_that_running_sums_take_one_query(self, _):
+        BalanceSeries([self.date])  # Creates the equity account
+
+        # Chart of accounts, equity account, accounts, latest closed ledger and running sums
+        with self.assertNumQueries(5):
+            BalanceSeries(get_month_ends(2017) + get_month_ends(2018))
+
+
+class DifferenceBalanceTestCase(LedgerRequiringMixin, TestCase):
+    def setUp(self):
+        # Closing changes the ledger instance, so do not share it between tests
+        self.ledger = Ledger.objects.get(pk=self.ledger.pk)
+        for day, amount in ((date(2018, 1, 10), 1000), (date(2018, 4, 15), 100), (date(2018, 5, 31), 50),
+                            (date(2018, 9, 1), 25)):
+            Transaction.objects.create(ledger=self.ledger, date=day, description='Investment',
+                                       debit_account=self.bank, credit_account=self.creditor_owner, amount=amount)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 5, 20), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+
+    def assertDifferenceBalance(self, start_date, end_date):
+        def get_values(balance):
+            return {item.account.pk: item.value for item in balance.debit_balance_items + balance.credit_balance_items}
+
+        start_values = get_values(Balance(start_date - timedelta(days=1)))
+        end_values = get_values(Balance(end_date))
+        expected_values = {pk: end_values.get(pk, 0) - start_values.get(pk, 0) for pk in {*start_values, *end_values}}
+        difference_values = get_values(Balance(end_date, start_date=start_date))
+        self.assertDictEqual({pk: value for pk, value in expected_values.items() if value},
+                             {pk: value for pk, value in difference_values.items() if value})
+        return difference_values
+
+    def test_that_difference_balance_holds_movements_between_dates(self):
+        difference_values = self.assertDifferenceBalance(date(2018, 4, 1), date(2018, 6, 30))
+        self.assertEqual(Decimal(550), difference_values[self.bank.pk])
+        self.assertEqual(Decimal(150), difference_values[self.creditor_owner.pk])
+        self.assertDifferenceBalance(date(2018, 4, 16), date(2018, 5, 20))
+        self.assertDifferenceBalance(date(2018, 1, 1), date(2018, 12, 31))
+
+    def test_that_difference_balance_holds_movements_over_closed_year(self):
+        next_ledger = close_ledger(self.ledger)
+        Transaction.objects.create(ledger=next_ledger, date=date(2019, 2, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=200)
+        difference_values = self.assertDifferenceBalance(date(2018, 7, 1), date(2019, 3, 31))
+        self.assertEqual(Decimal(225), difference_values[self.bank.pk])
+        self.assertDifferenceBalance(date(2019, 1, 1), date(2019, 12, 31))
+
+    def test_that_difference_balance_sums_the_interval_in_one_query(self):
+        Balance(self.date)  # Creates the equity account
+
+        # Ledger versions, chart of accounts, equity account, totals and accounts
+        with self.assertNumQueries(5):
+            Balance(date(2018, 6, 30), start_date=date(2018, 4, 1))
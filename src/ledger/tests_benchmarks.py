@@ -0,0 +1,82 @@
+import os.path
+from tempfile import TemporaryDirectory
+
+from django.test import TestCase
+
+from accounts.models import Account
+from contacts.models import Contact
+from ledger.benchmarks import BenchmarkSuite, SyntheticLedgerGenerator, compare_results, measure
+from ledger.models import AccountPeriodTotal, Ledger, Transaction
+
+
+class SyntheticLedgerGeneratorTestCase(TestCase):
+    @staticmethod
+    def get_contents():
+        return list(Transaction.objects.order_by('ledger__year', 'description').values_list(
+            'date', 'description', 'invoice_number', 'contact__name', 'debit_account__code', 'credit_account__code',
+            'amount'))
+
+    def test_that_transactions_are_spread_over_the_years(self):
+        ledgers = SyntheticLedgerGenerator(nr_contacts=5).generate([2018, 2019], 101)
+        self.assertListEqual([2018, 2019], [ledger.year for ledger in ledgers])
+        self.assertEqual(51, ledgers[0].transactions.count())
+        self.assertEqual(50, ledgers[1].transactions.count())
+        self.assertFalse(Transaction.objects.exclude(date__year=2018).filter(ledger=ledgers[0]).exists())
+        self.assertEqual(5, Contact.objects.count())
+        self.assertTrue(Account.objects.filter(code='8000').exists())
+
+    def test_that_the_same_seed_generates_the_same_contents(self):
+        SyntheticLedgerGenerator(seed=1, nr_contacts=5).generate([2018], 50)
+        contents = self.get_contents()
+        Ledger.objects.all().delete()
+        Contact.objects.all().delete()
+        SyntheticLedgerGenerator(seed=1, nr_contacts=5).generate([2018], 50)
+        self.assertListEqual(contents, self.get_contents())
+
+    def test_that_period_totals_are_up_to_date(self):
+        SyntheticLedgerGenerator(batch_size=20).generate([2018], 50)
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+
+class BenchmarkTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_that_measure_counts_the_queries(self):
+        with measure({'name': 'count'}) as result:
+            Ledger.objects.count()
+            Transaction.objects.count()
+        self.assertEqual(2, result['queries'])
+        self.assertGreater(result['wall_time'], 0)
+        self.assertGreater(result['peak_memory'], 0)
+
+    def test_that_every_benchmark_is_run(self):
+        results = BenchmarkSuite(self.tmp_dir.name, sizes=[20], nr_years=2).run()
+        names = [result['name'] for result in results['results']]
+        self.assertListEqual(['balance[decimal]', 'profit_loss[decimal]', 'balance[cents]', 'profit_loss[cents]',
+                              'exporter.write_balance_series_to_xlsx',
+                              'exporter.write_balance_to_xlsx',
+                              'exporter.write_full_financials_to_xlsx', 'exporter.write_general_ledger_to_xlsx',
+                              'exporter.write_ledger_to_xlsx',
+                              'exporter.write_profit_loss_comparison_to_xlsx', 'exporter.write_profit_loss_to_xlsx',
+                              'importer'], names)
+        self.assertListEqual([], results['engine_mismatches'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, 'write_ledger_to_xlsx.xlsx')))
+        # The importer imported the exported ledger again, and the generated contents are removed afterwards
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Ledger.objects.exists())
+
+    def test_that_regressions_are_reported(self):
+        baseline = {'results': [{'name': 'balance', 'size': 10, 'wall_time': 1.0, 'queries': 5, 'peak_memory': 100},
+                                {'name': 'profit_loss', 'size': 10, 'wall_time': 1.0, 'queries': 3,
+                                 'peak_memory': 100}]}
+        results = {'results': [{'name': 'balance', 'size': 10, 'wall_time': 1.1, 'queries': 5, 'peak_memory': 100},
+                               {'name': 'profit_loss', 'size': 10, 'wall_time': 0.5, 'queries': 4,
+                                'peak_memory': 100},
+                               {'name': 'importer', 'size': 10, 'wall_time': 1.0, 'queries': 5, 'peak_memory': 100}]}
+        comparisons = compare_results(results, baseline, tolerance=0.2)
+        self.assertListEqual(['balance', 'profit_loss'], [comparison['name'] for comparison in comparisons])
+        self.assertFalse(comparisons[0]['regression'])
+        self.assertTrue(comparisons[1]['regression'])
+        self.assertAlmostEqual(1.1, comparisons[0]['wall_time'])
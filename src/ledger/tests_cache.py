@@ -0,0 +1,120 @@
+from datetime import date, datetime
+
+from django.db.transaction import atomic
+from django.test import TestCase
+
+from common.test_mixins import TransactionRequiringMixin
+from ledger.balance import Balance, BalanceItem
+from ledger.cache import get_report_cache
+from ledger.closing import close_ledger
+from ledger.exporters import LedgerExporter
+from ledger.importers import LedgerImporter
+from ledger.models import Ledger, Transaction
+from ledger.profit_loss import ProfitLoss
+
+
+class ReportCacheTestCase(TransactionRequiringMixin, TestCase):
+    def setUp(self):
+        get_report_cache().clear()
+        self.addCleanup(get_report_cache().clear)
+        # Closing changes the ledger, which is shared by all tests
+        self.ledger = Ledger.objects.get(pk=self.ledger.pk)
+        self.end_of_year = date(2018, 12, 31)
+
+    def cache_balance(self) -> Balance:
+        # Reports are only stored once the database transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return Balance(self.end_of_year)
+
+    def cache_profit_loss(self) -> ProfitLoss:
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProfitLoss(self.ledger)
+
+    def test_that_balance_is_served_from_the_cache(self):
+        balance = self.cache_balance()
+        # Only the ledger versions
+        with self.assertNumQueries(1):
+            cached_balance = Balance(self.end_of_year)
+        self.assertListEqual(balance.debit_balance_items, cached_balance.debit_balance_items)
+        self.assertListEqual(balance.credit_balance_items, cached_balance.credit_balance_items)
+
+    def test_that_profit_loss_is_served_from_the_cache(self):
+        profit_loss = self.cache_profit_loss()
+        # Only the ledger version
+        with self.assertNumQueries(1):
+            cached_profit_loss = ProfitLoss(self.ledger)
+        self.assertListEqual(profit_loss.profit_loss_lines, cached_profit_loss.profit_loss_lines)
+        self.assertEqual(profit_loss.total, cached_profit_loss.total)
+
+    def test_that_exporter_is_served_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            exporter = LedgerExporter(self.ledger)
+            exporter.profit_loss, exporter.balance
+        exporter = LedgerExporter(self.ledger)
+        with self.assertNumQueries(2):
+            exporter.profit_loss, exporter.balance
+
+    def test_that_cache_is_invalidated_on_create(self):
+        self.cache_balance()
+        self.cache_profit_loss()
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 6, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=100)
+        self.assertIn(BalanceItem(self.bank, 1300), Balance(self.end_of_year).debit_balance_items)
+        self.assertEqual(200, ProfitLoss(self.ledger).total.debit)
+
+    def test_that_cache_is_invalidated_on_update(self):
+        self.cache_profit_loss()
+        transaction = self.ledger.transactions.get(description='Sales')
+        transaction.amount = 500
+        transaction.save()
+        self.assertEqual(200, ProfitLoss(self.ledger).total.debit)
+
+    def test_that_cache_is_invalidated_on_delete(self):
+        self.cache_balance()
+        self.ledger.transactions.get(description='Sales').delete()
+        self.assertIn(BalanceItem(self.bank, 800), Balance(self.end_of_year).debit_balance_items)
+
+    def test_that_cache_is_invalidated_on_import(self):
+        self.cache_profit_loss()
+        contents = [
+            LedgerImporter.columns,
+            (1, datetime(2018, 6, 1), 'Sales', None, None, '1010', 'Bank', 100, None),
+            (None, None, None, None, None, '4100', 'Sales income', None, 100),
+        ]
+        LedgerImporter()._parse_contents(contents)
+        self.assertEqual(200, ProfitLoss(self.ledger).total.debit)
+
+    def test_that_cache_is_invalidated_on_rename_of_account(self):
+        self.cache_balance()
+        self.bank.name = 'Savings'
+        self.bank.save()
+        self.assertEqual('Savings', Balance(self.end_of_year).debit_balance_items[0].account.name)
+
+    def test_that_balance_of_closed_year_is_kept_when_later_years_change(self):
+        close_ledger(self.ledger)
+        self.cache_balance()
+        next_ledger = Ledger.objects.get(year=2019)
+        Transaction.objects.create(ledger=next_ledger, date=date(2019, 6, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=100)
+        with self.assertNumQueries(1):
+            Balance(self.end_of_year)
+
+    def test_that_reports_of_a_rolled_back_transaction_are_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with atomic():
+                    Balance(self.end_of_year)
+                    raise RuntimeError('Rolled back')
+        self.assertListEqual([], callbacks)
+        # The balance is computed again, and stored this time
+        with self.captureOnCommitCallbacks() as callbacks:
+            Balance(self.end_of_year)
+        self.assertEqual(1, len(callbacks))
+
+    def test_that_outdated_ledger_does_not_write_back_its_version(self):
+        version = Ledger.objects.get(pk=self.ledger.pk).version
+        outdated_ledger = Ledger.objects.get(pk=self.ledger.pk)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 6, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=100)
+        outdated_ledger.save()
+        self.assertEqual(version + 2, Ledger.objects.get(pk=self.ledger.pk).version)
@@ -0,0 +1,115 @@
+import os
+from datetime import date
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from common.test_mixins import TransactionRequiringMixin
+from ledger.balance import Balance, BalanceItem
+from ledger.closing import close_ledger, reopen_ledger
+from ledger.models import Account, Ledger, LedgerClosedError, Transaction
+from ledger.profit_loss import ProfitLoss, ProfitLossLine
+
+
+class CloseLedgerTestCase(TransactionRequiringMixin, TestCase):
+    def setUp(self):
+        # Closing changes the ledger instance, so do not share it between tests
+        self.ledger = Ledger.objects.get(pk=self.ledger.pk)
+        self.end_of_year = date(self.year, 12, 31)
+        self.expected_debit_items = [BalanceItem(self.bank, 1200)]
+        self.expected_credit_items = [BalanceItem(self.creditor_owner, 1000),
+                                      BalanceItem(self.creditor_accountant, 100)]
+
+    @property
+    def equity(self) -> Account:
+        return Account.objects.get(name=Balance.equity_name)
+
+    def test_that_closing_moves_result_into_equity(self):
+        close_ledger(self.ledger)
+        self.ledger.refresh_from_db()
+        self.assertTrue(self.ledger.is_closed)
+
+        closing_entries = self.ledger.transactions.filter(kind=Transaction.CLOSING)
+        self.assertEqual(2, closing_entries.count())
+        self.assertTrue(closing_entries.filter(debit_account=self.sales, credit_account=self.equity,
+                                               amount=400).exists())
+        self.assertTrue(closing_entries.filter(debit_account=self.equity, credit_account=self.administration,
+                                               amount=300).exists())
+
+    def test_that_closing_does_not_change_profit_loss_and_balance(self):
+        close_ledger(self.ledger)
+
+        profit_loss = ProfitLoss(self.ledger)
+        self.assertListEqual([ProfitLossLine(self.sales, 400, None), ProfitLossLine(self.administration, None, 300)],
+                             profit_loss.profit_loss_lines)
+
+        balance = Balance(self.end_of_year)
+        self.assertListEqual(self.expected_debit_items, balance.debit_balance_items)
+        self.assertListEqual(self.expected_credit_items + [BalanceItem(self.equity, 100)],
+                             balance.credit_balance_items)
+
+    def test_that_closing_carries_forward_balance(self):
+        next_ledger = close_ledger(self.ledger)
+        self.assertEqual(self.year + 1, next_ledger.year)
+
+        opening_entries = next_ledger.transactions.filter(kind=Transaction.OPENING)
+        self.assertEqual(3, opening_entries.count())
+        self.assertTrue(opening_entries.filter(debit_account=self.bank, credit_account=self.equity,
+                                               amount=1200).exists())
+
+        Transaction.objects.create(ledger=next_ledger, date=date(self.year + 1, 2, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=50)
+        balance = Balance(date(self.year + 1, 6, 30))
+        self.assertListEqual([BalanceItem(self.bank, 1250)], balance.debit_balance_items)
+        self.assertListEqual(self.expected_credit_items + [BalanceItem(self.equity, 150)],
+                             balance.credit_balance_items)
+
+    def test_that_closed_ledger_refuses_changes(self):
+        close_ledger(self.ledger)
+        transaction = self.ledger.transactions.first()
+        transaction.amount = 1
+        with self.assertRaises(LedgerClosedError):
+            transaction.save()
+        with self.assertRaises(LedgerClosedError):
+            transaction.delete()
+        with self.assertRaises(LedgerClosedError):
+            Transaction.objects.create(ledger=self.ledger, date=self.date, description='Late invoice',
+                                       debit_account=self.administration, credit_account=self.bank, amount=10)
+        with self.assertRaises(LedgerClosedError):
+            close_ledger(self.ledger)
+
+    def test_that_ledgers_must_be_closed_in_order(self):
+        next_ledger = Ledger.objects.create(chart=self.chart, year=self.year + 1)
+        Ledger.objects.create(chart=self.chart, year=self.year - 1)
+        with self.assertRaises(LedgerClosedError):
+            close_ledger(next_ledger)
+
+    def test_that_end_book_year_exports_and_closes(self):
+        with TemporaryDirectory() as base_dir, override_settings(BASE_DIR=base_dir):
+            os.mkdir(os.path.join(base_dir, 'tmp'))
+            call_command('end_book_year', str(self.year), stdout=StringIO())
+            self.assertNotEqual([], os.listdir(os.path.join(base_dir, 'tmp')))
+        self.ledger.refresh_from_db()
+        self.assertTrue(self.ledger.is_closed)
+
+    def test_that_end_book_year_refuses_ledger_that_cannot_be_closed_before_exporting(self):
+        Ledger.objects.create(chart=self.chart, year=self.year - 1)
+        with TemporaryDirectory() as base_dir, override_settings(BASE_DIR=base_dir):
+            os.mkdir(os.path.join(base_dir, 'tmp'))
+            with self.assertRaisesMessage(CommandError, 'All ledgers before {} must be closed first'.format(self.year)):
+                call_command('end_book_year', str(self.year), stdout=StringIO())
+            self.assertListEqual([], os.listdir(os.path.join(base_dir, 'tmp')))
+
+    def test_that_reopening_removes_closing_and_opening_entries(self):
+        close_ledger(self.ledger)
+        reopen_ledger(self.ledger)
+        self.ledger.refresh_from_db()
+        self.assertFalse(self.ledger.is_closed)
+        self.assertFalse(Transaction.objects.exclude(kind=Transaction.REGULAR).exists())
+
+        balance = Balance(date(self.year + 1, 6, 30))
+        self.assertListEqual(self.expected_debit_items, balance.debit_balance_items)
+        self.assertListEqual(self.expected_credit_items + [BalanceItem(self.equity, 100)],
+                             balance.credit_balance_items)
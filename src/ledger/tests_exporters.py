@@ -1,15 +1,18 @@
+import os.path
 from decimal import Decimal
+from tempfile import TemporaryDirectory
 
 import datetime
 from django.test import TestCase
 from django.utils import timezone
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
 from unittest.mock import call, patch
 
 from common.test_mixins import TransactionRequiringMixin
 from common.utils import Matrix
-from ledger.balance import Balance
+from ledger.balance import Balance, get_month_ends
 from ledger.exporters import LedgerExporter
+from ledger.models import Ledger, Transaction
 from ledger.profit_loss import ProfitLoss
 
 
@@ -57,9 +60,77 @@ class ExporterTestCase(TransactionRequiringMixin, TestCase):
                 [None, 'Total', Decimal('1200.00'), None, 'Total', Decimal('1200.00')]]
 
     def test_that_ledger_is_exported_correctly(self):
-        with patch('ledger.exporters.write_xlsx') as mock_xlsx_writer:
+        with patch('ledger.exporters.write_xlsx_stream') as mock_xlsx_writer:
             self.exporter.write_ledger_to_xlsx(self.filename)
-            mock_xlsx_writer.assert_called_once_with(self.ledger_contents, self.filename)
+            mock_xlsx_writer.assert_called_once()
+            contents, filename = mock_xlsx_writer.call_args[0]
+            self.assertListEqual(self.ledger_contents, list(contents))
+            self.assertEqual(self.filename, filename)
+
+    def test_that_ledger_contents_are_fetched_in_one_query(self):
+        for day in range(1, 21):
+            Transaction.objects.create(ledger=self.ledger, date=datetime.date(2018, 2, day), description='Invoice',
+                                       debit_account=self.administration, credit_account=self.creditor_accountant,
+                                       amount=day)
+        with self.assertNumQueries(1):
+            contents = list(self.exporter._generate_contents_from_ledger(self.ledger))
+        self.assertEqual(1 + 2 * 24, len(contents))
+        self.assertListEqual([None, None, None, None, 'Accountant', '2011', 'Creditor: Accountant', None,
+                              Decimal('20.00')], contents[-1])
+
+    def test_that_lines_of_one_transaction_are_exported_below_each_other(self):
+        transaction = Transaction(ledger=self.ledger, date=datetime.date(2018, 2, 1), description='Invoice')
+        transaction.set_lines([(self.administration, 250), (self.bank, 50), (self.creditor_accountant, -300)])
+        transaction.save()
+        contents = list(self.exporter._generate_contents_from_ledger(self.ledger))
+        self.assertListEqual([
+            [5, datetime.date(2018, 2, 1), 'Invoice', '', None, '5010', 'Administration', Decimal('250.00'), None],
+            [None, None, None, None, None, '1010', 'Bank', Decimal('50.00'), None],
+            [None, None, None, None, 'Accountant', '2011', 'Creditor: Accountant', None, Decimal('300.00')],
+        ], contents[-3:])
+
+    def test_that_ledger_export_does_not_compute_reports(self):
+        with patch('ledger.exporters.write_xlsx_stream') as mock_xlsx_writer:
+            mock_xlsx_writer.side_effect = lambda contents, *args, **kwargs: list(contents)
+            # Only the transactions
+            with self.assertNumQueries(1):
+                LedgerExporter(self.ledger).write_ledger_to_xlsx(self.filename)
+
+    def test_that_general_ledger_is_exported_with_a_worksheet_per_account(self):
+        with TemporaryDirectory() as tmp_dir:
+            full_path_to_file = os.path.join(tmp_dir, 'general_ledger.xlsx')
+            self.exporter.write_general_ledger_to_xlsx(full_path_to_file)
+            workbook = load_workbook(full_path_to_file)
+            self.assertListEqual(['1010', '2010', '2011', '4100', '5010'], workbook.sheetnames)
+            self.assertListEqual([
+                ('Date', 'Description', 'Invoice number', 'Debit', 'Credit', 'Balance'),
+                (datetime.datetime(2018, 1, 1), 'Opening balance', None, None, None, 0),
+                (datetime.datetime(2018, 1, 1), 'Initial investment', None, 1000, None, 1000),
+                (datetime.datetime(2018, 1, 3), 'Sales', None, 400, None, 1400),
+                (datetime.datetime(2018, 1, 4), 'Partial payment accountant', None, None, 200, 1200),
+                (datetime.datetime(2018, 12, 31), 'Closing balance', None, 1400, 200, 1200),
+            ], list(workbook['1010'].values))
+            self.assertTrue(workbook['1010']['F6'].font.bold)
+
+    def test_that_general_ledger_of_selected_accounts_is_exported(self):
+        with patch('ledger.exporters.XlsxStreamWriter') as mock_writer:
+            writer = mock_writer.return_value.__enter__.return_value
+            writer.write_sheet.side_effect = lambda contents, *args, **kwargs: list(contents)
+            self.exporter.write_general_ledger_to_xlsx(self.filename, accounts=[self.creditor_accountant])
+        mock_writer.assert_called_once_with(self.filename)
+        writer.write_sheet.assert_called_once()
+        self.assertEqual('2011', writer.write_sheet.call_args[0][1])
+
+    def test_that_reports_are_computed_once_per_exporter(self):
+        with patch('ledger.exporters.ProfitLoss') as mock_profit_loss, \
+                patch('ledger.exporters.Balance') as mock_balance:
+            exporter = LedgerExporter(self.ledger)
+            mock_profit_loss.assert_not_called()
+            mock_balance.assert_not_called()
+            self.assertIs(exporter.profit_loss, exporter.profit_loss)
+            self.assertIs(exporter.balance, exporter.balance)
+        mock_profit_loss.assert_called_once_with(ledger=self.ledger)
+        mock_balance.assert_called_once_with(datetime.date(2018, 12, 31))
 
     def test_that_profit_loss_is_exported_correctly_to_xlsx(self):
         with patch('ledger.exporters.write_xlsx') as mock_xlsx_writer:
@@ -80,3 +151,52 @@ class ExporterTestCase(TransactionRequiringMixin, TestCase):
                 call(self.profit_loss_contents, self.filename, worksheet_name='PL'),
                 call(self.balance_contents, self.filename, workbook=workbook, worksheet_name='Balance')
             ])
+
+    def test_that_balance_series_is_exported_correctly_to_xlsx(self):
+        dates = [datetime.date(2017, 12, 31), datetime.date(2018, 1, 2), datetime.date(2018, 1, 31)]
+        with patch('ledger.exporters.write_xlsx') as mock_xlsx_writer:
+            self.exporter.write_balance_series_to_xlsx(self.filename, dates)
+            mock_xlsx_writer.assert_called_once_with([
+                ['Account', 'Description'] + dates,
+                ['1010', 'Bank', None, Decimal('1000.00'), Decimal('1200.00')],
+                [None, 'Total debit', Decimal(0), Decimal('1000.00'), Decimal('1200.00')],
+                ['2010', 'Creditor: Owner', None, Decimal('1000.00'), Decimal('1000.00')],
+                ['2011', 'Creditor: Accountant', None, Decimal('300.00'), Decimal('100.00')],
+                ['1900', 'Eigen vermogen', Decimal(0), Decimal('-300.00'), Decimal('100.00')],
+                [None, 'Total credit', Decimal(0), Decimal('1000.00'), Decimal('1200.00')],
+            ], self.filename, currency_columns=['C', 'D', 'E'])
+
+    def test_that_balance_series_is_exported_at_month_ends_by_default(self):
+        with patch('ledger.exporters.write_xlsx') as mock_xlsx_writer:
+            self.exporter.write_balance_series_to_xlsx(self.filename)
+            contents = mock_xlsx_writer.call_args[0][0]
+            self.assertListEqual(['Account', 'Description'] + get_month_ends(2018), contents[0])
+            self.assertListEqual([None, 'Total credit'] + [Decimal('1200.00')] * 12, contents[-1])
+
+    def test_that_profit_loss_comparison_is_exported_correctly_to_xlsx(self):
+        Ledger.objects.create(chart=self.chart, year=2017)
+        Transaction.objects.create(ledger=Ledger.objects.get(year=2017), date=datetime.date(2017, 1, 1),
+                                   description='Sales', debit_account=self.bank, credit_account=self.sales,
+                                   amount=100)
+        workbook = Workbook()
+        with patch('ledger.exporters.write_xlsx', return_value=workbook) as mock_xlsx_writer:
+            self.exporter.write_profit_loss_comparison_to_xlsx('path/to/file', nr_years=2)
+        years_call, months_call = mock_xlsx_writer.call_args_list
+        self.assertListEqual([
+            ['Account', 'Description', 2017, 2018, 'Change 2018'],
+            ['4100', 'Sales income', Decimal('100.00'), Decimal('400.00'), Decimal('300.00')],
+            ['5010', 'Administration', Decimal(0), Decimal('-300.00'), Decimal('-300.00')],
+            [None, 'Total', Decimal('100.00'), Decimal('100.00'), Decimal(0)],
+        ], years_call[0][0])
+        self.assertEqual(call(years_call[0][0], self.filename, worksheet_name='Years',
+                              currency_columns=['C', 'D', 'E']), years_call)
+
+        months_contents = months_call[0][0]
+        self.assertListEqual(['Account', 'Description', 'Year', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
+                              'Sep', 'Oct', 'Nov', 'Dec', 'Total'], months_contents[0])
+        self.assertListEqual(['4100', 'Sales income', 2018, Decimal('400.00')] + [Decimal(0)] * 11 +
+                             [Decimal('400.00')], months_contents[2])
+        self.assertListEqual([None, 'Total', 2018, Decimal('100.00')] + [Decimal(0)] * 11 + [Decimal('100.00')],
+                             months_contents[-1])
+        self.assertEqual(workbook, months_call[1]['workbook'])
+        self.assertEqual('Months', months_call[1]['worksheet_name'])
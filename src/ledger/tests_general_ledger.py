@@ -0,0 +1,54 @@
+from decimal import Decimal
+
+from datetime import date
+from django.test import TestCase
+
+from common.test_mixins import TransactionRequiringMixin
+from ledger.closing import close_ledger
+from ledger.general_ledger import GeneralLedger
+from ledger.models import Ledger, Transaction
+
+
+class GeneralLedgerTestCase(TransactionRequiringMixin, TestCase):
+    def setUp(self):
+        # Closing changes the ledger instance, so do not share it between tests
+        self.ledger = Ledger.objects.get(pk=self.ledger.pk)
+
+    def get_accounts(self, general_ledger):
+        return {account.code: (opening_balance, [(line.transaction.description, balance) for line, balance in entries])
+                for account, opening_balance, entries in general_ledger.generate_accounts()}
+
+    def test_that_running_balance_follows_the_debit_type(self):
+        accounts = self.get_accounts(GeneralLedger(self.ledger))
+        self.assertListEqual(['1010', '2010', '2011', '4100', '5010'], sorted(accounts))
+        self.assertEqual((Decimal(0), [('Initial investment', Decimal('1000.00')), ('Sales', Decimal('1400.00')),
+                                       ('Partial payment accountant', Decimal('1200.00'))]), accounts['1010'])
+        self.assertEqual((Decimal(0), [('Accountant sent invoice', Decimal('300.00')),
+                                       ('Partial payment accountant', Decimal('100.00'))]), accounts['2011'])
+        self.assertEqual((Decimal(0), [('Accountant sent invoice', Decimal('300.00'))]), accounts['5010'])
+
+    def test_that_opening_balance_is_carried_forward_from_the_year_before(self):
+        next_ledger = close_ledger(self.ledger)
+        Transaction.objects.create(ledger=next_ledger, date=date(2019, 2, 1), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=50)
+        accounts = self.get_accounts(GeneralLedger(next_ledger))
+        # The opening entries are not repeated as mutations, and profit/loss accounts start from zero
+        self.assertEqual((Decimal('1200.00'), [('Sales', Decimal('1250.00'))]), accounts['1010'])
+        self.assertEqual((Decimal(0), [('Sales', Decimal('50.00'))]), accounts['4100'])
+        self.assertEqual((Decimal('1000.00'), []), accounts['2010'])
+        self.assertNotIn('5010', accounts)
+
+    def test_that_only_the_selected_accounts_are_generated(self):
+        empty_ledger = Ledger.objects.create(chart=self.chart, year=2017)
+        accounts = self.get_accounts(GeneralLedger(empty_ledger, accounts=[self.bank, self.sales]))
+        self.assertDictEqual({'1010': (Decimal(0), []), '4100': (Decimal(0), [])}, accounts)
+
+    def test_that_the_lines_of_all_accounts_are_fetched_in_one_query(self):
+        for day in range(1, 21):
+            Transaction.objects.create(ledger=self.ledger, date=date(2018, 2, day), description='Invoice',
+                                       debit_account=self.administration, credit_account=self.creditor_accountant,
+                                       amount=day)
+        general_ledger = GeneralLedger(self.ledger)
+        with self.assertNumQueries(1):
+            accounts = self.get_accounts(general_ledger)
+        self.assertEqual(Decimal('310.00'), accounts['2011'][1][-1][1])
@@ -2,12 +2,18 @@ import os.path
 
 from datetime import date, datetime
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+from unittest.mock import patch
 
 from common.test_mixins import AccountRequiringMixin
+from common.utils import Matrix
 from contacts.models import Contact
 from ledger.importers import LedgerImportError, LedgerImporter
-from ledger.models import Ledger, Transaction
+from ledger.models import AccountPeriodTotal, Ledger, Transaction
 
 
 class LedgerImportTestCase(AccountRequiringMixin, TestCase):
@@ -37,7 +43,7 @@ class LedgerImportTestCase(AccountRequiringMixin, TestCase):
         return self.ledger_contents[0]
 
     def test_that_xlsx_is_properly_read(self):
-        contents = self.importer._read_xlsx(self.input_file)
+        contents = list(self.importer._read_xlsx(self.input_file))
         expected_contents = self.ledger_contents
         self.assertListEqual(expected_contents, contents)
 
@@ -89,6 +95,38 @@ class LedgerImportTestCase(AccountRequiringMixin, TestCase):
         with self.assertRaisesMessage(LedgerImportError, msg):
             self.importer._parse_contents(contents)
 
+    def test_that_rows_of_one_transaction_become_its_lines(self):
+        contents = [
+            self.header,
+            [1, datetime(2018, 1, 2, 0, 0), 'Accountant sent invoice', 'INV-123', None,
+             '5010', 'Administration', 250, None],
+            (None, None, None, None, None, '1010', 'Bank', 50, None),
+            (None, None, None, None, 'Accountant', '2011', 'Creditor: Accountant', None, 300),
+            (None, None, None, None, None, '1010', 'Bank', 1000, None),
+            (None, None, None, None, None, '2010', 'Creditor: Owner', None, 1000),
+        ]
+        self.importer._parse_contents(contents)
+        transaction = Transaction.objects.get()
+        self.assertIsNone(transaction.debit_account)
+        self.assertListEqual([(self.administration.pk, 250), (self.bank.pk, 50), (self.creditor_accountant.pk, -300),
+                              (self.bank.pk, 1000), (self.creditor_owner.pk, -1000)],
+                             [(line.account_id, line.amount) for line in transaction.lines.all()])
+        self.assertEqual(self.accountant, transaction.contact)
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+    def test_that_ledger_import_checks_balance_of_transactions_with_more_lines(self):
+        contents = [
+            self.header,
+            [1, datetime(2018, 1, 2, 0, 0), 'Accountant sent invoice', None, None, '5010', 'Administration', 250, None],
+            (None, None, None, None, None, '1010', 'Bank', 50, None),
+            (None, None, None, None, 'Accountant', '2011', 'Creditor: Accountant', None, 310),
+            [2, datetime(2018, 1, 3, 0, 0), 'Sales', None, None, '1010', 'Bank', 400, None],
+            (None, None, None, None, None, '4100', 'Sales income', None, 400),
+        ]
+        msg = 'Transaction in row 4 is not in balance'
+        with self.assertRaisesMessage(LedgerImportError, msg):
+            self.importer._parse_contents(contents)
+
     def test_that_transactions_imported_twice_are_only_present_once(self):
         contents = [
             self.header,
@@ -98,3 +136,99 @@ class LedgerImportTestCase(AccountRequiringMixin, TestCase):
         self.importer._parse_contents(contents.copy())
         self.importer._parse_contents(contents.copy())
         self.assertEqual(1, Transaction.objects.count())
+
+    def test_that_rows_are_parsed_while_streaming(self):
+        def stream_contents():
+            yield self.header
+            yield [1, datetime(2018, 1, 1, 0, 0), 'Initial investment', None, None, '1010', 'Bank', 1000, None]
+            yield [None, None, None, None, 'Owner', '2010', 'Creditor: Owner', None, 1000]
+            yield [2, datetime(2018, 1, 2, 0, 0), 'Sales', None, None, '1010', 'Bank', 400, None]
+            # The first transaction is complete once the next one starts, and is written before reading on
+            self.assertEqual(1, Transaction.objects.count())
+            yield [None, None, None, None, None, '4100', 'Sales income', None, 400]
+
+        self.importer.batch_size = 1
+        self.importer._parse_contents(stream_contents())
+        self.assertEqual(2, Transaction.objects.count())
+
+    def test_that_columns_can_be_in_any_order(self):
+        contents = [
+            ('Credit', 'Debit', 'Account name', 'Account code', 'Contact', 'Invoice number', 'Description', 'Date',
+             'ID'),
+            (None, 1000, 'Bank', '1010', None, None, 'Initial investment', datetime(2018, 1, 1, 0, 0), 1),
+            (1000, None, 'Creditor: Owner', '2010', 'Owner', None, None, None, None),
+        ]
+        self.importer._parse_contents(contents)
+        transaction = Transaction.objects.get()
+        self.assertEqual(self.bank, transaction.debit_account)
+        self.assertEqual(self.creditor_owner, transaction.credit_account)
+
+    def test_that_missing_columns_are_reported(self):
+        contents = [self.header[:-1]]
+        with self.assertRaisesMessage(LedgerImportError, 'The columns Credit are missing in the header'):
+            self.importer._parse_contents(contents)
+
+    @staticmethod
+    def count_queries(context: CaptureQueriesContext) -> int:
+        # Inserts are split in chunks by the database backend, so their number depends on the number of rows
+        return len([query for query in context.captured_queries
+                    if not query['sql'].startswith(('INSERT', 'SAVEPOINT', 'RELEASE SAVEPOINT'))])
+
+    def generate_contents(self, nr_transactions: int) -> Matrix:
+        contents = [self.header]
+        for index in range(1, nr_transactions + 1):
+            contents += [
+                [index, datetime(2018, 1, 1 + index % 28), 'Invoice {}'.format(index), None, None,
+                 '5010', 'Administration', index, None],
+                [None, None, None, None, 'Contact {}'.format(index % 3), '2011', 'Creditor: Accountant', None, index],
+            ]
+        return contents
+
+    def test_that_number_of_queries_does_not_depend_on_number_of_rows(self):
+        with CaptureQueriesContext(connection) as small_import:
+            LedgerImporter()._parse_contents(self.generate_contents(5))
+        Transaction.objects.all().delete()
+        AccountPeriodTotal.objects.all().delete()
+        with CaptureQueriesContext(connection) as large_import:
+            LedgerImporter()._parse_contents(self.generate_contents(100))
+        self.assertEqual(self.count_queries(small_import), self.count_queries(large_import))
+        self.assertEqual(100, Transaction.objects.count())
+        self.assertEqual(1, Ledger.objects.count())
+        self.assertEqual(3, Contact.objects.filter(name__startswith='Contact').count())
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+    def test_that_transactions_are_written_in_batches(self):
+        importer = LedgerImporter(batch_size=10)
+        with patch.object(Transaction.objects, 'bulk_create', wraps=Transaction.objects.bulk_create) as bulk_create:
+            importer._parse_contents(self.generate_contents(25))
+        self.assertEqual(3, bulk_create.call_count)
+        self.assertEqual(25, Transaction.objects.count())
+
+    def test_that_nothing_is_imported_if_a_row_is_invalid(self):
+        contents = self.generate_contents(25)
+        contents[-1][5] = '9999'
+        msg = 'Account with code 9999 (Creditor: Accountant) does not exist in row 51'
+        with self.assertRaisesMessage(LedgerImportError, msg):
+            LedgerImporter(batch_size=10)._parse_contents(contents)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(AccountPeriodTotal.objects.exists())
+
+    def test_that_reimport_replaces_existing_transactions_by_fingerprint(self):
+        LedgerImporter()._parse_contents(self.generate_contents(5))
+        with CaptureQueriesContext(connection) as small_reimport:
+            LedgerImporter()._parse_contents(self.generate_contents(5))
+        LedgerImporter()._parse_contents(self.generate_contents(100))
+        with CaptureQueriesContext(connection) as large_reimport:
+            LedgerImporter()._parse_contents(self.generate_contents(100))
+        self.assertEqual(self.count_queries(small_reimport), self.count_queries(large_reimport))
+        self.assertEqual(100, Transaction.objects.count())
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+    def test_that_import_command_reports_the_profile(self):
+        out = StringIO()
+        call_command('import_ledger', self.input_file, '--profile', stdout=out)
+        self.assertEqual(4, Transaction.objects.count())
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('import_ledger: '))
+        self.assertTrue(any(line.startswith('  fetch: ') for line in lines))
+        self.assertTrue(any(line.startswith('  save: ') for line in lines))
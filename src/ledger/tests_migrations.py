@@ -0,0 +1,101 @@
+import os.path
+from decimal import Decimal
+from tempfile import TemporaryDirectory
+from unittest import skipUnless
+
+import datetime
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from ledger.balance import Balance
+from ledger.fingerprints import make_fingerprint
+from ledger.models import AccountPeriodTotal, Ledger, Transaction, TransactionLine
+from ledger.profit_loss import ProfitLoss
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The migrations are run on a new SQLite database')
+class MigrationTestCase(TransactionTestCase):
+    """
+    Migrate a database that was populated before the first migration of this project to the latest migrations
+    """
+
+    # State of the database before this project changed it
+    baseline = [('contacts', '0002_auto_20190422_1759'), ('accounts', '0001_initial'), ('ledger', '0001_initial')]
+
+    def setUp(self):
+        # The migrations run on the default connection, so it is replaced by a connection to an empty database
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        test_connection = connections[DEFAULT_DB_ALIAS]
+        database = test_connection.__class__(dict(test_connection.settings_dict,
+                                                  NAME=os.path.join(tmp_dir.name, 'db.sqlite3')), DEFAULT_DB_ALIAS)
+        connections[DEFAULT_DB_ALIAS] = database
+        self.addCleanup(connections.__setitem__, DEFAULT_DB_ALIAS, test_connection)
+        self.addCleanup(database.close)
+
+        self.database = database
+        executor = MigrationExecutor(database)
+        executor.migrate(self.baseline)
+        self.populate(executor.loader.project_state(self.baseline).apps)
+        executor = MigrationExecutor(database)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    @staticmethod
+    def populate(apps):
+        now = timezone.now()
+
+        def create(app_label, model_name, uuid, **fields):
+            return apps.get_model(app_label, model_name).objects.create(uuid=uuid, created_at=now, updated_at=now,
+                                                                        **fields)
+
+        owner = create('contacts', 'Contact', 'OWNER', name='Owner')
+        chart = create('accounts', 'ChartOfAccounts', 'CHART')
+        accounts = {code: create('accounts', 'Account', code, chart=chart, code=code, name=name, type=account_type,
+                                 debit_type=debit_type, contact=contact)
+                    for code, name, account_type, debit_type, contact in (
+                        ('1010', 'Bank', 'balance', 'debit', None),
+                        ('2010', 'Creditor: Owner', 'balance', 'credit', owner),
+                        ('4100', 'Sales income', 'profit_loss', 'credit', None))}
+        ledger = create('ledger', 'Ledger', 'LEDGER', chart=chart, year=2019)
+        for uuid, date, debit, credit, amount in (('T1', datetime.date(2019, 1, 3), '1010', '2010', 1000),
+                                                  ('T2', datetime.date(2019, 1, 11), '1010', '4100', 200),
+                                                  ('T3', datetime.date(2019, 2, 10), '1010', '4100', 50)):
+            create('ledger', 'Transaction', uuid, ledger=ledger, date=date, description='Transaction {}'.format(uuid),
+                   debit_account=accounts[debit], credit_account=accounts[credit], amount=amount)
+
+    def test_that_period_totals_are_filled_from_existing_transactions(self):
+        self.assertSetEqual({
+            ('1010', datetime.date(2019, 1, 1), Decimal('1200.00'), Decimal(0)),
+            ('1010', datetime.date(2019, 2, 1), Decimal('50.00'), Decimal(0)),
+            ('2010', datetime.date(2019, 1, 1), Decimal(0), Decimal('1000.00')),
+            ('4100', datetime.date(2019, 1, 1), Decimal(0), Decimal('200.00')),
+            ('4100', datetime.date(2019, 2, 1), Decimal(0), Decimal('50.00')),
+        }, set(AccountPeriodTotal.objects.values_list('account__code', 'period', 'debit', 'credit')))
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+    def test_that_fingerprints_are_calculated_from_the_new_ids(self):
+        for transaction in Transaction.objects.all():
+            self.assertEqual(make_fingerprint(transaction.date, transaction.ledger_id, transaction.description,
+                                              transaction.invoice_number, transaction.debit_account_id,
+                                              transaction.credit_account_id, transaction.amount),
+                             transaction.fingerprint)
+
+    def test_that_reports_hold_existing_transactions(self):
+        self.assertEqual(6, TransactionLine.objects.count())
+        self.assertEqual(Decimal('1250.00'), Balance(datetime.date(2019, 12, 31)).debit_sum)
+        self.assertEqual(Decimal('250.00'), ProfitLoss(Ledger.objects.get()).total.debit)
+
+    def test_that_migrations_are_reversed_to_uuid_keys(self):
+        executor = MigrationExecutor(self.database)
+        executor.migrate(self.baseline)
+        apps = executor.loader.project_state(self.baseline).apps
+        self.assertSetEqual({('1010', 'CHART', None), ('2010', 'CHART', 'OWNER'), ('4100', 'CHART', None)},
+                            set(apps.get_model('accounts', 'Account').objects.values_list('uuid', 'chart', 'contact')))
+        self.assertSetEqual({
+            ('T1', 'LEDGER', '1010', '2010', Decimal('1000.00')),
+            ('T2', 'LEDGER', '1010', '4100', Decimal('200.00')),
+            ('T3', 'LEDGER', '1010', '4100', Decimal('50.00')),
+        }, set(apps.get_model('ledger', 'Transaction').objects
+               .values_list('uuid', 'ledger', 'debit_account', 'credit_account', 'amount')))
@@ -0,0 +1,173 @@
+from decimal import Decimal
+
+from datetime import date
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+
+from common.test_mixins import LedgerRequiringMixin
+from ledger.balance import Balance, BalanceItem
+from ledger.models import AccountPeriodTotal, Transaction, TransactionLine, UnbalancedTransactionError
+
+
+class TransactionTestCase(LedgerRequiringMixin, TestCase):
+    def test_that_primary_key_is_integer_and_uuid_is_unique_external_id(self):
+        transaction = Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                                 debit_account=self.bank, credit_account=self.sales, amount=400)
+        self.assertIsInstance(transaction.pk, int)
+        self.assertIsInstance(transaction.ledger_id, int)
+        self.assertIsInstance(transaction.debit_account_id, int)
+        self.assertEqual(transaction, Transaction.objects.get(uuid=transaction.uuid))
+
+    def test_that_fingerprint_is_stored_on_save(self):
+        transaction = Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                                 debit_account=self.bank, credit_account=self.sales, amount=400)
+        self.assertEqual(64, len(transaction.fingerprint))
+        self.assertTrue(Transaction.objects.filter(fingerprint=transaction.fingerprint).exists())
+
+    def test_that_fingerprint_depends_on_content(self):
+        transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                  debit_account=self.bank, credit_account=self.sales, amount=400)
+        same_transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                       debit_account=self.bank, credit_account=self.sales, amount=Decimal('400.00'))
+        other_transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                        debit_account=self.bank, credit_account=self.sales, amount=401)
+        self.assertEqual(transaction.make_fingerprint(), same_transaction.make_fingerprint())
+        self.assertNotEqual(transaction.make_fingerprint(), other_transaction.make_fingerprint())
+
+
+class TransactionLineTestCase(LedgerRequiringMixin, TestCase):
+    def create_invoice(self) -> Transaction:
+        transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Invoice')
+        transaction.set_lines([(self.administration, 250), (self.bank, 50), (self.creditor_accountant, -300)])
+        transaction.save()
+        return transaction
+
+    def test_that_simple_transaction_is_saved_with_a_debit_line_and_a_credit_line(self):
+        transaction = Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                                 debit_account=self.bank, credit_account=self.sales, amount=400)
+        self.assertListEqual([(self.bank.pk, Decimal(400)), (self.sales.pk, Decimal(-400))],
+                             list(transaction.lines.values_list('account', 'amount')))
+
+        transaction.date = date(2018, 2, 10)
+        transaction.credit_account = self.creditor_owner
+        transaction.save()
+        self.assertListEqual([(self.bank.pk, date(2018, 2, 10)), (self.creditor_owner.pk, date(2018, 2, 10))],
+                             list(transaction.lines.values_list('account', 'date')))
+
+    def test_that_transaction_can_have_more_lines(self):
+        transaction = self.create_invoice()
+        self.assertIsNone(transaction.debit_account)
+        self.assertIsNone(transaction.amount)
+        self.assertEqual(3, TransactionLine.objects.filter(transaction=transaction, ledger=self.ledger).count())
+
+        self.assertListEqual([BalanceItem(self.bank, 50)], Balance(date(2018, 1, 31)).debit_balance_items)
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+        transaction = Transaction.objects.get(pk=transaction.pk)
+        transaction.description = 'Invoice accountant'
+        transaction.save()
+        self.assertEqual(3, transaction.lines.count())
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+        transaction.delete()
+        self.assertFalse(TransactionLine.objects.exists())
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+
+    def test_that_transaction_must_be_in_balance(self):
+        transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Invoice')
+        transaction.set_lines([(self.administration, 250), (self.creditor_accountant, -300)])
+        with self.assertRaises(UnbalancedTransactionError):
+            transaction.save()
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_that_one_debit_line_and_one_credit_line_make_a_simple_transaction(self):
+        transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Sales')
+        transaction.set_lines([(self.sales, '-400'), (self.bank, 400)])
+        self.assertEqual((self.bank, self.sales, 400),
+                         (transaction.debit_account, transaction.credit_account, transaction.amount))
+
+    def test_that_fingerprint_does_not_depend_on_order_of_lines(self):
+        transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Invoice')
+        transaction.set_lines([(self.administration, 250), (self.bank, 50), (self.creditor_accountant, -300)])
+        same_transaction = Transaction(ledger=self.ledger, date=date(2018, 1, 10), description='Invoice')
+        same_transaction.set_lines([(self.creditor_accountant, -300), (self.administration, 250), (self.bank, 50)])
+        self.assertEqual(transaction.make_fingerprint(), same_transaction.make_fingerprint())
+
+
+class AccountPeriodTotalTestCase(LedgerRequiringMixin, TestCase):
+    def assertPeriodTotal(self, account, period, debit, credit):
+        total = AccountPeriodTotal.objects.get(ledger=self.ledger, account=account, period=period)
+        self.assertEqual((Decimal(debit), Decimal(credit)), (total.debit, total.credit))
+
+    def test_that_period_totals_are_updated_on_create(self):
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Initial investment',
+                                   debit_account=self.bank, credit_account=self.creditor_owner, amount=1000)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 20), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 2, 1), description='Withdrawal',
+                                   debit_account=self.creditor_owner, credit_account=self.bank, amount=100)
+        self.assertPeriodTotal(self.bank, date(2018, 1, 1), 1400, 0)
+        self.assertPeriodTotal(self.bank, date(2018, 2, 1), 0, 100)
+        self.assertPeriodTotal(self.creditor_owner, date(2018, 1, 1), 0, 1000)
+        self.assertPeriodTotal(self.creditor_owner, date(2018, 2, 1), 100, 0)
+        self.assertPeriodTotal(self.sales, date(2018, 1, 1), 0, 400)
+
+    def test_that_period_totals_are_updated_on_update(self):
+        transaction = Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                                 debit_account=self.bank, credit_account=self.sales, amount=400)
+        transaction.date = date(2018, 2, 10)
+        transaction.amount = 300
+        transaction.save()
+        self.assertPeriodTotal(self.bank, date(2018, 1, 1), 0, 0)
+        self.assertPeriodTotal(self.bank, date(2018, 2, 1), 300, 0)
+        self.assertPeriodTotal(self.sales, date(2018, 2, 1), 0, 300)
+
+    def test_that_period_totals_are_updated_on_delete(self):
+        transaction = Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                                 debit_account=self.bank, credit_account=self.sales, amount=400)
+        transaction.delete()
+        self.assertPeriodTotal(self.bank, date(2018, 1, 1), 0, 0)
+        self.assertPeriodTotal(self.sales, date(2018, 1, 1), 0, 0)
+
+    def test_that_amounts_are_added_by_the_database(self):
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+        january, february = date(2018, 1, 1), date(2018, 2, 1)
+        with CaptureQueriesContext(connection) as context:
+            AccountPeriodTotal.objects.apply({(self.ledger.pk, self.bank.pk, january): (Decimal(100), Decimal(0)),
+                                              (self.ledger.pk, self.bank.pk, february): (Decimal(0), Decimal(50))})
+        # The stored totals are not read first, which would lose amounts that are added concurrently
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('SELECT')])
+        self.assertPeriodTotal(self.bank, january, 500, 0)
+        self.assertPeriodTotal(self.bank, february, 0, 50)
+        self.assertPeriodTotal(self.sales, january, 0, 400)
+
+    def test_that_balance_combines_period_totals_and_transactions(self):
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Initial investment',
+                                   debit_account=self.bank, credit_account=self.creditor_owner, amount=1000)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 2, 10), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 2, 20), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=50)
+
+        self.assertListEqual([BalanceItem(self.bank, 1000)], Balance(date(2018, 1, 31)).debit_balance_items)
+        self.assertListEqual([BalanceItem(self.bank, 1000)], Balance(date(2018, 2, 9)).debit_balance_items)
+        self.assertListEqual([BalanceItem(self.bank, 1400)], Balance(date(2018, 2, 10)).debit_balance_items)
+        self.assertListEqual([BalanceItem(self.bank, 1450)], Balance(date(2018, 2, 28)).debit_balance_items)
+
+    def test_that_rebuild_restores_period_totals(self):
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 10), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=400)
+        Transaction.objects.create(ledger=self.ledger, date=date(2018, 1, 11), description='Sales',
+                                   debit_account=self.bank, credit_account=self.sales, amount=100)
+        AccountPeriodTotal.objects.filter(account=self.bank).update(debit=0)
+        self.assertEqual(1, len(AccountPeriodTotal.objects.verify()))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_period_totals', '--check-only', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_period_totals', stdout=StringIO())
+        self.assertListEqual([], AccountPeriodTotal.objects.verify())
+        self.assertPeriodTotal(self.bank, date(2018, 1, 1), 500, 0)
@@ -4,8 +4,8 @@ from django.test import TestCase
 from django.utils import timezone
 
 from common.test_mixins import AccountRequiringMixin, LedgerRequiringMixin
-from ledger.models import Transaction
-from ledger.profit_loss import ProfitLoss, ProfitLossLine
+from ledger.models import Account, Ledger, Transaction
+from ledger.profit_loss import ProfitLoss, ProfitLossCube, ProfitLossLine
 
 
 class ProfitLossLineTestCase(AccountRequiringMixin, TestCase):
@@ -87,3 +87,71 @@ class ProfitLossTestCase(LedgerRequiringMixin, TestCase):
                                    credit_account=self.bank, amount=100)
         pl = ProfitLoss(self.ledger)
         self.assertEqual(0, len(pl.profit_loss_lines))
+
+    def test_that_number_of_queries_does_not_depend_on_number_of_accounts(self):
+        Transaction.objects.create(ledger=self.ledger, date=timezone.datetime(year=self.year, month=3, day=28).date(),
+                                   description='New client', debit_account=self.bank,
+                                   credit_account=self.sales, amount=100)
+        ProfitLoss(self.ledger)  # Creates the profit account
+
+        # Ledger version, accounts, totals and profit account
+        with self.assertNumQueries(4):
+            ProfitLoss(self.ledger)
+
+        for code in range(6000, 6050):
+            account = Account.objects.create(chart=self.chart, code=str(code), name='Account {}'.format(code),
+                                              type=Account.PROFIT_LOSS, debit_type=Account.DEBIT)
+            Transaction.objects.create(ledger=self.ledger, date=self.date, description='Costs',
+                                       debit_account=account, credit_account=self.bank, amount=1)
+        with self.assertNumQueries(4):
+            pl = ProfitLoss(self.ledger)
+        self.assertEqual(51, len(pl.profit_loss_lines))
+        self.assertEqual(pl.total.account.name, 'Profit')
+        self.assertEqual(pl.total.debit, Decimal(50))
+
+
+class ProfitLossCubeTestCase(LedgerRequiringMixin, TestCase):
+    def setUp(self):
+        self.previous_ledger = Ledger.objects.create(chart=self.chart, year=self.year - 1)
+        for ledger, month, amount in ((self.previous_ledger, 3, 100), (self.ledger, 3, 250), (self.ledger, 3, 50),
+                                      (self.ledger, 11, 400)):
+            Transaction.objects.create(ledger=ledger, date=timezone.datetime(ledger.year, month, 10).date(),
+                                       description='Sales', debit_account=self.bank, credit_account=self.sales,
+                                       amount=amount)
+        Transaction.objects.create(ledger=self.ledger, date=timezone.datetime(self.year, 11, 20).date(),
+                                   description='Invoice accountant', debit_account=self.administration,
+                                   credit_account=self.creditor_accountant, amount=120)
+
+    def test_that_results_are_split_per_account_year_and_month(self):
+        cube = ProfitLossCube([self.year, self.year - 1])
+        self.assertListEqual([self.year - 1, self.year], cube.years)
+        self.assertListEqual([self.sales, self.administration], cube.accounts)
+        self.assertEqual(Decimal(100), cube.get_result(self.sales, self.year - 1))
+        self.assertEqual(Decimal(300), cube.get_result(self.sales, self.year, 3))
+        self.assertEqual(Decimal(0), cube.get_result(self.sales, self.year, 4))
+        self.assertEqual(Decimal(-120), cube.get_result(self.administration, self.year, 11))
+        self.assertEqual(Decimal(280), cube.get_total(self.year, 11))
+        self.assertEqual(Decimal(580), cube.get_total(self.year))
+
+    def test_that_accounts_are_ordered_by_path(self):
+        group = Account.objects.create(chart=self.chart, code='9', name='Other income', type=Account.PROFIT_LOSS,
+                                       debit_type=Account.CREDIT)
+        sales = Account.objects.get(pk=self.sales.pk)
+        sales.parent = group
+        sales.save()
+        cube = ProfitLossCube([self.year])
+        self.assertListEqual([self.administration, sales], cube.accounts)
+
+    def test_that_yearly_results_equal_profit_loss(self):
+        cube = ProfitLossCube([self.year])
+        profit_loss = ProfitLoss(self.ledger)
+        for line in profit_loss.profit_loss_lines:
+            self.assertEqual((line.debit or 0) - (line.credit or 0), cube.get_result(line.account, self.year))
+        self.assertEqual(profit_loss.total.debit, cube.get_total(self.year))
+
+    def test_that_number_of_queries_does_not_depend_on_number_of_years(self):
+        # Ledger versions, results and accounts
+        with self.assertNumQueries(3):
+            ProfitLossCube([self.year])
+        with self.assertNumQueries(3):
+            ProfitLossCube(range(self.year - 9, self.year + 1))
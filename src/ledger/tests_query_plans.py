@@ -0,0 +1,57 @@
+import re
+from unittest import skipUnless
+
+from datetime import date
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from common.test_mixins import TransactionRequiringMixin
+from ledger.balance import Balance
+from ledger.closing import close_ledger
+from ledger.exporters import LedgerExporter
+from ledger.profit_loss import ProfitLoss
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with SQLite')
+class QueryPlanTestCase(TransactionRequiringMixin, TestCase):
+    """
+    Verify that the reports find their transactions, transaction lines and period totals through an index, instead
+    of scanning the whole table
+    """
+
+    checked_tables = ('ledger_transaction', 'ledger_transactionline', 'ledger_accountperiodtotal')
+    table_scan = re.compile(r'\bSCAN ({})\b'.format('|'.join(checked_tables)))
+
+    def assertNoTableScans(self, context: CaptureQueriesContext):
+        for query in context.captured_queries:
+            if not any(table in query['sql'] for table in self.checked_tables):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if self.table_scan.search(step)]
+            self.assertListEqual([], scans, 'Query scans a whole table: {}'.format(query['sql']))
+
+    def test_that_balance_does_not_scan_all_transactions(self):
+        with CaptureQueriesContext(connection) as context:
+            Balance(date(self.year, 1, 3))
+            Balance(date(self.year, 12, 31))
+        self.assertNoTableScans(context)
+
+    def test_that_balance_after_closing_does_not_scan_all_transactions(self):
+        close_ledger(self.ledger)
+        with CaptureQueriesContext(connection) as context:
+            Balance(date(self.year + 1, 5, 3))
+        self.assertNoTableScans(context)
+
+    def test_that_profit_loss_does_not_scan_all_transactions(self):
+        with CaptureQueriesContext(connection) as context:
+            ProfitLoss(self.ledger)
+        self.assertNoTableScans(context)
+
+    def test_that_ledger_export_does_not_scan_all_transactions(self):
+        exporter = LedgerExporter(self.ledger)
+        with CaptureQueriesContext(connection) as context:
+            list(exporter._generate_contents_from_ledger(self.ledger))
+        self.assertNoTableScans(context)
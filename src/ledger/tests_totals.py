@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+import datetime
+from django.test import TestCase, override_settings
+
+from common.test_mixins import TransactionRequiringMixin
+from ledger.balance import Balance, BalanceSeries, get_month_ends
+from ledger.benchmarks import SyntheticLedgerGenerator
+from ledger.cache import get_report_cache
+from ledger.models import Account, TransactionLine
+from ledger.profit_loss import ProfitLoss
+from ledger.totals import CENTS_ENGINE, DECIMAL_ENGINE, cents_to_decimal, get_account_totals, get_subtree_totals, \
+    roll_up_totals
+
+
+class EngineTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ledgers = SyntheticLedgerGenerator(nr_contacts=5).generate([2018, 2019], 2000)
+
+    def setUp(self):
+        get_report_cache().clear()
+        self.addCleanup(get_report_cache().clear)
+
+    def get_reports(self, engine):
+        with override_settings(REPORT_ENGINE=engine):
+            get_report_cache().clear()
+            balances = [Balance(datetime.date(2019, 12, 31)), Balance(datetime.date(2019, 6, 30),
+                                                                       start_date=datetime.date(2018, 3, 15))]
+            balances += BalanceSeries(get_month_ends(2018) + get_month_ends(2019)).balances
+            profit_losses = [ProfitLoss(ledger) for ledger in self.ledgers]
+        return ([[(item.account.pk, item.value) for item in balance.debit_balance_items + balance.credit_balance_items]
+                 for balance in balances],
+                [[(line.account.pk, line.debit, line.credit) for line in profit_loss.profit_loss_lines]
+                 + [profit_loss.total.debit, profit_loss.total.credit] for profit_loss in profit_losses])
+
+    def test_that_cents_engine_equals_decimal_engine(self):
+        self.assertEqual(self.get_reports(DECIMAL_ENGINE), self.get_reports(CENTS_ENGINE))
+
+    def test_that_cents_engine_sums_in_one_query(self):
+        lines = self.ledgers[0].transaction_lines.all()
+        with override_settings(REPORT_ENGINE=CENTS_ENGINE), self.assertNumQueries(1):
+            totals = get_account_totals(lines)
+        debit_sum = sum(debit for debit, _ in totals.values())
+        self.assertEqual(sum(transaction.amount for transaction in self.ledgers[0].transactions.all()), debit_sum)
+        self.assertEqual(debit_sum, sum(credit for _, credit in totals.values()))
+
+    def test_that_reports_of_both_engines_have_amounts_in_cents(self):
+        for engine in (DECIMAL_ENGINE, CENTS_ENGINE):
+            balances, profit_losses = self.get_reports(engine)
+            amounts = [value for balance in balances for _, value in balance] + \
+                      [amount for profit_loss in profit_losses for _, debit, credit in profit_loss[:-2]
+                       for amount in (debit, credit) if amount is not None]
+            self.assertSetEqual({-2}, {amount.as_tuple().exponent for amount in amounts}, engine)
+
+    def test_that_cents_are_converted_to_decimals_with_two_decimal_places(self):
+        self.assertEqual(Decimal('12.34'), cents_to_decimal(1234))
+        self.assertEqual('-0.05', str(cents_to_decimal(-5)))
+
+
+class HierarchyTestCase(TransactionRequiringMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.assets = cls.create_group('1', 'Assets', Account.BALANCE, Account.DEBIT, [cls.bank])
+        cls.liabilities = cls.create_group('2', 'Liabilities', Account.BALANCE, Account.CREDIT, [])
+        cls.creditors = cls.create_group('20', 'Creditors', Account.BALANCE, Account.CREDIT,
+                                         [cls.creditor_owner, cls.creditor_accountant], parent=cls.liabilities)
+        cls.revenues = cls.create_group('4', 'Revenues', Account.PROFIT_LOSS, Account.CREDIT, [cls.sales])
+        cls.costs = cls.create_group('5', 'Costs', Account.PROFIT_LOSS, Account.DEBIT, [cls.administration])
+
+    @classmethod
+    def create_group(cls, code, name, account_type, debit_type, accounts, parent=None):
+        group = Account.objects.create(chart=cls.chart, code=code, name=name, type=account_type,
+                                       debit_type=debit_type, parent=parent)
+        for account in accounts:
+            account.parent = group
+            account.save()
+        return group
+
+    def test_that_totals_are_rolled_up_in_one_pass(self):
+        accounts = [Account(pk=1, path='/1/'), Account(pk=2, path='/1/10/', parent_id=1),
+                    Account(pk=3, path='/1/10/100/', parent_id=2), Account(pk=4, path='/1/11/', parent_id=1)]
+        totals = {1: (1, 0), 2: (0, 2), 3: (4, 0), 4: (8, 0)}
+        self.assertDictEqual({1: (13, 2), 2: (4, 2), 3: (4, 0), 4: (8, 0)}, roll_up_totals(totals, accounts))
+        self.assertDictEqual({1: (1, 0), 2: (4, 2), 4: (8, 0)}, roll_up_totals(totals, accounts, depth=1))
+        self.assertDictEqual({1: (13, 2)}, roll_up_totals(totals, accounts, depth=0))
+
+    def test_that_subtree_totals_are_summed_in_one_query(self):
+        with self.assertNumQueries(1):
+            totals = get_subtree_totals(self.liabilities, lines=TransactionLine.objects.all())
+        self.assertEqual((Decimal(200), Decimal(1300)), totals)
+
+    def test_that_balance_is_reported_at_depth(self):
+        def get_items(balance):
+            return ([(item.account.code, item.value) for item in balance.debit_balance_items],
+                    [(item.account.code, item.value) for item in balance.credit_balance_items])
+
+        end_of_year = datetime.date(self.year, 12, 31)
+        self.assertEqual(([('1', 1200)], [('2', 1100), ('1900', 100)]), get_items(Balance(end_of_year, depth=0)))
+        self.assertEqual(([('1010', 1200)], [('20', 1100), ('1900', 100)]), get_items(Balance(end_of_year, depth=1)))
+        self.assertEqual(([('1010', 1200)], [('2010', 1000), ('2011', 100), ('1900', 100)]),
+                         get_items(Balance(end_of_year)))
+
+    def test_that_profit_loss_is_reported_at_depth(self):
+        profit_loss = ProfitLoss(self.ledger, depth=0)
+        self.assertListEqual([('4', 400, None), ('5', None, 300)],
+                             [(line.account.code, line.debit, line.credit) for line in profit_loss.profit_loss_lines])
+        self.assertEqual(100, profit_loss.total.debit)
@@ -0,0 +1,241 @@
+import decimal
+from decimal import Decimal
+
+import datetime
+from django.conf import settings
+from django.db import connections
+from django.db.models import BigIntegerField, Expression, F, Q, QuerySet, Sum
+from django.db.models.functions import Cast, Round
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from ledger.models import Account, TransactionLine
+
+AccountTotals = Dict[int, Tuple[Decimal, Decimal]]
+DailyAccountTotals = Dict[datetime.date, AccountTotals]
+
+ZERO = Decimal(0)
+CENT = Decimal('.01')
+
+# Engines that sum the amounts of the reports, chosen with settings.REPORT_ENGINE. The engine 'decimal' sums the
+# amounts as decimals. The engine 'cents' sums them as integer numbers of cents, which is exact on every database,
+# and only converts the sum of every account to a decimal.
+DECIMAL_ENGINE = 'decimal'
+CENTS_ENGINE = 'cents'
+ENGINES = (DECIMAL_ENGINE, CENTS_ENGINE)
+
+
+def account_totals_queryset(lines: Optional[QuerySet] = None,
+                            period_totals: Optional[QuerySet] = None, by_day: bool = False,
+                            in_cents: bool = False) -> QuerySet:
+    """
+    Build a single query that sums the given transaction lines and period totals per account
+
+    Each row holds an account, the sum of the amounts it was debited with and the sum of the amounts it was credited
+    with. An account appears in one row per source: the transaction lines, which are summed in one pass, and the
+    period totals. If by_day is set, the sums are split per day as well, in the column day. Period totals count on
+    the first day of their period. If in_cents is set, the sums are integer numbers of cents.
+    """
+
+    parts = _get_account_totals_parts(lines, period_totals, by_day, in_cents)
+    assert parts, 'Pass transaction lines, period totals or both'
+
+    first, *others = parts
+    return first.union(*others, all=True) if others else first
+
+
+def _get_account_totals_parts(lines: Optional[QuerySet], period_totals: Optional[QuerySet], by_day: bool,
+                              in_cents: bool) -> List[QuerySet]:
+    """
+    Return the parts of the query of account_totals_queryset, one for every given source
+    """
+
+    amount_sum = _sum_cents if in_cents else Sum
+    # All parts must select the same columns in the same order, which are account and day
+    line_day = {'day': F('date')} if by_day else {}
+    period_day = {'day': F('period')} if by_day else {}
+    parts = []
+    if lines is not None:
+        # Clear the default ordering, since it is not allowed in the parts of a compound statement
+        lines = lines.order_by()
+        parts.append(lines.values('account', **line_day)
+                     .annotate(debit=TransactionLine.debit_sum(amount_sum),
+                               credit=TransactionLine.credit_sum(amount_sum)))
+    if period_totals is not None:
+        period_totals = period_totals.order_by()
+        parts.append(period_totals.values('account', **period_day)
+                     .annotate(debit=amount_sum('debit'), credit=amount_sum('credit')))
+    return parts
+
+
+def get_account_totals(lines: Optional[QuerySet] = None,
+                       period_totals: Optional[QuerySet] = None) -> AccountTotals:
+    """
+    Return the debit sum and credit sum of the given transaction lines and period totals per account
+
+    :param lines: TransactionLines to sum
+    :param period_totals: AccountPeriodTotals to sum
+    :return: Dictionary from account primary key to a tuple (debit sum, credit sum)
+    """
+
+    return _sum_rows(lines, period_totals, by_day=False, get_key=lambda row: row['account'])
+
+
+def get_daily_account_totals(lines: Optional[QuerySet] = None,
+                             period_totals: Optional[QuerySet] = None) -> DailyAccountTotals:
+    """
+    Return the debit sum and credit sum of the given transaction lines and period totals per day and per account
+
+    :param lines: TransactionLines to sum
+    :param period_totals: AccountPeriodTotals to sum, which count on the first day of their period
+    :return: Dictionary from day to a dictionary from account primary key to a tuple (debit sum, credit sum)
+    """
+
+    daily_totals = {}
+    totals = _sum_rows(lines, period_totals, by_day=True, get_key=lambda row: (row['day'], row['account']))
+    for (day, account), sums in totals.items():
+        daily_totals.setdefault(day, {})[account] = sums
+    return daily_totals
+
+
+def get_running_account_totals(*sources: Tuple[Optional[QuerySet], Optional[QuerySet]]) -> DailyAccountTotals:
+    """
+    Return the running debit sum and credit sum of every account at the end of every day on which it changed
+
+    The given sources are summed per day and per account in one query, in which the database adds up the daily sums
+    in order of day with window functions. The totals of all accounts on a date are the latest running sums of each
+    account up to that date, so they do not have to be added up again.
+
+    :param sources: Pairs of transaction lines and period totals, either of which can be None, that do not overlap
+    :return: Dictionary from day to a dictionary from account primary key to a tuple (running debit sum, running
+             credit sum), for the accounts that changed on that day
+    """
+
+    in_cents = settings.REPORT_ENGINE == CENTS_ENGINE
+    parts = [part for lines, period_totals in sources
+             for part in _get_account_totals_parts(lines, period_totals, by_day=True, in_cents=in_cents)]
+    assert parts, 'Pass at least one source'
+    first, *others = parts
+    daily_sums = first.union(*others, all=True) if others else first
+
+    connection = connections[daily_sums.db]
+    account, day, debit, credit = (connection.ops.quote_name(name) for name in ('account', 'day', 'debit', 'credit'))
+    sql, params = daily_sums.query.sql_with_params()
+    running_sql = 'SELECT {account}, {day}, SUM(SUM({debit})) OVER running, SUM(SUM({credit})) OVER running ' \
+                  'FROM ({sql}) daily_sums GROUP BY {account}, {day} ' \
+                  'WINDOW running AS (PARTITION BY {account} ORDER BY {day})' \
+        .format(account=account, day=day, debit=debit, credit=credit, sql=sql)
+    to_amount = (lambda value: cents_to_decimal(int(value or 0))) if in_cents else _to_decimal
+
+    running_totals = {}
+    with connection.cursor() as cursor:
+        # The query is raw SQL, so the values are converted here, like Django does for the other queries
+        cursor.execute(running_sql, params)
+        for row_account, row_day, row_debit, row_credit in cursor.fetchall():
+            if isinstance(row_day, str):
+                row_day = datetime.date.fromisoformat(row_day)
+            running_totals.setdefault(row_day, {})[row_account] = (to_amount(row_debit), to_amount(row_credit))
+    return running_totals
+
+
+def get_subtree_totals(account: Account, lines: Optional[QuerySet] = None,
+                       period_totals: Optional[QuerySet] = None) -> Tuple[Decimal, Decimal]:
+    """
+    Return the debit sum and credit sum of the given transaction lines and period totals of the given account and all
+    accounts below it
+
+    The accounts of the subtree are selected with a range condition on their path, in the same query as the sums.
+    """
+
+    low, high = account.get_subtree_range()
+    in_subtree = {'account__path__gte': low, 'account__path__lt': high}
+    totals = get_account_totals(lines.filter(**in_subtree) if lines is not None else None,
+                                period_totals.filter(**in_subtree) if period_totals is not None else None)
+    return sum((debit for debit, _ in totals.values()), ZERO), sum((credit for _, credit in totals.values()), ZERO)
+
+
+def roll_up_totals(totals: AccountTotals, accounts: Iterable[Account], depth: Optional[int] = None) -> AccountTotals:
+    """
+    Add the debit sum and credit sum of every account to the group it belongs to, bottom-up in one pass
+
+    The accounts are visited in reverse order of their path, so every account below a group is visited before the
+    group itself, and its totals already hold the totals of the accounts below it when they are added to the group.
+
+    :param totals: Debit sum and credit sum per account, see get_account_totals
+    :param accounts: Accounts of the totals, including all groups they belong to
+    :param depth: Without a depth, every account gets the totals of its whole subtree. With a depth, the accounts
+                  below that depth are folded into their group at that depth and left out, so the accounts at that
+                  depth get the totals of their subtree and the accounts above it keep their own totals.
+    :return: Dictionary from account primary key to a tuple (debit sum, credit sum)
+    """
+
+    rolled_up = dict(totals)
+    for account in sorted(accounts, key=lambda account: account.path, reverse=True):
+        if account.parent_id is None or account.pk not in rolled_up:
+            continue
+        if depth is None:
+            debit, credit = rolled_up[account.pk]
+        elif account.depth > depth:
+            debit, credit = rolled_up.pop(account.pk)
+        else:
+            continue
+        group_debit, group_credit = rolled_up.get(account.parent_id, (ZERO, ZERO))
+        rolled_up[account.parent_id] = (group_debit + debit, group_credit + credit)
+    return rolled_up
+
+
+def cents_to_decimal(cents: int) -> Decimal:
+    """
+    Return the given number of cents as a decimal amount with two decimal places
+    """
+
+    return Decimal(cents).scaleb(-2)
+
+
+def _sum_cents(amount: Union[str, Expression], filter: Optional[Q] = None) -> Sum:
+    """
+    Return an aggregate that sums the given decimal field or expression as integer numbers of cents, with the same
+    signature as Sum
+    """
+
+    if isinstance(amount, str):
+        amount = F(amount)
+    return Sum(Cast(Round(amount * 100), output_field=BigIntegerField()), filter=filter)
+
+
+def _to_decimal(value: Union[Decimal, float, int, None]) -> Decimal:
+    """
+    Return a sum that is read with raw SQL as a decimal, where SQLite returns sums of decimals as floats
+    """
+
+    if value is None:
+        return ZERO
+    if isinstance(value, float):
+        return decimal.Context(prec=15).create_decimal_from_float(value).quantize(CENT)
+    # SQLite returns sums of whole amounts as integers
+    return Decimal(value).quantize(CENT)
+
+
+def _sum_rows(lines: Optional[QuerySet], period_totals: Optional[QuerySet], by_day: bool,
+              get_key: Callable[[Dict], Hashable]) -> Dict[Hashable, Tuple[Decimal, Decimal]]:
+    """
+    Sum the rows of account_totals_queryset with the same key, with the engine of the settings
+    """
+
+    in_cents = settings.REPORT_ENGINE == CENTS_ENGINE
+    rows = account_totals_queryset(lines, period_totals, by_day=by_day, in_cents=in_cents)
+    if not in_cents:
+        totals = {}
+        for row in rows:
+            key = get_key(row)
+            debit, credit = totals.get(key, (ZERO, ZERO))
+            totals[key] = (debit + (row['debit'] or ZERO), credit + (row['credit'] or ZERO))
+        # SQLite sums decimals as floats, so the sums are rounded once here instead of in every report line
+        return {key: (debit.quantize(CENT), credit.quantize(CENT)) for key, (debit, credit) in totals.items()}
+
+    cents = {}
+    for row in rows:
+        key = get_key(row)
+        debit, credit = cents.get(key, (0, 0))
+        cents[key] = (debit + int(row['debit'] or 0), credit + int(row['credit'] or 0))
+    # Decimals are only created for the sums, not for every row
+    return {key: (cents_to_decimal(debit), cents_to_decimal(credit)) for key, (debit, credit) in cents.items()}